@@ -3,13 +3,15 @@
 
 import numpy as np
 from core.evolution import population, agents
-from core.utils import utils
+from core.utils import utils, rollout
 import os, gc, json
 
 class BaseBaseline(object):
   """
   This is the base baseline from where to create all the other ones
   """
+  render_rollouts = False # If true the final frame of each rollout is rendered
+
   # ---------------------------------------------------
   def __init__(self, env, parameters):
     """
@@ -24,7 +26,7 @@ class BaseBaseline(object):
     self.agents_shapes = self.params.agent_shapes
     self.agent_name = self.params.qd_agent
 
-    self.logs = utils.Logger({'Generation': [], 'Avg gen surprise': [], 'Max reward': [], 'Archive size': [], 'Coverage': []})
+    self.logs = utils.Logger({'Generation': [], 'Avg gen surprise': [], 'Max reward': [], 'Archive size': [], 'Coverage': [], 'Rollout cache hits': [], 'Rollout cache misses': []})
 
     if self.agent_name == 'Neural':
       self.agent_type = agents.FFNeuralAgent
@@ -41,7 +43,17 @@ class BaseBaseline(object):
                                            pop_size=0)
 
     self.opt = self.params.optimizer(self.population, archive=self.archive, mutation_rate=self.params.mutation_rate,
-                                     metric_update_interval=self.params.update_interval)
+                                     metric_update_interval=self.params.update_interval,
+                                     novelty_index=self.params.novelty_index,
+                                     novelty_index_params=self.params.novelty_index_params)
+
+    # Workers used to evaluate the agents
+    self.rollouts = rollout.RolloutPool(self.env, self.params.env_tag, self.agent_type, self.agents_shapes,
+                                        self.params.max_episode_len, seed=self.params.seed,
+                                        workers=self.params.rollout_workers, render=self.render_rollouts,
+                                        vec_env=rollout.make_vec_env(self.params.env_tag, self.params.lockstep_envs,
+                                                                       self.params.env_kwargs),
+                                        cache_size=self.params.rollout_cache_size, env_kwargs=self.params.env_kwargs)
 
     self.END = False
     self.elapsed_gen = 0
@@ -50,8 +62,30 @@ class BaseBaseline(object):
   # ---------------------------------------------------
   def evaluate_agent(self, agent):
     """
-    Evaluates the agent. This one needs to be reimplemented. It raises a NotImplementedError
-    :param agent:
+    Evaluates the agent in the environment.
+    :param agent: agent to evaluate
+    :return:
+    """
+    return self.process_rollout(agent, self.rollouts.evaluate([agent['agent']], [agent['name']])[0])
+
+  def evaluate_population(self, rows=None):
+    """
+    Evaluates the agents of the population, in parallel
+    :param rows: Indexes of the agents to evaluate. If None all the agents are evaluated
+    """
+    if rows is None:
+      rows = range(self.population.size)
+    pop = [self.population[idx] for idx in rows]
+    results = self.rollouts.evaluate([agent['agent'] for agent in pop], [agent['name'] for agent in pop])
+    for agent, result in zip(pop, results):
+      self.process_rollout(agent, result)
+
+  def process_rollout(self, agent, result):
+    """
+    Sets the data of the agent from the result of its rollout. This one needs to be reimplemented. It raises a
+    NotImplementedError
+    :param agent: evaluated agent
+    :param result: result of the rollout
     :return:
     """
     raise NotImplementedError
@@ -66,10 +100,9 @@ class BaseBaseline(object):
     """
     for self.elapsed_gen in range(steps):
       # Evaluate all the agents
-      for agent in self.population:
-        self.evaluate_agent(agent)
+      self.evaluate_population()
 
-      max_rew = np.max(self.population['reward'].values)
+      max_rew = np.max(self.population['reward'])
       self.opt.step() # Perform optimization step, updating the archive and the population
 
       # Every 10 generation print an overview of the process, save a checkpoint and perform garbage collection
@@ -78,6 +111,8 @@ class BaseBaseline(object):
         print('Seed {} - Generation {}'.format(self.params.seed, self.elapsed_gen))
         if self.archive is not None:
           print('Seed {} - Archive size {}'.format(self.params.seed, self.archive.size))
+          if self.opt.archive_index.approximate:
+            print('Seed {} - Novelty k-NN recall {}'.format(self.params.seed, self.opt.novelty_recall()))
         print('Seed {} - Max reward {}'.format(self.params.seed, max_rew))
         print('Saving checkpoint...')
         self.save(ckpt=True)
@@ -85,7 +120,7 @@ class BaseBaseline(object):
         print()
 
       if self.archive is not None:
-        bs_points = np.stack(self.archive['bs'].to_list())
+        bs_points = np.stack(self.archive['bs'])
       else:
         bs_points = np.concatenate([a['bs'] for a in self.population if a['bs'] is not None])
       if 'Ant' in self.params.env_tag:
@@ -107,9 +142,13 @@ class BaseBaseline(object):
       self.logs.register_log('Max reward', max_rew)
       self.logs.register_log('Archive size', self.archive.size)
       self.logs.register_log('Coverage', coverage)
+      cache_hits, cache_misses = self.rollouts.cache_stats
+      self.logs.register_log('Rollout cache hits', cache_hits)
+      self.logs.register_log('Rollout cache misses', cache_misses)
       if self.END:
         print('Seed {} - Quitting.'.format(self.params.seed))
         break
+    self.rollouts.close()
     gc.collect()
     # ---------------------------------------------------
 
@@ -128,7 +167,10 @@ class BaseBaseline(object):
         print('Seed {} - Cannot create save folder.'.format(self.params.seeds))
     self.population.save_pop(save_subf, 'pop')
     if self.archive is not None:
-      self.archive.save_pop(save_subf, 'archive')
+      if ckpt: # Only the archive agents added since the last checkpoint are saved
+        self.archive.save_pop_incremental(save_subf, 'archive', self.elapsed_gen)
+      else:
+        self.archive.save_pop(save_subf, 'archive')
 
     self.logs.save(self.save_path)
     print('Seed {} - Done'.format(self.params.seed))
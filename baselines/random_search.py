@@ -23,53 +23,33 @@ class RandomSearch(BaseBaseline):
                                            shapes=self.agents_shapes,
                                            pop_size=0)
     self.opt = self.params.optimizer(self.population, archive=self.archive, mutation_rate=self.params.mutation_rate,
-                                     metric_update_interval=self.params.update_interval)
+                                     metric_update_interval=self.params.update_interval,
+                                     novelty_index=self.params.novelty_index,
+                                     novelty_index_params=self.params.novelty_index_params)
   # ---------------------------------------------------
 
   # ---------------------------------------------------
-  def evaluate_agent(self, agent):
+  def process_rollout(self, agent, result):
     """
-    This function evaluates the agent in the environment. This function should be run in parallel
-    :param agent: agent to evaluate
+    Sets the data of the agent from the result of its rollout
+    :param agent: evaluated agent
+    :param result: result of the rollout
     :return:
     """
-    done = False
-    cumulated_reward = 0
-
-    obs = self.env.reset()
-    t = 0
-    while not done:
-      if 'FastsimSimpleNavigation' in self.params.env_tag:
-        agent_input = [t/self.params.max_episode_len, obs] # Observation and time. The time is used to see when to stop the action. TODO move the action stopping outside of the agent
-      elif 'Ant' in self.params.env_tag:
-        agent_input = [t]
-      else:
-        agent_input = [t/self.params.max_episode_len]
-      action = utils.action_formatting(self.params.env_tag, agent['agent'](agent_input))
-
-      obs, reward, done, info = self.env.step(action)
-      t += 1
-      cumulated_reward += reward
-
-      if  t >= self.params.max_episode_len:
-        done = True
-
-      if 'Ant' in self.params.env_tag:
-        CoM = np.array([self.env.robot.body_xyz[:2]])
-        if np.any(np.abs(CoM) >= np.array([3, 3])):
-          done = True
-
-    agent['bs'] = utils.extact_hd_bs(self.env, obs, reward, done, info)
-    agent['reward'] = cumulated_reward
-
+    agent['bs'] = result['bs']
+    agent['reward'] = result['reward']
     agent['features'] = [None, None] # RS does not uses any features cuz it does not do any evolution
-    return cumulated_reward
+    return result['reward']
   # ---------------------------------------------------
 
   # ---------------------------------------------------
   def train(self, *args, **kwargs):
+    # The agents are evaluated in chunks, so that the evaluation stops as soon as END is set. A chunk is big enough to
+    # keep all the rollout workers, or all the lockstep tables, busy.
+    chunk = max(5, self.params.rollout_workers, self.params.lockstep_envs)
     for idx, agent in enumerate(self.population):
-      self.evaluate_agent(agent)
+      if idx % chunk == 0:
+        self.evaluate_population(range(idx, min(idx + chunk, self.population.size)))
       self.archive.add(self.population.copy(idx, with_data=True))
       if idx % 100 == 0:
         gc.collect()
@@ -80,7 +60,7 @@ class RandomSearch(BaseBaseline):
       if (idx + 1) % 5 == 0 and idx != 0:
         self.elapsed_gen += 1
 
-        bs_points = np.concatenate(self.archive['bs'].values)
+        bs_points = np.concatenate(self.archive['bs'])
         if 'Ant' in self.params.env_tag:
           u_limit = 3.5
           l_limit = -u_limit
@@ -91,7 +71,7 @@ class RandomSearch(BaseBaseline):
           u_limit = 1.35
           l_limit = -u_limit
 
-        max_rew = np.max(self.archive['reward'].values)
+        max_rew = np.max(self.archive['reward'])
         coverage = utils.show(bs_points, filepath=self.save_path,
                               info={'gen': self.elapsed_gen, 'seed': self.params.seed},
                               upper_limit=u_limit, lower_limit=l_limit)
@@ -105,5 +85,6 @@ class RandomSearch(BaseBaseline):
         print('Seed {} - Quitting.'.format(self.params.seed))
         break
 
+    self.rollouts.close()
     gc.collect()
   # ---------------------------------------------------
@@ -2,11 +2,31 @@ import numpy as np
 from core.evolution import genome
 from copy import deepcopy
 
+# ---------------------------------------------------------------------------
+def mutate_flat_genomes(genomes, mutation_spec, mutation_operator):
+  """
+  Mutates in place a matrix of flat genomes. Each element is perturbed with the mutation operator with the probability
+  given by the mutation spec and then clipped in its limits. All the random numbers are drawn in one call each.
+  :param genomes: [agents, genome_len] array of flat genomes
+  :param mutation_spec: (probability, lower limits, upper limits) arrays of length genome_len
+  :param mutation_operator: Function that given a shape returns the noise to add to the genomes
+  """
+  prob, low, high = mutation_spec
+  mutation_selection = np.random.uniform(size=genomes.shape) <= prob
+  genomes += mutation_operator(*genomes.shape) * mutation_selection
+  np.clip(genomes, low, high, out=genomes)
+# ---------------------------------------------------------------------------
+
 # ---------------------------------------------------------------------------
 class BaseAgent(object):
   """
-  This class defines the base agent from which other agents should inherit
+  This class defines the base agent from which other agents should inherit.
+  All the parameters of the genome are stored in a single contiguous array, the flat genome. The elements of the genome
+  and the action length are views into it, so that mutating, copying and saving an agent are single array operations.
   """
+  action_len_mutation = (1., 0., 1.) # Mutation probability, lower and upper limit of the action length
+  open_loop = False # If True the output depends only on the time and the agent can be evaluated with trajectory
+
   # ---------------------------------
   def __init__(self, mutation_distr=None, **kwargs):
     """
@@ -24,8 +44,11 @@ class BaseAgent(object):
       self.mutation_operator = normal
     else:
       self.mutation_operator = mutation_distr
+    self._trajectory = None # Cached (inputs, flat genome, actions) of the last trajectory
+    self._action_len = np.zeros(())
     self.action_len = 0.
     self._genome = []
+    self._flat_genome = None
   # ---------------------------------
 
   # ---------------------------------
@@ -59,22 +82,123 @@ class BaseAgent(object):
     return gen
   # ---------------------------------
 
+  # ---------------------------------
+  @property
+  def flat_genome(self):
+    """
+    Contiguous array containing all the parameters of the genome, with the action length as last element.
+    The genome elements are views into this array, so modifying it modifies the agent.
+    """
+    return self._flat_genome
+
+  def load_flat_genome(self, flat_genome):
+    """
+    Loads a flat genome into the agent
+    :param flat_genome: Array of the same length of self.flat_genome
+    """
+    assert np.shape(flat_genome) == self._flat_genome.shape, 'Wrong flat genome shape. Given {}, needed {}'.format(np.shape(flat_genome), self._flat_genome.shape)
+    self._flat_genome[:] = flat_genome
+    self._trajectory = None
+  # ---------------------------------
+
+  # ---------------------------------
+  def _build_flat_genome(self):
+    """
+    Allocates the flat genome and moves the genome elements and the action length into it.
+    Needs to be called by the inheriting classes once the genome has been created.
+    """
+    self._flat_genome = np.empty(sum(l.size for l in self._genome) + 1)
+    self._bind_genome(load=True)
+    self.mutation_spec = self._mutation_spec()
+
+  def _bind_genome(self, load=False):
+    """
+    Makes the genome elements views of the flat genome
+    :param load: If True, the current values of the genome elements are copied in the flat genome
+    """
+    offset = 0
+    for l in self._genome:
+      l.bind(self._flat_genome[offset:offset + l.size], load=load)
+      offset += l.size
+    action_len = self._flat_genome[-1:].reshape(())
+    if load:
+      action_len[...] = self._action_len
+    self._action_len = action_len
+  # ---------------------------------
+
+  # ---------------------------------
+  def _param_mutation(self, layer, param):
+    """
+    Mutation probability and limits of a parameter of a genome element.
+    :param layer: Genome element
+    :param param: Name of the parameter
+    :return: (probability, lower limit, upper limit)
+    """
+    low, high = layer.bounds.get(param, (-np.inf, np.inf))
+    return 1., low, high
+
+  def _mutation_spec(self):
+    """
+    Creates the arrays with the mutation probability and limits of each element of the flat genome.
+    :return: (probability, lower limits, upper limits) arrays
+    """
+    spec = []
+    for l in self._genome:
+      for p in l.param_names:
+        spec.append(np.tile(self._param_mutation(l, p), (np.size(getattr(l, p)), 1)))
+    spec.append(np.array([self.action_len_mutation]))
+    spec = np.concatenate(spec).T.copy()
+    spec.flags.writeable = False
+    return spec[0], spec[1], spec[2]
+  # ---------------------------------
+
   # ---------------------------------
   @property
   def action_len(self):
     """
     Length of the agent actions.
     """
-    return self._action_len
+    return self._action_len[()]
 
   @action_len.setter
   def action_len(self, l):
-    if l < 0.:
-      self._action_len = 0.
-    elif l > 1.:
-      self._action_len = 1.
-    else:
-      self._action_len = l
+    self._action_len[...] = np.clip(l, 0., 1.)
+    self._trajectory = None
+  # ---------------------------------
+
+  # ---------------------------------
+  def trajectory(self, inputs):
+    """
+    Evaluates the agent on a whole sequence of inputs at once. Only for open loop agents, whose output depends only on
+    the time. The result is cached until the inputs or the genome change.
+    :param inputs: [T] array of inputs of the agent
+    :return: Read-only [T, output size] array with the outputs of the agent
+    """
+    inputs = np.asarray(inputs, dtype=np.float64)
+    cached = self._trajectory
+    if cached is None or not (np.array_equal(cached[0], inputs) and np.array_equal(cached[1], self._flat_genome)):
+      actions = self._evaluate_trajectory(inputs)
+      actions.flags.writeable = False
+      cached = (inputs.copy(), self._flat_genome.copy(), actions)
+      self._trajectory = cached
+    return cached[2]
+
+  def actuation_steps(self, inputs):
+    """
+    Number of steps after which all the outputs of the trajectory are zero. Past it the agent performs no further
+    actions, so the env can end the episode as soon as the scene is at rest.
+    :param inputs: [T] array of inputs of the agent
+    :return: The number of steps
+    """
+    active = np.flatnonzero(np.any(self.trajectory(inputs) != 0, axis=1))
+    return active[-1] + 1 if len(active) else 0
+
+  def _evaluate_trajectory(self, inputs):
+    """
+    Vectorized evaluation of the agent over the inputs. Needs to be implemented by open loop agents
+    :param inputs: [T] array of inputs of the agent
+    """
+    raise NotImplementedError
   # ---------------------------------
 
   # ---------------------------------
@@ -85,13 +209,45 @@ class BaseAgent(object):
     raise NotImplementedError
   # ---------------------------------
 
+  # ---------------------------------
+  def _mutate_flat_genome(self):
+    """
+    Mutates the whole flat genome at once. Each element is perturbed with the mutation operator with the probability
+    given by the mutation spec and then clipped in its limits.
+    """
+    mutate_flat_genomes(self._flat_genome[None], self.mutation_spec, self.mutation_operator)
+    self._trajectory = None
+  # ---------------------------------
+
   # ---------------------------------
   def copy(self):
     """
-    Performs a deep copy of the agent
+    Copies the agent. Only the flat genome is copied; the genome elements of the copy are rebound to it.
     :return: A copy of the agent
     """
-    return deepcopy(self)
+    if self._flat_genome is None:
+      return deepcopy(self)
+    agent = self.__class__.__new__(self.__class__)
+    agent.__dict__.update(self.__dict__)
+    agent._genome = [l.__class__.__new__(l.__class__) for l in self._genome]
+    for new, old in zip(agent._genome, self._genome):
+      for attr in old.__slots__:
+        setattr(new, attr, getattr(old, attr))
+    agent._flat_genome = self._flat_genome.copy()
+    agent._bind_genome(load=False)
+    return agent
+  # ---------------------------------
+
+  # ---------------------------------
+  def __setstate__(self, state):
+    """
+    Used by pickle and deepcopy. Rebinds the genome elements to the flat genome, given that the views are copied as
+    separate arrays.
+    :param state: State of the agent
+    """
+    self.__dict__.update(state)
+    if self._flat_genome is not None:
+      self._bind_genome(load=False)
   # ---------------------------------
 
   # ---------------------------------
@@ -111,6 +267,8 @@ class FFNeuralAgent(BaseAgent):
   """
   This agent implements a small feedforward neural network agent.
   """
+  action_len_mutation = (1., .5, 1.)
+
   # ---------------------------------
   def __init__(self, shapes, mutation_distr=None):
     """
@@ -129,16 +287,17 @@ class FFNeuralAgent(BaseAgent):
     self.action_len = np.random.uniform(0.5, 1)
     self._genome = [genome.FCLayer(self.input_shape, 5, 'fc1', bias=self.use_bias),
                     genome.FCLayer(5, self.output_shape, 'fc2', bias=self.use_bias)]
+    self._build_flat_genome()
   # ---------------------------------
 
   # ---------------------------------
-  def evaluate(self, t, obs):
+  def evaluate(self, t, obs=None):
     """
     Evaluate agent.
     :param t: Time step
-    :param obs: Observation
+    :param obs: Observation. If None the time is the only input of the network (e.g. in the Billiard)
     """
-    output = obs
+    output = obs if obs is not None else t
     if not len(np.shape(output)) > 1:
       output = np.array([output])
 
@@ -152,7 +311,8 @@ class FFNeuralAgent(BaseAgent):
   # ---------------------------------
 
   # ---------------------------------
-  def sigmoid(self, x):
+  @staticmethod
+  def sigmoid(x):
     """
     Sigmoid function
     :param x: Input
@@ -164,25 +324,25 @@ class FFNeuralAgent(BaseAgent):
   def mutate(self):
     """
     Mutates the genome of the agent. It does not return anything. The mutation is internal.
+    Each weight and bias is mutated with probability 0.2, the weights are limited in [-5, 5] and the action length in
+    [0.5, 1].
     """
-    for l in self._genome:
-      self._mutate_layer(l)
-    self.action_len = np.clip(self.action_len + self.mutation_operator(), a_min=0.5, a_max=1)
+    self._mutate_flat_genome()
   # ---------------------------------
 
   # ---------------------------------
-  def _mutate_layer(self, layer):
+  def _param_mutation(self, layer, param):
     """
-    Mutates single layer of the network
-    :param layer: Layer to mutate
+    Mutation probability and limits of the parameters of the layers of the network
+    :param layer: Layer
+    :param param: Name of the parameter
+    :return: (probability, lower limit, upper limit)
     """
-    mutation_selection = np.array(np.random.uniform(size=(layer.w.shape[0], layer.w.shape[1]))<= 0.2).astype(int)
-    layer.w += self.mutation_operator(layer.w.shape[0], layer.w.shape[1]) * mutation_selection
-    layer.w = np.clip(layer.w, a_min=-5, a_max=5)
-
-    if self.use_bias:
-      mutation_selection = np.array(np.random.uniform(size=(layer.bias.shape[0], layer.bias.shape[1]))<= 0.2).astype(int)
-      layer.bias += self.mutation_operator(layer.bias.shape[0], layer.bias.shape[1]) * mutation_selection
+    if param == 'w':
+      return .2, -5., 5.
+    elif param == 'bias' and self.use_bias:
+      return .2, -np.inf, np.inf
+    return 0., -np.inf, np.inf
   # ---------------------------------
 
   # ---------------------------------
@@ -197,7 +357,74 @@ class FFNeuralAgent(BaseAgent):
     for p, g in zip(params[:-1], self._genome):
       assert np.all(np.shape(g.w) == np.shape(p['w'])), 'Wrong shape of weight for layer {} of agent {}'.format(self.name, agent_name)
       assert np.all(np.shape(g.bias) == np.shape(p['bias'])), 'Wrong shape of bias for layer {} of agent {}'.format(self.name, agent_name)
-      g.load(deepcopy(p))
+      g.load(p)
+  # ---------------------------------
+# ---------------------------------------------------------------------------
+
+# ---------------------------------------------------------------------------
+class FFNeuralPopulation(object):
+  """
+  Evaluates a whole population of FFNeuralAgents at once. The weights of the agents are stacked in [P, in, out]
+  tensors, so that the actions of all the agents for a timestep are calculated with one batched matmul per layer.
+  The weights are copied from the agents: if the agents change, the population has to be loaded again.
+  """
+  # ---------------------------------
+  def __init__(self, agents):
+    """
+    Constructor
+    :param agents: List of FFNeuralAgents with the same shapes
+    """
+    self.load(agents)
+  # ---------------------------------
+
+  # ---------------------------------
+  def load(self, agents):
+    """
+    Stacks the genomes of the agents
+    :param agents: List of FFNeuralAgents with the same shapes
+    """
+    genomes = np.stack([agent.flat_genome for agent in agents])
+    self.size = len(agents)
+    self.layers = []
+    offset = 0
+    for l in agents[0]._genome:
+      params = []
+      for p in l.param_names:
+        shape = np.shape(getattr(l, p))
+        size = int(np.prod(shape))
+        params.append(np.ascontiguousarray(genomes[:, offset:offset + size].reshape((self.size,) + shape)))
+        offset += size
+      self.layers.append(params)
+    self.action_len = genomes[:, -1]
+  # ---------------------------------
+
+  # ---------------------------------
+  def evaluate(self, t, obs=None):
+    """
+    Evaluates all the agents for one timestep
+    :param t: Time step, scalar or one per agent
+    :param obs: [P, input_shape] observations, one per agent. If None the time is the only input of the networks
+    :return: [P, output_shape] actions. The actions of the agents whose action length is over are 0
+    """
+    if obs is None:
+      obs = np.broadcast_to(t, self.size)
+    output = np.reshape(obs, (self.size, 1, -1))
+    for w, bias in self.layers[:-1]:
+      output = FFNeuralAgent.sigmoid(np.matmul(output, w) + bias)
+    w, bias = self.layers[-1]
+    output = np.tanh(np.matmul(output, w) + bias)[:, 0]
+    output[np.broadcast_to(t, self.size) > self.action_len] = 0.
+    return output
+  # ---------------------------------
+
+  # ---------------------------------
+  def __call__(self, *args):
+    """
+    Call function
+    :param x: Inputs of the agents, as (time, observations)
+    :return: Actions of the agents
+    """
+    return self.evaluate(*args[0])
   # ---------------------------------
 # ---------------------------------------------------------------------------
 
@@ -206,6 +433,9 @@ class DMPAgent(BaseAgent):
   """
   This class implements DMP agents
   """
+  open_loop = True
+  action_len_steps = 500. # Time steps corresponding to an action length of 1
+
   # ---------------------------------
   def __init__(self, shapes, mutation_distr=None):
     """
@@ -234,6 +464,7 @@ class DMPAgent(BaseAgent):
 
     for i in range(self.dof):
       self._genome.append(_dmp('dmp{}'.format(i), shapes['degree']))
+    self._build_flat_genome()
   # ---------------------------------
 
   # ---------------------------------
@@ -245,28 +476,32 @@ class DMPAgent(BaseAgent):
     """
     output = np.zeros(self.dof)
 
-    if t/500. <= self.action_len: #if x <= self.action_len: MUJOCO
+    if t/self.action_len_steps <= self.action_len: #if x <= self.action_len: MUJOCO
       for i, dmp in enumerate(self._genome):
         output[i] = dmp(t)
 
     return [output]
+
+  def _evaluate_trajectory(self, inputs):
+    """
+    Evaluates all the DMPs over the whole sequence of inputs at once
+    :param inputs: [T] array of time steps
+    :return: [T, dof] array of outputs
+    """
+    output = np.zeros((len(inputs), self.dof))
+    active = inputs/self.action_len_steps <= self.action_len
+    for i, dmp in enumerate(self._genome):
+      output[active, i] = dmp.trajectory(inputs[active])
+    return output
   # ---------------------------------
 
   # ---------------------------------
   def mutate(self):
     """
     Mutates the genome of the agent. It does not return anything. The mutation is internal.
+    All the parameters of the DMPs and the action length are mutated.
     """
-    for dmp in self._genome:
-      for param_name in dmp.params:
-        if param_name == 'name':
-          continue
-        try:
-          new_value = dmp.params[param_name] + self.mutation_operator(dmp.params[param_name].shape[0])
-        except AttributeError:
-          new_value = dmp.params[param_name] + self.mutation_operator()
-        setattr(dmp, param_name, new_value)
-    self.action_len = self.action_len + self.mutation_operator()
+    self._mutate_flat_genome()
   # ---------------------------------
 
   # ---------------------------------
@@ -280,7 +515,8 @@ class DMPAgent(BaseAgent):
     self.action_len = params[-1]  # the last is the action lenght
 
     for p, g in zip(params[:-1], self._genome):
-      g.load(deepcopy (p))
+      g.load(p)
+    self._trajectory = None
   # ---------------------------------
 
 
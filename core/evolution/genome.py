@@ -4,10 +4,65 @@
 import numpy as np
 
 # ---------------------------------------------------------------------------
-class FCLayer(object):
+class BaseGenome(object):
+  """
+  Base class of the genome elements. All the parameters listed in param_names are numpy arrays (scalars are 0-d arrays)
+  so that they can be moved into views of a bigger contiguous buffer owned by the agent.
+  """
+  __slots__ = ()
+  param_names = ()
+  bounds = {} # Limits of the values of the parameters, as {param_name: (low, high)}
+
+  # ------------------------------------------------------
+  @property
+  def size(self):
+    """
+    Number of scalar values in the parameters
+    """
+    return sum(getattr(self, p).size for p in self.param_names)
+  # ------------------------------------------------------
+
+  # ------------------------------------------------------
+  def bind(self, buffer, load=True):
+    """
+    Turns the parameters into views of the given buffer.
+    :param buffer: 1D float array of length self.size
+    :param load: If True the current values of the parameters are written into the buffer first
+    """
+    offset = 0
+    for p in self.param_names:
+      value = getattr(self, p)
+      view = buffer[offset:offset + value.size].reshape(value.shape)
+      if load:
+        view[...] = value
+      setattr(self, p, view)
+      offset += value.size
+  # ------------------------------------------------------
+
+  # ------------------------------------------------------
+  def load(self, params):
+    """
+    Load function. The values are copied in place, so that if the parameters are views, the buffer is updated.
+    :param params: Parameters of the genome element
+    """
+    for p in self.param_names:
+      value = params[p]
+      if p in self.bounds:
+        value = np.clip(value, *self.bounds[p])
+      getattr(self, p)[...] = value
+    if 'name' in params:
+      self.name = params['name']
+  # ------------------------------------------------------
+# ---------------------------------------------------------------------------
+
+# ---------------------------------------------------------------------------
+class FCLayer(BaseGenome):
   """
   This one is a simple FC layer to be used as genome of the evolution agents
   """
+  __slots__ = ('w', 'bias', 'name')
+  param_names = ('w', 'bias')
+
   # ------------------------------------------------------
   def __init__(self, input, output, name='fc', bias=True):
     """
@@ -66,23 +121,16 @@ class FCLayer(object):
     print('Weights {}'.format(self.w))
     print('Bias {}'.format(self.bias))
   # ------------------------------------------------------
-
-  # ------------------------------------------------------
-  def load(self, params):
-    """
-    Load function
-    :param params: Parameters of the layer
-    """
-    self.w = params['w']
-    self.bias = params['bias']
-  # ------------------------------------------------------
 # ---------------------------------------------------------------------------
 
 # ---------------------------------------------------------------------------
-class DMPExp(object):
+class DMPExp(BaseGenome):
   """
   This one is a exponential DMP
   """
+  __slots__ = ('num_basis_func', 'mu', 'sigma', 'w', 'a_x', 'tau', 'name')
+  param_names = ('mu', 'sigma', 'w', 'a_x', 'tau')
+
   # ------------------------------------------------------
   def __init__(self, name='dmp', degree=5):
     """
@@ -94,8 +142,8 @@ class DMPExp(object):
     self.mu = np.abs(np.random.randn(self.num_basis_func))
     self.sigma = np.random.uniform(size=self.num_basis_func)
     self.w = np.random.randn(self.num_basis_func)
-    self.a_x  = np.random.uniform()
-    self.tau = 2
+    self.a_x  = np.array(np.random.uniform())
+    self.tau = np.array(2.)
     self.name = name
   # ------------------------------------------------------
 
@@ -115,6 +163,18 @@ class DMPExp(object):
     return f
   # ------------------------------------------------------
 
+  # ------------------------------------------------------
+  def trajectory(self, t):
+    """
+    Values of the DMP for a whole sequence of times, all at once
+    :param t: [T] array of times
+    :return: [T] array of values of the DMP
+    """
+    x = np.exp(-self.a_x*t/self.tau)
+    g = self.basis_function(x[:, None], self.mu[None, :], self.sigma[None, :])
+    return np.sum(g*self.w, axis=1)/np.sum(g, axis=1)
+  # ------------------------------------------------------
+
   # ------------------------------------------------------
   @property
   def params(self):
@@ -137,27 +197,16 @@ class DMPExp(object):
     """
     return np.exp(np.sin((x - mu)/sigma)/2)
   # ------------------------------------------------------
-
-  # ------------------------------------------------------
-  def load(self, params):
-    """
-    Load function
-    :param params: Parameters of the DMP
-    """
-    self.mu = params['mu']
-    self.sigma = params['sigma']
-    self.w = params['w']
-    self.a_x = params['a_x']
-    self.tau = params['tau']
-    self.name = params['name']
-  # ------------------------------------------------------
 # ---------------------------------------------------------------------------
 
 # ---------------------------------------------------------------------------
-class DMPPoly(object):
+class DMPPoly(BaseGenome):
   """
   This one is a Polynomial DMP
   """
+  __slots__ = ('degree', 'w', 'scale', 'name')
+  param_names = ('w', 'scale')
+
   # ------------------------------------------------------
   def __init__(self, name='dmp', degree=5):
     """
@@ -167,7 +216,7 @@ class DMPPoly(object):
     """
     self.degree = degree
     self.w = np.random.randn(self.degree+1)
-    self.scale = 1
+    self.scale = np.array(1.)
     self.name = name
   # ------------------------------------------------------
 
@@ -186,32 +235,38 @@ class DMPPoly(object):
   # ------------------------------------------------------
 
   # ------------------------------------------------------
-  @property
-  def params(self):
+  def trajectory(self, t):
     """
-    Parameters of the DMP.
-    :return: A dict of the parameters
+    Values of the DMP for a whole sequence of times, all at once
+    :param t: [T] array of times
+    :return: [T] array of values of the DMP
     """
-    return {'w': self.w, 'scale':self.scale, 'name':self.name}
+    x = np.cos(t/self.scale)
+    p = np.zeros(np.shape(t))
+    for i in range(self.degree+1):
+      p += self.w[i]*x**i
+    return p
   # ------------------------------------------------------
 
   # ------------------------------------------------------
-  def load(self, params):
+  @property
+  def params(self):
     """
-    Load function
-    :param params: Parameters of the DMP
+    Parameters of the DMP.
+    :return: A dict of the parameters
     """
-    self.scale = params['scale']
-    self.w = params['w']
-    self.name = params['name']
+    return {'w': self.w, 'scale':self.scale, 'name':self.name}
   # ------------------------------------------------------
 # ---------------------------------------------------------------------------
 
 # ---------------------------------------------------------------------------
-class DMPSin(object):
+class DMPSin(BaseGenome):
   """
   This one is a Sinusoidal DMP
   """
+  __slots__ = ('period', 'amplitude', 'name')
+  param_names = ('period', 'amplitude')
+  bounds = {'amplitude': (-5., 5.)} # There are only a bunch of values that the amplitude can have
 
   # ------------------------------------------------------
   def __init__(self, name='dmp', *kwargs):
@@ -221,8 +276,8 @@ class DMPSin(object):
     :param kwargs:
     """
     self.name = name
-    self.amplitude = np.random.randn()
-    self.period = np.random.uniform(10, 50) # self.period = np.random.uniform() # MUJOCO
+    self.amplitude = np.array(np.clip(np.random.randn(), *self.bounds['amplitude']))
+    self.period = np.array(np.random.uniform(10, 50)) # self.period = np.random.uniform() # MUJOCO
   # ------------------------------------------------------
 
   # ------------------------------------------------------
@@ -237,45 +292,22 @@ class DMPSin(object):
   # ------------------------------------------------------
 
   # ------------------------------------------------------
-  @property
-  def params(self):
+  def trajectory(self, t):
     """
-    Parameters of the DMP.
-    :return: A dict of the parameters
+    Values of the DMP for a whole sequence of times, all at once
+    :param t: [T] array of times
+    :return: [T] array of values of the DMP
     """
-    return {'period': self.period, 'amplitude': self.amplitude, 'name':self.name}
+    return self(np.asarray(t))
   # ------------------------------------------------------
 
   # ------------------------------------------------------
   @property
-  def amplitude(self):
-    """
-    Amplitude of the sinusoid. Is defined as a property cause there are only a bunch of values that it can have.
-    """
-    return self.__amplitude
-
-  @amplitude.setter
-  def amplitude(self, x):
-    """
-    Amplitude setter
-    :param x: Value
-    """
-    if x > 5:
-      self.__amplitude = 5
-    elif x < -5:
-      self.__amplitude = -5
-    else:
-      self.__amplitude = x
-  # ------------------------------------------------------
-
-  # ------------------------------------------------------
-  def load(self, params):
+  def params(self):
     """
-    Load function
-    :param params: Parameters of the DMP
+    Parameters of the DMP.
+    :return: A dict of the parameters
     """
-    self.period = params['period']
-    self.amplitude = params['amplitude']
-    self.name = params['name']
+    return {'period': self.period, 'amplitude': self.amplitude, 'name':self.name}
   # ------------------------------------------------------
 # ---------------------------------------------------------------------------
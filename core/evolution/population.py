@@ -1,33 +1,166 @@
 from core.evolution.agents import *
-import pandas as pd
 import os
 import pickle as pkl
+import json
 
+
+# ---------------------------------------------------------------------------
+def share(value):
+  """
+  Makes the arrays in value read-only, so that they can be shared between the copies of an agent instead of being
+  copied. Lists, like the features, are shallow copied, so that their elements can still be replaced.
+  :param value: Value of a field of the agent
+  :return: The value to give to the copy
+  """
+  if isinstance(value, np.ndarray):
+    value.flags.writeable = False
+  elif isinstance(value, list):
+    value = [share(v) for v in value]
+  return value
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+class AgentRow(object):
+  """
+  View on a single row of the population. Reading and writing the fields of the row reads and writes directly the
+  columns of the population, so that the row can be used like the pandas rows that were used before.
+  """
+  __slots__ = ('_pop', '_idx')
+
+  # ---------------------------------
+  def __init__(self, pop, idx):
+    """
+    Constructor
+    :param pop: Population the row belongs to
+    :param idx: Position of the row in the population
+    """
+    self._pop = pop
+    self._idx = idx
+  # ---------------------------------
+
+  # ---------------------------------
+  def __getitem__(self, key):
+    """
+    Returns the value of the field key of the row
+    :param key: Name of the column
+    """
+    if key == 'agent':
+      return self._pop._agent(self._idx)
+    return self._pop.columns[key][self._idx]
+
+  def __setitem__(self, key, value):
+    """
+    Sets the value of the field key of the row
+    :param key: Name of the column
+    :param value: Value to set
+    """
+    if key == 'agent':
+      self._pop.agents[self._idx] = value
+    else:
+      self._pop.columns[key][self._idx] = value
+  # ---------------------------------
+
+  # ---------------------------------
+  def keys(self):
+    """
+    Names of the fields of the row
+    """
+    return Population.COLUMNS
+
+  def to_dict(self):
+    """
+    Returns the row as a dict. The values are not copied.
+    """
+    return {key: self[key] for key in self.keys()}
+
+  def __repr__(self):
+    return 'AgentRow({})'.format(self.to_dict())
+  # ---------------------------------
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
 class Population(object):
   """
   Population class. The new generation is just the mutation of the best elements that substitutes the worst.
   The criteria for the best is given by the metric, and is calculated outside.
+
+  The data of the agents is stored column-wise: the agents are kept in a list while all the other fields are stored
+  in preallocated numpy arrays that are grown geometrically, so that adding an agent is amortized O(1).
+
+  If a state store is given, the states of the agents (the second element of their features) are moved in it when
+  the agents are added, and the features only keep the index of the state in the store.
+
+  The agents of a loaded pop are only created when they are accessed: until then only their flat genome is kept.
   """
+  COLUMNS = ('agent', 'reward', 'surprise', 'best', 'bs', 'name', 'novelty', 'features')
+  # Type and empty value of each of the data columns. bs and features can have different shapes (or be None) depending
+  # on the env and on the experiment, so they are stored as object arrays.
+  DTYPES = {'reward': (np.float64, np.nan),
+            'surprise': (np.float64, np.nan),
+            'novelty': (np.float64, np.nan),
+            'best': (np.bool_, False),
+            'name': (np.int64, -1),
+            'bs': (object, None),
+            'features': (object, None)}
+
   # ---------------------------------
-  def __init__(self, shapes, agent=BaseAgent, pop_size=10, max_len=None):
+  def __init__(self, shapes, agent=BaseAgent, pop_size=10, max_len=None, state_store=None):
     """
     Constructors
     :param shapes: Parameters for the agents
     :param agent: Agent type
     :param pop_size: Size of the initial population
     :param max_len: Maximum length of the pop in case we use a growing population
+    :param state_store: StateStore in which to keep the states of the agents. If None they are kept in the features
     """
-    self.pop = pd.DataFrame(columns=['agent', 'reward', 'surprise', 'best', 'bs', 'name', 'novelty', 'features'])
     self.agent_class = agent
+    self.state_store = state_store
+    self._prototype = None # Agent copied to create the loaded agents
     self.shapes = shapes
     self.max_len = max_len
     self.avg_surprise = 0
     self.agent_name = 0
+    self.features_version = 0 # Has to be increased every time the features of the agents are updated all together
+    self._init_columns(pop_size)
 
     for i in range(pop_size):
       self.add()
   # ---------------------------------
 
+  # ---------------------------------
+  def _init_columns(self, capacity):
+    """
+    Creates the empty columns of the population
+    :param capacity: Number of agents for which to preallocate the columns
+    """
+    self._size = 0
+    self.agents = []
+    self._genomes = [] # Flat genomes of the loaded agents that have not been created yet
+    self.columns = {}
+    self._capacity = max(capacity, 1)
+    for key in self.DTYPES:
+      dtype, empty = self.DTYPES[key]
+      self.columns[key] = np.full(self._capacity, empty, dtype=dtype)
+
+  def _reserve(self, capacity):
+    """
+    Grows the columns so that they can contain at least capacity agents. The capacity is doubled to have amortized
+    O(1) additions.
+    :param capacity: Needed capacity
+    """
+    if capacity <= self._capacity:
+      return
+    new_capacity = max(capacity, 2 * self._capacity)
+    for key in self.columns:
+      dtype, empty = self.DTYPES[key]
+      column = np.full(new_capacity, empty, dtype=dtype)
+      column[:self._size] = self.columns[key][:self._size]
+      self.columns[key] = column
+    self._capacity = new_capacity
+  # ---------------------------------
+
   # These functions allow to work with the pop as a list
   # ---------------------------------
   def __iter__(self):
@@ -44,7 +177,7 @@ class Population(object):
     :return:
     """
     if self._iter_idx < self.size:
-      x = self.pop.loc[self._iter_idx]
+      x = AgentRow(self, self._iter_idx)
       self._iter_idx += 1
     else:
       raise StopIteration
@@ -54,21 +187,38 @@ class Population(object):
     """
     Returns the asked item
     :param item: item to return.
-    :return: If item is a string returns a column of the dataframe. If it is an integer returns the corresponding agent
+    :return: If item is a string returns the column as a numpy array (the list of agents for the 'agent' column).
+             If it is an integer returns the corresponding agent row.
     """
     if type(item) is str:
-      return self.pop[item]
-    return self.pop.iloc[item]
+      if item == 'agent':
+        if len(self._genomes) > 0: # Create the loaded agents that have not been created yet, only once
+          for idx, genome in enumerate(self._genomes):
+            if genome is not None:
+              self._agent(idx)
+          self._genomes = []
+        return self.agents
+      return self.columns[item][:self.size]
+    return AgentRow(self, self._check_index(item))
 
   def __setitem__(self, key, value):
     """
-    Set the agent in position key with the ones passed as value
-    :param key: Position of the agent to set
-    :param value: New agent to set
+    Set the agent in position key with the ones passed as value. If key is a string, the whole column is set.
+    :param key: Position of the agent to set or name of the column
+    :param value: New agent to set or values of the column
     :return:
     """
-    assert key < self.size and key > -self.size-1, 'Index out of range'
-    self.pop.iloc[key] = value
+    if type(key) is str:
+      if key == 'agent':
+        assert len(value) == self.size, 'Wrong number of agents'
+        self.agents = list(value)
+        self._genomes = []
+      else:
+        self.columns[key][:self.size] = value
+      return
+    key = self._check_index(key)
+    for col in self.COLUMNS:
+      self[key][col] = value[col]
 
   def __len__(self):
     """
@@ -76,19 +226,56 @@ class Population(object):
     """
     return self.size
 
+  def _check_index(self, idx):
+    """
+    Checks that the index is in range and converts negative indexes to positive ones
+    :param idx: Index
+    :return: Positive index
+    """
+    assert idx < self.size and idx > -self.size-1, 'Index out of range'
+    if idx < 0:
+      idx += self.size
+    return int(idx)
+
   @property
   def size(self):
     """
     Size of the population
     """
-    return len(self.pop)
+    return self._size
+  # ---------------------------------
+
+  # ---------------------------------
+  def _agent(self, idx):
+    """
+    Returns the agent at position idx, creating it from its flat genome if it has been loaded but not created yet
+    :param idx: Position of the agent
+    """
+    agent = self.agents[idx]
+    if agent is None and idx < len(self._genomes) and self._genomes[idx] is not None:
+      if self._prototype is None:
+        self._prototype = self.agent_class(self.shapes)
+      agent = self._prototype.copy()
+      agent.load_flat_genome(self._genomes[idx])
+      self.agents[idx] = agent
+      self._genomes[idx] = None
+    return agent
+
+  def _flat_genome(self, idx):
+    """
+    Returns the flat genome of the agent at position idx, without creating the agent if it has not been created yet
+    :param idx: Position of the agent
+    """
+    if self.agents[idx] is None and idx < len(self._genomes) and self._genomes[idx] is not None:
+      return self._genomes[idx]
+    return self.agents[idx].flat_genome
   # ---------------------------------
 
   # ---------------------------------
   def add(self, agent=None):
     """
     Adds agent to the pop. If no agent is passed, a new agent is generated.
-    :param agent: agent to add
+    :param agent: agent to add. Can be a dict or an AgentRow
     :return:
     """
     if agent is None:
@@ -96,8 +283,51 @@ class Population(object):
                'best': False, 'bs':None, 'name':self.agent_name, 'features': None}
       self.agent_name += 1
 
-    agent = pd.DataFrame([agent], columns=agent.keys()) # If an agent is given, it should already have a name
-    self.pop = pd.concat([self.pop, agent], ignore_index=True, sort=True)
+    # If an agent is given, it should already have a name
+    self._reserve(self.size + 1)
+    self.agents.append(agent['agent'])
+    self._size += 1
+    row = AgentRow(self, self.size - 1)
+    for key in self.columns:
+      value = agent[key]
+      if value is None:
+        value = self.DTYPES[key][1]
+      elif key == 'features' and self.state_store is not None and isinstance(value[1], np.ndarray):
+        value = [value[0], self.state_store.append(value[1])]
+      row[key] = value
+  # ---------------------------------
+
+  # ---------------------------------
+  def get_states(self, rows=None):
+    """
+    Returns the states of the agents, that is the second element of their features. If the states are in the state
+    store, the ones of consecutive agents are read as a single slice of the store.
+    :param rows: Positions of the agents. If None the states of all the agents are returned
+    :return: [n, ...] array of states
+    """
+    feats = self['features']
+    if rows is not None:
+      feats = feats[rows]
+    if self.state_store is not None:
+      return self.state_store.read([f[1] for f in feats])
+    return np.stack([f[1] for f in feats])
+  # ---------------------------------
+
+  # ---------------------------------
+  def sort(self, key, ascending=True):
+    """
+    Reorders the population according to the values of the given column
+    :param key: Column according to which to sort
+    :param ascending: Flag to sort in ascending or descending order
+    """
+    order = np.argsort(self[key], kind='stable')
+    if not ascending:
+      order = order[::-1]
+    self.agents = [self.agents[i] for i in order]
+    if len(self._genomes) > 0:
+      self._genomes = [self._genomes[i] if i < len(self._genomes) else None for i in order]
+    for col in self.columns:
+      self.columns[col][:self.size] = self.columns[col][order]
   # ---------------------------------
 
   # ---------------------------------
@@ -112,97 +342,388 @@ class Population(object):
   # ---------------------------------
   def copy(self, idx, with_data=False):
     """
-    Returns a copy of the agent at position idx
+    Returns a copy of the agent at position idx. Only the flat genome of the agent is copied. The data is not copied but
+    shared with the original row: its arrays are made read-only, so that neither of the two can modify the other.
+    Note that this also makes read-only the arrays of the source row, and any other reference to them.
     :param idx: Position of the agent to copy
     :param with_data: If true also copies all the data relative to the agent.
-    :return: Copy of the agent
+    :return: Copy of the agent as a dict
     """
-    assert idx < self.size and idx > -self.size-1, 'Index out of range'
-    agent = {'agent': self.agent_class(self.shapes), 'reward': None, 'surprise': None, 'novelty': None,
+    idx = self._check_index(idx)
+    agent = {'agent': self._agent(idx).copy(), 'reward': None, 'surprise': None, 'novelty': None,
              'best': False, 'bs': None, 'name':self.agent_name, 'features': None}
 
     if with_data:
-      for key in agent.keys(): # If copied with data we keep the original name
-        agent[key] = deepcopy(self[idx][key])
+      for key in self.columns: # If copied with data we keep the original name
+        agent[key] = share(self.columns[key][idx])
+      if self.state_store is not None and agent['features'] is not None: # The copy gets its own state
+        agent['features'][1] = share(self.get_states([idx])[0].copy())
     else:
-      agent['agent'] = deepcopy(self[idx]['agent'])
       self.agent_name += 1 # if not with data, the agent is new, so we update the name
+    return agent
+  # ---------------------------------
+
+  # ---------------------------------
+  def _saved_genomes(self, start=0, end=None):
+    """
+    Creates the entries with which the agents are saved: their flat genome, features and bs.
+    If the states are in the state store, the features keep the position of the state in the list of saved states.
+    :param start: Position of the first agent to save
+    :param end: Position after the last agent to save. If None the agents are saved up to the end of the pop
+    :return: Dict with the entry of each agent, indexed by its name, and list with the indexes in the state store of the
+             saved states
+    """
+    genomes = {}
+    states = [] # Indexes in the state store of the saved states
+    for idx in range(start, self.size if end is None else end):
+      a = self[idx]
+      feat = a['features']
+      if self.state_store is not None and feat is not None:
+        states.append(feat[1])
+        feat = [feat[0], len(states) - 1]
+      genomes[a['name']] = {'gen': self._flat_genome(idx), 'feat': feat, 'bs': a['bs']}
+    return genomes, states
+
+  def _load_genomes(self, genomes, states=None, columns=None):
+    """
+    Adds to the pop the agents saved in genomes. The agents saved as flat genomes are created only when accessed.
+    :param genomes: Dict with the saved agents, indexed by their name
+    :param states: Array with the states of the agents, if they have been saved separately
+    :param columns: Columns to load. If None all of them are loaded
+    """
+    if columns is None:
+      columns = self.COLUMNS
+    for agent_name in genomes:
+      # Create empty agent
+      agent = {'agent': None, 'reward': None, 'surprise': None, 'novelty': None,
+               'best': False, 'bs': None, 'name': agent_name, 'features': None}
+      try:
+        agent_genome = genomes[agent_name]['gen'] # Get genome
+        if 'features' in columns:
+          agent['features'] = genomes[agent_name]['feat'] # Get features
+          if states is not None and agent['features'] is not None:
+            agent['features'] = [agent['features'][0], np.array(states[agent['features'][1]])]
+          elif self.state_store is not None and agent['features'] is not None:
+            agent['features'] = [agent['features'][0], self._legacy_state(agent['features'][1])]
+        if 'bs' in columns:
+          try:
+            agent['bs'] = genomes[agent_name]['bs'] # Get ground truth BS
+          except:
+            print('Agents without bs')
+      except:
+        print('Agents without features!')
+        agent_genome = genomes[agent_name] # Get genome
+
+      flat_genome = None
+      if 'agent' not in columns:
+        pass
+      elif isinstance(agent_genome, np.ndarray): # Flat genome. The agent is created when accessed
+        flat_genome = agent_genome
+      else: # Genome saved as list of genome elements
+        agent['agent'] = self.agent_class(self.shapes)
+        # Check if genome is of the right size
+        assert len(agent_genome) == len(agent['agent'].genome), 'Wrong genome length. Saved {}, current {}'.format(agent_genome, agent['agent'].genome)
+        agent['agent'].load_genome(agent_genome, agent_name) # Load genome to agent
+        # Check that genome has been loaded properly
+        for k in range(len(agent_genome)):
+          try:
+            for p in agent['agent'].genome[k]:
+              assert np.all(agent['agent'].genome[k][p] == agent_genome[k][p]), 'Could not load {} of element {} in agent {}'.format(p, k, agent)
+          except TypeError: #TODO this is because the action len is stored as a float in the list. Might have to put it into a dict so don't have to do the exception
+            assert agent['agent'].genome[k] == agent_genome[k], 'Could not load action_len of element {} in agent {}'.format(p, k, agent)
 
-    agent = pd.DataFrame([agent], columns=agent.keys())
-    return agent.iloc[0]
+      self._genomes.extend([None] * (self.size - len(self._genomes)))
+      self._genomes.append(flat_genome)
+      self.add(agent) # Add loaded agent to the population
   # ---------------------------------
 
   # ---------------------------------
   def save_pop(self, filepath, name):
     """
-    Saves the population as a .json file
+    Saves the population in the qd_<name> folder, in a columnar format: each field of the agents is saved as a separate
+    .npy file, so that the fields can be loaded separately and memory-mapped. The agents are saved as their flat
+    genomes, and the features are split in the features and states files. The fields whose values are not arrays of the
+    same shape are pickled. columns.json records the agent type and the size of the pop.
     :param filepath:
-    :param name: Name of the file where to save the pop
+    :param name: Name of the folder where to save the pop
     """
-    save_ckpt = {}
+    folder = os.path.join(filepath, 'qd_{}'.format(name))
+    try:
+      os.makedirs(folder, exist_ok=True)
+      self._save_column(folder, 'genome', [self._flat_genome(idx) for idx in range(self.size)])
+      for key in ('reward', 'surprise', 'novelty', 'best', 'name'):
+        np.save(os.path.join(folder, key + '.npy'), self[key])
+      self._save_column(folder, 'bs', list(self['bs']))
 
-    save_ckpt['Agent Type'] = self.agent_class.__name__
-    save_ckpt['Genome'] = {}
+      feats = self['features']
+      self._save_column(folder, 'features', [None if f is None else f[0] for f in feats])
+      self._save_states(folder, feats)
 
-    for a in self:
-      save_ckpt['Genome'][a['name']] = {'gen': a['agent'].genome, 'feat': a['features'], 'bs': a['bs']}
+      with open(os.path.join(folder, 'columns.json'), 'w') as file:
+        json.dump({'agent_type': self.agent_class.__name__, 'size': self.size}, file, indent=2)
+    except Exception as e:
+      print('Cannot Save {}.'.format(name))
+      print('Exception {}'.format(e))
+
+  def _save_states(self, folder, feats):
+    """
+    Saves the states of the agents, that is the second element of their features, as the states field
+    :param folder: Folder of the saved pop
+    :param feats: Features of the agents
+    """
+    if self.state_store is not None and all(f is not None for f in feats):
+      # All the states are in the store: they are copied to the file in chunks, without loading them all in RAM
+      self._save_column(folder, 'states', []) # Only removes the files of previous saves
+      self.state_store.save(os.path.join(folder, 'states.npy'), [f[1] for f in feats])
+      return
+
+    states = []
+    for f in feats:
+      if f is None or len(f) < 2 or f[1] is None: # Agent without state
+        states.append(None)
+      elif self.state_store is not None: # The features keep the index of the state in the store
+        states.append(self.state_store.read([f[1]])[0])
+      else:
+        states.append(f[1])
+    self._save_column(folder, 'states', states)
+
+  @staticmethod
+  def _save_column(folder, key, values):
+    """
+    Saves the values of a field of the agents in folder. If they are all arrays of the same shape they are saved in the
+    <key>.npy file, otherwise they are pickled in the <key>.pkl file. If they are all None nothing is saved.
+    :param folder: Folder of the saved pop
+    :param key: Name of the field
+    :param values: List with the value of each agent
+    """
+    for ext in ('.npy', '.pkl'): # Remove the files of previous saves
+      if os.path.exists(os.path.join(folder, key + ext)):
+        os.remove(os.path.join(folder, key + ext))
+    if all(v is None for v in values):
+      return
+    if all(isinstance(v, np.ndarray) and v.shape == values[0].shape for v in values):
+      np.save(os.path.join(folder, key + '.npy'), np.stack(values))
+    else:
+      with open(os.path.join(folder, key + '.pkl'), 'wb') as file:
+        pkl.dump(list(values), file)
+
+  @staticmethod
+  def _read_column(folder, key):
+    """
+    Reads the values of a field of the agents saved with _save_column. The .npy files are memory-mapped copy-on-write:
+    the values are read from disk only when accessed, and modifying them does not modify the file.
+    :param folder: Folder of the saved pop
+    :param key: Name of the field
+    :return: Array or list with the value of each agent. None if the field has not been saved
+    """
+    if os.path.exists(os.path.join(folder, key + '.npy')):
+      return np.asarray(np.load(os.path.join(folder, key + '.npy'), mmap_mode='c')) # Plain array on the memory map
+    if os.path.exists(os.path.join(folder, key + '.pkl')):
+      with open(os.path.join(folder, key + '.pkl'), 'rb') as file:
+        return pkl.load(file)
+    return None
+
+  def save_pop_incremental(self, filepath, name, generation=None):
+    """
+    Saves the population in the qd_<name> folder, writing only what changed since the last save. Made for the archive,
+    that only grows: the agents added since the last save are appended as a new segment file, and the features of all
+    the agents are rewritten only if they changed (that is if features_version changed). The manifest.json file lists
+    the files of the last complete save, and is replaced only once they have been written. New files never overwrite
+    existing ones, and the files not listed in the new manifest are removed only after it has been replaced, so that an
+    interrupted save always leaves the previous one loadable.
+    If the pop does not start with the agents of the saved segments, everything is saved again.
+    :param filepath: Folder in which to create the qd_<name> folder
+    :param name: Name of the pop
+    :param generation: Generation at which the pop is saved. Recorded in the manifest
+    """
+    folder = os.path.join(filepath, 'qd_{}'.format(name))
     try:
-      with open(os.path.join(filepath, 'qd_{}.pkl'.format(name)), 'wb') as file:
-        pkl.dump(save_ckpt, file)
+      os.makedirs(folder, exist_ok=True)
+      manifest = self._read_manifest(folder)
+      saved = manifest['size']
+      if manifest['agent_type'] != self.agent_class.__name__ or saved > self.size or \
+              (saved > 0 and self[saved - 1]['name'] != manifest['last_name']):
+        manifest = self._empty_manifest()
+        saved = 0
+      # The new files are numbered after all the ones in the folder
+      file_ids = [int(f.split('_')[1][:5]) for f in os.listdir(folder) if f.startswith(('segment_', 'features_'))]
+      next_id = max(file_ids, default=-1) + 1
+
+      if saved < self.size: # Append the new agents
+        segment = 'segment_{:05d}'.format(next_id)
+        next_id += 1
+        genomes, states = self._saved_genomes(saved)
+        if self.state_store is not None:
+          self.state_store.save(os.path.join(folder, segment + '_states.npy'), states)
+        with open(os.path.join(folder, segment + '.pkl'), 'wb') as file:
+          pkl.dump(genomes, file)
+        manifest['segments'].append({'file': segment, 'start': saved, 'end': self.size})
+
+      if manifest['features_version'] != self.features_version and self.size > 0: # Rewrite the features
+        features_file = 'features_{:05d}.npy'.format(next_id)
+        np.save(os.path.join(folder, features_file), np.stack([f[0] for f in self['features']]))
+        manifest['features'] = {'file': features_file, 'rows': self.size}
+        manifest['features_version'] = self.features_version
+
+      manifest['size'] = self.size
+      manifest['last_name'] = int(self[-1]['name']) if self.size > 0 else None
+      manifest['generation'] = generation
+      with open(os.path.join(folder, 'manifest.json.tmp'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+      os.replace(os.path.join(folder, 'manifest.json.tmp'), os.path.join(folder, 'manifest.json'))
+
+      # Remove the files of the previous saves that are not used anymore
+      used = {f for seg in manifest['segments'] for f in [seg['file'] + '.pkl', seg['file'] + '_states.npy']}
+      if manifest['features'] is not None:
+        used.add(manifest['features']['file'])
+      for f in os.listdir(folder):
+        if f.startswith(('segment_', 'features_')) and f not in used:
+          os.remove(os.path.join(folder, f))
     except Exception as e:
       print('Cannot Save {}.'.format(name))
       print('Exception {}'.format(e))
+
+  def _empty_manifest(self):
+    """
+    Manifest of a pop saved incrementally, without any agent saved yet
+    """
+    return {'agent_type': self.agent_class.__name__, 'generation': None, 'size': 0, 'last_name': None,
+            'segments': [], 'features': None, 'features_version': 0}
+
+  def _read_manifest(self, folder):
+    """
+    Reads the manifest of the pop saved incrementally in folder
+    :param folder: Folder of the saved pop
+    :return: The manifest. If there is none, an empty one
+    """
+    path = os.path.join(folder, 'manifest.json')
+    if not os.path.exists(path):
+      return self._empty_manifest()
+    with open(path) as file:
+      return json.load(file)
   # ---------------------------------
 
   # ---------------------------------
-  def load_pop(self, filepath):
+  def load_pop(self, filepath, columns=None):
     """
-    Loads a population from a given filepath
+    Loads a population from a given filepath: the folder of a pop saved with save_pop or save_pop_incremental, or the
+    .pkl file of the legacy format. In the legacy format, if the states have been saved in a separate file by a
+    population with a state store, they are loaded from there.
+    Only the given columns are loaded, e.g. ['bs'] or ['features'], while the other fields are left empty. The names of
+    the agents are always loaded. The agents are created only when accessed.
     :param filepath: Filepath from where to save the population
+    :param columns: Columns to load. If None all of them are loaded
     """
     if not os.path.exists(filepath):
       print('File to load not found.')
       return
+    if columns is None:
+      columns = self.COLUMNS
 
     print('Loading population from {}'.format(filepath))
+    if os.path.isdir(filepath):
+      if os.path.exists(os.path.join(filepath, 'manifest.json')):
+        self._load_incremental(filepath, columns)
+      else:
+        self._load_columns(filepath, columns)
+      print("Done")
+      return
+
     with open(filepath, 'rb') as file:
       ckpt = pkl.load(file)
+    states = None
+    states_path = os.path.splitext(filepath)[0] + '_states.npy'
+    if os.path.exists(states_path):
+      states = np.load(states_path, mmap_mode='r')
+    if self.state_store is not None:
+      self.state_store.clear()
 
     # Check if we are loading the right agent class
     assert ckpt['Agent Type'] == self.agent_class.__name__, "Wrong agent type. Saved {}, current {}".format(ckpt['Agent Type'], self.agent_class.__name__)
 
-    # Creates empty pop
-    del self.pop
-    self.pop = pd.DataFrame(columns=['agent', 'reward', 'surprise', 'best', 'bs', 'name', 'novelty', 'features'])
+    # Creates empty pop, with already enough space for all the agents
+    self._init_columns(len(ckpt['Genome']))
     self.agent_name = 0
 
     # Start loading agents
-    for agent_name in ckpt['Genome']:
-      # Create empty agent
-      agent = {'agent': self.agent_class(self.shapes), 'reward': None, 'surprise': None, 'novelty': None,
-               'best': False, 'bs': None, 'name': agent_name, 'features': None}
-      try:
-        agent_genome = ckpt['Genome'][agent_name]['gen'] # Get genome
-        agent['features'] = ckpt['Genome'][agent_name]['feat'] # Get features
-        try:
-          agent['bs'] = ckpt['Genome'][agent_name]['bs'] # Get ground truth BS
-        except:
-          print('Agents without bs')
-      except:
-        print('Agents without features!')
-        agent_genome = ckpt['Genome'][agent_name] # Get genome
-
-      # Check if genome is of the right size
-      assert len(agent_genome) == len(agent['agent'].genome), 'Wrong genome length. Saved {}, current {}'.format(agent_genome, self[-1]['agent'].genome)
-      agent['agent'].load_genome(agent_genome, agent_name) # Load genome to agent
-      # Check that genome has been loaded properly
-      for k in range(len(agent_genome)):
-        try:
-          for p in agent['agent'].genome[k]:
-            assert np.all(agent['agent'].genome[k][p] == agent_genome[k][p]), 'Could not load {} of element {} in agent {}'.format(p, k, agent)
-        except TypeError: #TODO this is because the action len is stored as a float in the list. Might have to put it into a dict so don't have to do the exception
-          assert agent['agent'].genome[k] == agent_genome[k], 'Could not load action_len of element {} in agent {}'.format(p, k, agent)
-
-      self.add(agent) # Add loaded agent to the population
+    self._load_genomes(ckpt['Genome'], states, columns)
     print("Done")
+
+  def _legacy_state(self, state):
+    """
+    Converts a state saved in the legacy format to the type of the state store. The legacy format kept the images as
+    floats in [0, 1]: they are scaled to [0, 255] as done by prepare_states, instead of being truncated to 0 and 1
+    :param state: Saved state
+    :return: The state to add to the state store
+    """
+    if isinstance(state, np.ndarray) and np.issubdtype(state.dtype, np.floating) and \
+            np.issubdtype(self.state_store.dtype, np.integer):
+      return np.round(np.clip(state, 0, 1) * 255).astype(self.state_store.dtype)
+    return state
+
+  def _load_columns(self, folder, columns):
+    """
+    Loads the given columns of the pop saved with save_pop in folder. The columns are filled directly from the
+    memory-mapped files, without going through add
+    :param folder: Folder of the saved pop
+    :param columns: Columns to load
+    """
+    with open(os.path.join(folder, 'columns.json')) as file:
+      info = json.load(file)
+    assert info['agent_type'] == self.agent_class.__name__, "Wrong agent type. Saved {}, current {}".format(info['agent_type'], self.agent_class.__name__)
+    if self.state_store is not None:
+      self.state_store.clear()
+    size = info['size']
+    self._init_columns(size)
+    self.agent_name = 0
+    self._size = size
+    self.agents = [None] * size
+
+    if 'agent' in columns and size > 0:
+      self._genomes = list(self._read_column(folder, 'genome'))
+    for key in ('reward', 'surprise', 'novelty', 'best', 'name'):
+      if key in columns or key == 'name':
+        self.columns[key][:size] = self._read_column(folder, key)
+    if 'bs' in columns:
+      bs = self._read_column(folder, 'bs')
+      for idx in range(size if bs is not None else 0):
+        self.columns['bs'][idx] = bs[idx]
+    if 'features' in columns:
+      feats = self._read_column(folder, 'features')
+      states = self._read_column(folder, 'states')
+      if self.state_store is not None and isinstance(states, np.ndarray):
+        states = self.state_store.extend(states)
+      for idx in range(size):
+        feat = None if feats is None else feats[idx]
+        state = None if states is None else states[idx]
+        if feat is not None or state is not None:
+          self.columns['features'][idx] = [feat, state]
+
+  def _load_incremental(self, folder, columns):
+    """
+    Loads the given columns of the pop saved with save_pop_incremental in folder
+    :param folder: Folder of the saved pop
+    :param columns: Columns to load
+    """
+    manifest = self._read_manifest(folder)
+    assert manifest['agent_type'] == self.agent_class.__name__, "Wrong agent type. Saved {}, current {}".format(manifest['agent_type'], self.agent_class.__name__)
+    if self.state_store is not None:
+      self.state_store.clear()
+    self._init_columns(manifest['size'])
+    self.agent_name = 0
+
+    for segment in manifest['segments']:
+      with open(os.path.join(folder, segment['file'] + '.pkl'), 'rb') as file:
+        genomes = pkl.load(file)
+      states = None
+      states_path = os.path.join(folder, segment['file'] + '_states.npy')
+      if os.path.exists(states_path):
+        states = np.load(states_path, mmap_mode='r')
+      self._load_genomes(genomes, states, columns)
+
+    if manifest['features'] is not None and 'features' in columns: # The features of the agents saved before the last rewrite
+      features = np.load(os.path.join(folder, manifest['features']['file']))
+      for agent, feat in zip(self, features):
+        agent['features'][0] = feat
+    self.features_version = manifest['features_version']
   # ---------------------------------
@@ -37,3 +37,59 @@ def test_mutation_operator():
 def test_mutation():
   raise NotImplementedError
 
+
+def test_flat_genome():
+  shapes = {'dof': 2, 'degree': 5, 'type': 'sin'}
+  agent = agents.DMPAgent(shapes)
+  flat = agent.flat_genome
+  assert len(flat) == 2 * 2 + 1, 'Wrong flat genome length.'
+  assert np.shares_memory(agent._genome[1].amplitude, flat), 'Genome elements are not views of the flat genome.'
+
+  flat[-1] = 0.3
+  assert agent.action_len == 0.3, 'Action length not bound to the flat genome.'
+
+  copy = agent.copy()
+  assert not np.shares_memory(copy.flat_genome, flat), 'Copy shares the genome with the original.'
+  assert np.shares_memory(copy._genome[0].period, copy.flat_genome), 'Genome of the copy not bound to its flat genome.'
+
+  agent.mutate()
+  assert np.all(np.abs(flat[1::2][:2]) <= 5), 'Amplitude limits not respected by mutation.'
+  assert not np.all(copy.flat_genome == flat), 'Mutating the agent changed the copy.'
+
+def test_batch_mutation():
+  shapes = {'input_shape': 3, 'output_shape': 2}
+  pop = [agents.FFNeuralAgent(shapes) for i in range(50)]
+  genomes = np.stack([a.flat_genome for a in pop])
+  old_genomes = genomes.copy()
+  agents.mutate_flat_genomes(genomes, pop[0].mutation_spec, pop[0].mutation_operator)
+
+  prob, low, high = pop[0].mutation_spec
+  assert np.all(genomes[:, -1] != old_genomes[:, -1]), 'Action length not always mutated.'
+  assert np.all((genomes[:, -1] >= .5) & (genomes[:, -1] <= 1.)), 'Action length limits not respected.'
+  assert np.all(np.abs(genomes[:, high == 5.]) <= 5.), 'Weight limits not respected.'
+  assert 0 < np.mean(genomes[:, :-1] != old_genomes[:, :-1]) < .5, 'Wrong mutation probability.'
+
+def test_dmp_trajectory():
+  inputs = np.arange(100) / 100.
+  for dmp_type in ['poly', 'exp', 'sin']:
+    agent = agents.DMPAgent({'dof': 2, 'degree': 5, 'type': dmp_type})
+    agent.action_len = 0.0015
+    trajectory = agent.trajectory(inputs)
+    assert trajectory.shape == (100, 2), 'Wrong trajectory shape.'
+    assert np.allclose(trajectory, [agent([t])[0] for t in inputs]), 'Trajectory differs from the step by step evaluation.'
+    assert agent.trajectory(inputs) is trajectory, 'Trajectory not cached.'
+
+    agent.mutate()
+    assert np.allclose(agent.trajectory(inputs), [agent([t])[0] for t in inputs]), 'Trajectory not updated after mutation.'
+    agent.flat_genome[0] += 1.
+    assert np.allclose(agent.trajectory(inputs), [agent([t])[0] for t in inputs]), 'Trajectory not updated after genome change.'
+
+def test_ff_neural_population():
+  shapes = {'input_shape': 3, 'output_shape': 2}
+  pop = [agents.FFNeuralAgent(shapes) for i in range(10)]
+  policy = agents.FFNeuralPopulation(pop)
+  obs = np.random.randn(10, 3)
+  for t in [0., .7, 1.]:
+    actions = policy([t, obs])
+    assert actions.shape == (10, 2), 'Wrong actions shape.'
+    assert np.allclose(actions, np.concatenate([a([t, o]) for a, o in zip(pop, obs)])), 'Batched evaluation differs from the single agents.'
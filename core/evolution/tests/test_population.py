@@ -1,29 +1,34 @@
-from core.rnd_qd import population
+from core.rnd_qd import population, agents
+from core.utils import state_store
+import numpy as np
 
+shapes = {'dof': 2, 'degree': 5, 'type': 'poly'}
 
 def test_iter():
-  pop = population.Population()
+  pop = population.Population(shapes, agent=agents.DMPAgent)
 
   for k in pop:
     k['best'] = True
 
   for i in range(pop.size):
-    assert pop.pop.iloc[i]['best'], 'Could not iterate properly. '
+    assert pop['best'][i], 'Could not iterate properly. '
 
 def test_get_item():
-  pop = population.Population()
+  pop = population.Population(shapes, agent=agents.DMPAgent)
   a = pop[3]
-  assert pop.pop.loc[3]['agent'] == a['agent'], 'Got wrong agent.'
+  assert pop['agent'][3] == a['agent'], 'Got wrong agent.'
+  assert pop[-1]['name'] == pop.size - 1, 'Got wrong agent with negative index.'
 
 def test_set_item():
-  pop = population.Population()
+  pop = population.Population(shapes, agent=agents.DMPAgent)
   a = pop.copy(3)
-  assert not pop.pop.loc[3]['agent'] == a['agent'], 'Could not deepcopy the agent.'
+  assert not pop['agent'][3] == a['agent'], 'Could not deepcopy the agent.'
   pop[3] = a
-  assert pop.pop.loc[3]['agent'] == a['agent'], 'Could not set agent.'
+  assert pop['agent'][3] == a['agent'], 'Could not set agent.'
+  assert pop[3]['name'] == a['name'], 'Could not set agent name.'
 
 def test_add():
-  pop = population.Population()
+  pop = population.Population(shapes, agent=agents.DMPAgent)
   len_pop = len(pop)
   pop.add()
   assert len_pop + 1 == len(pop), 'Could not add base agent.'
@@ -31,3 +36,137 @@ def test_add():
   pop.add(a)
   assert len_pop + 2 == len(pop), 'Could not add copy of agent.'
   assert pop[-1]['agent'] == a['agent'], 'Added wrong agent'
+
+def test_growth():
+  pop = population.Population(shapes, agent=agents.DMPAgent, pop_size=0)
+  for i in range(100):
+    pop.add()
+    pop[-1]['reward'] = i
+    pop[-1]['features'] = [np.ones(3) * i, None]
+  assert pop.size == 100, 'Wrong population size.'
+  assert np.all(pop['reward'] == np.arange(100)), 'Rewards lost while growing the population.'
+  assert np.all(pop['name'] == np.arange(100)), 'Names lost while growing the population.'
+  assert np.all(pop[42]['features'][0] == 42), 'Features lost while growing the population.'
+
+def test_sort():
+  pop = population.Population(shapes, agent=agents.DMPAgent)
+  first = pop[0]['agent']
+  pop.sort('name', ascending=False)
+  assert np.all(np.diff(pop['name']) < 0), 'Could not sort population.'
+  assert pop[-1]['agent'] is first, 'Agents not sorted with the other columns.'
+
+def test_state_store(tmp_path):
+  pop = population.Population(shapes, agent=agents.DMPAgent, pop_size=5)
+  images = np.random.randint(0, 256, (5, 3, 4, 4), dtype=np.uint8)
+  archive = population.Population(shapes, agent=agents.DMPAgent, pop_size=0, state_store=state_store.StateStore())
+  for i in range(5):
+    pop[i]['features'] = [np.ones(2) * i, images[i]]
+    archive.add(pop.copy(i, with_data=True))
+  assert archive[3]['features'][1] == 3, 'The state is not in the store'
+  assert np.array_equal(archive.get_states(), images) and np.array_equal(archive.get_states([4, 1]), images[[4, 1]]), 'Wrong states'
+  assert np.array_equal(archive.copy(2, with_data=True)['features'][1], images[2]), 'The copy has no state'
+
+  archive.save_pop(str(tmp_path), 'archive')
+  loaded = population.Population(shapes, agent=agents.DMPAgent, pop_size=0)
+  loaded.load_pop(str(tmp_path / 'qd_archive'))
+  assert np.array_equal(loaded.get_states(), images), 'States not loaded'
+
+def test_copy_shares_data():
+  pop = population.Population(shapes, agent=agents.DMPAgent)
+  pop[2]['features'] = [np.ones(3), np.zeros((3, 4, 4), dtype=np.uint8)]
+  pop[2]['bs'] = np.ones(2)
+  a = pop.copy(2, with_data=True)
+  assert a['bs'] is pop[2]['bs'] and a['features'][1] is pop[2]['features'][1], 'The data has been copied'
+  assert not a['bs'].flags.writeable and not a['features'][0].flags.writeable, 'The shared data can be modified'
+  a['features'][0] = np.zeros(3)
+  assert np.all(pop[2]['features'][0] == 1), 'The features of the original agent changed'
+  assert a['name'] == pop[2]['name'] and a['agent'] is not pop[2]['agent'], 'Wrong copy'
+  assert np.array_equal(a['agent'].flat_genome, pop[2]['agent'].flat_genome), 'Genome not copied'
+  assert not np.shares_memory(a['agent'].flat_genome, pop[2]['agent'].flat_genome), 'Genome shared'
+
+def test_save_incremental(tmp_path):
+  archive = population.Population(shapes, agent=agents.DMPAgent, pop_size=0, state_store=state_store.StateStore())
+  def add(n):
+    for i in range(archive.size + 1, archive.size + n + 1):
+      archive.add({'agent': agents.DMPAgent(shapes), 'reward': None, 'surprise': None, 'novelty': None, 'best': False,
+                   'name': i, 'bs': np.ones(2) * i, 'features': [np.ones(2) * i, np.full((3, 4, 4), i, dtype=np.uint8)]})
+
+  add(4)
+  archive.save_pop_incremental(str(tmp_path), 'archive', 10)
+  add(3)
+  for agent in archive:
+    agent['features'][0] = -agent['features'][0]
+  archive.features_version += 1
+  archive.save_pop_incremental(str(tmp_path), 'archive', 20)
+  archive.save_pop_incremental(str(tmp_path), 'archive', 30) # Nothing changed
+  files = sorted(f.name for f in (tmp_path / 'qd_archive').iterdir())
+  assert files == ['features_00002.npy', 'manifest.json', 'segment_00000.pkl', 'segment_00000_states.npy',
+                   'segment_00001.pkl', 'segment_00001_states.npy'], 'Wrong saved files {}'.format(files)
+
+  loaded = population.Population(shapes, agent=agents.DMPAgent, pop_size=0)
+  loaded.load_pop(str(tmp_path / 'qd_archive'))
+  assert loaded.size == 7 and np.all(loaded['name'] == archive['name']), 'Wrong loaded agents'
+  assert np.array_equal(np.stack([f[0] for f in loaded['features']]), -np.arange(1, 8)[:, None] * np.ones(2)), 'Wrong features'
+  assert np.array_equal(loaded.get_states(), archive.get_states()), 'Wrong states'
+  assert np.array_equal(np.stack(loaded['bs']), np.stack(archive['bs'])), 'Wrong bs'
+  for a, b in zip(loaded, archive):
+    assert np.array_equal(a['agent'].flat_genome, b['agent'].flat_genome), 'Wrong genome'
+
+  # A pop that does not start with the saved agents is saved again in new files, and the old ones are removed
+  archive.sort('name', ascending=False)
+  archive.save_pop_incremental(str(tmp_path), 'archive', 40)
+  files = sorted(f.name for f in (tmp_path / 'qd_archive').iterdir())
+  assert files == ['features_00004.npy', 'manifest.json', 'segment_00003.pkl', 'segment_00003_states.npy'], \
+    'Wrong saved files {}'.format(files)
+  loaded = population.Population(shapes, agent=agents.DMPAgent, pop_size=0)
+  loaded.load_pop(str(tmp_path / 'qd_archive'))
+  assert np.all(loaded['name'] == np.arange(7, 0, -1)), 'Wrong loaded agents after reset'
+  assert np.array_equal(loaded.get_states(), archive.get_states()), 'Wrong states after reset'
+
+def test_save_columns(tmp_path):
+  pop = population.Population(shapes, agent=agents.DMPAgent, pop_size=6)
+  for i, agent in enumerate(pop):
+    agent['bs'] = np.ones(2) * i
+    agent['features'] = [np.ones(3) * i, np.full((3, 4, 4), i, dtype=np.uint8)]
+    agent['reward'] = i
+  pop.save_pop(str(tmp_path), 'pop')
+
+  loaded = population.Population(shapes, agent=agents.DMPAgent, pop_size=0)
+  loaded.load_pop(str(tmp_path / 'qd_pop'))
+  assert all(a is None for a in loaded.agents), 'The agents have been created before being accessed'
+  assert np.array_equal(loaded[4]['agent'].flat_genome, pop[4]['agent'].flat_genome), 'Wrong genome'
+  assert loaded.agents[3] is None, 'Created the agents that have not been accessed'
+  assert np.all(loaded['reward'] == np.arange(6)) and np.all(loaded['name'] == pop['name']), 'Wrong columns'
+  assert np.array_equal(loaded.get_states(), pop.get_states()) and np.all(loaded[2]['features'][0] == 2), 'Wrong features'
+  loaded.sort('name', ascending=False)
+  assert np.array_equal(loaded[0]['agent'].flat_genome, pop[5]['agent'].flat_genome), 'Wrong genome after sorting'
+  agents_column = loaded['agent']
+  assert all(a is not None for a in agents_column), 'Agents not created when accessing the column'
+  assert len(loaded._genomes) == 0, 'Created agents still pending' # So that the next accesses do not walk the pop
+  assert loaded['agent'] is agents_column, 'Agents column rebuilt'
+
+  bs_only = population.Population(shapes, agent=agents.DMPAgent, pop_size=0)
+  bs_only.load_pop(str(tmp_path / 'qd_pop'), columns=['bs'])
+  assert np.all(np.stack(bs_only['bs']) == np.stack(pop['bs'])), 'Wrong bs'
+  assert bs_only[0]['features'] is None and bs_only[0]['agent'] is None, 'Loaded columns that were not asked'
+
+def test_load_legacy(tmp_path):
+  pop = population.Population(shapes, agent=agents.DMPAgent, pop_size=3)
+  genomes = {a['name']: {'gen': a['agent'].flat_genome, 'feat': [np.ones(2) * a['name'], None], 'bs': np.ones(2)} for a in pop}
+  with open(str(tmp_path / 'qd_pop.pkl'), 'wb') as file:
+    population.pkl.dump({'Agent Type': 'DMPAgent', 'Genome': genomes}, file)
+
+  loaded = population.Population(shapes, agent=agents.DMPAgent, pop_size=0)
+  loaded.load_pop(str(tmp_path / 'qd_pop.pkl'), columns=['agent', 'features'])
+  assert loaded.size == 3 and loaded[1]['bs'] is None and np.all(loaded[1]['features'][0] == 1), 'Wrong columns'
+  assert np.array_equal(loaded[2]['agent'].flat_genome, pop[2]['agent'].flat_genome), 'Wrong genome'
+
+  # The legacy float states in [0, 1] are scaled when copied in the uint8 state store
+  states = np.random.rand(3, 3, 4, 4)
+  for name, state in zip(genomes, states):
+    genomes[name]['feat'][1] = state
+  with open(str(tmp_path / 'qd_pop.pkl'), 'wb') as file:
+    population.pkl.dump({'Agent Type': 'DMPAgent', 'Genome': genomes}, file)
+  loaded = population.Population(shapes, agent=agents.DMPAgent, pop_size=0, state_store=state_store.StateStore())
+  loaded.load_pop(str(tmp_path / 'qd_pop.pkl'))
+  assert np.array_equal(loaded.get_states(), np.round(states * 255).astype(np.uint8)), 'Wrong legacy states'
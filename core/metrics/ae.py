@@ -188,9 +188,11 @@ class ConvAE(BaseAE):
   def forward(self, x):
     """
     Forward pass of the network.
-    :param x: Input as RGB array of images
+    :param x: Input as RGB array of images. uint8 images are normalized to [0, 1]
     :return: reconstruction error, features, reconstructed image
     """
+    if x.dtype == torch.uint8:  # The frames are kept as bytes until here
+      x = x.float() / 255
     if x.shape[-1] > self.first_subs/4:  # Only subsample if not done yet.
       x = self.subsample(x)
 
@@ -274,6 +276,8 @@ class FFAE(BaseAE):
     :param x: Input
     :return: rec_error, features, reconstructed image
     """
+    if x.dtype == torch.uint8:  # The frames are kept as bytes until here
+      x = x.float() / 255
     if x.shape[-1] > self.first_subs/4:  # Only subsample if not done yet.
       x = self.subsample(x)
 
@@ -392,6 +396,8 @@ class BVAE(BaseAE):
     :return: If training: Rec_error, features, reconstructed image, mu, logvar
              If not training: rec error, features, reconstructed image
     """
+    if x.dtype == torch.uint8:  # The frames are kept as bytes until here
+      x = x.float() / 255
     if x.shape[-1] > self.first_subs/4:  # Only subsample if not done yet.
       x = self.subsample(x)
 
@@ -122,9 +122,11 @@ class RND(nn.Module):
   def forward(self, x):
     '''
     This function calculates the surprise given by the input
-    :param x: Network input. Needs to be a torch tensor.
+    :param x: Network input. Needs to be a torch tensor. uint8 images are normalized to [0, 1]
     :return: surprise as a 1 dimensional torch tensor
     '''
+    if x.dtype == torch.uint8:  # The frames are kept as bytes until here
+      x = x.float() / 255
     if x.shape[-1] > self.first_subs/4:  # Only subsample if not done yet.
       x = self.subsample(x)
 
@@ -49,3 +49,11 @@ def test_training():
 
 
 
+
+def test_uint8_input():
+  encoding_shape = 3
+  net = rnd.RND(encoding_shape, device=device)
+  images = np.random.randint(0, 256, (2, 3, 64, 64), dtype=np.uint8)
+  byte_surprise = net(torch.from_numpy(images).to(device))
+  float_surprise = net(torch.Tensor(images / 255).to(device))
+  assert np.allclose(byte_surprise[0].cpu().data.numpy(), float_surprise[0].cpu().data.numpy(), atol=1e-5), 'uint8 images are not normalized'
@@ -1,7 +1,7 @@
 import numpy as np
 from core.metrics import rnd, ae
 from core.evolution import population, agents
-from core.utils import utils
+from core.utils import utils, rollout, state_store, replay_buffer
 import torch
 import os
 import json
@@ -25,7 +25,7 @@ class RndQD(object):
 
     self.metric_update_steps = 0
     self.metric_update_single_agent = self.params.per_agent_update
-    self.logs = utils.Logger({'Generation':[], 'Avg gen surprise':[], 'Max reward':[], 'Archive size':[], 'Coverage':[]})
+    self.logs = utils.Logger({'Generation':[], 'Avg gen surprise':[], 'Max reward':[], 'Archive size':[], 'Coverage':[], 'Rollout cache hits':[], 'Rollout cache misses':[]})
 
     if self.agent_name == 'Neural':
       agent_type = agents.FFNeuralAgent
@@ -39,9 +39,14 @@ class RndQD(object):
                                             pop_size=self.pop_size)
     self.archive = None
     if self.params.use_archive:
+      archive_states = None
+      if self.params.archive_state_store: # The states of the archive are kept on disk instead of in RAM
+        os.makedirs(self.save_path, exist_ok=True)
+        archive_states = state_store.StateStore(os.path.join(self.save_path, 'archive_states.dat'))
       self.archive = population.Population(agent=agent_type,
                                            shapes=self.agents_shapes,
-                                           pop_size=0)
+                                           pop_size=0,
+                                           state_store=archive_states)
 
     if self.params.gpu:
       self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -50,6 +55,11 @@ class RndQD(object):
 
     print("Seed {} - Using device: {}".format(self.params.seed, self.device))
 
+    # States on which the metric is trained, kept on its device. The first buffer collects the states of the generations
+    # between two metric updates, the second one the states of the archive.
+    self.states_buffer = replay_buffer.ReplayBuffer(self.pop_size * (self.params.update_interval + 1), device=self.device)
+    self.archive_buffer = replay_buffer.ReplayBuffer(device=self.device)
+
     if self.params.metric == 'AE':
       self.metric = ae.ConvAE(device=self.device,
                               learning_rate=self.params.learning_rate,
@@ -65,7 +75,20 @@ class RndQD(object):
     else:
       self.metric = rnd.RND(device=self.device, learning_rate=self.params.learning_rate, encoding_shape=self.params.feature_size)
 
-    self.opt = self.params.optimizer(self.population, archive=self.archive, mutation_rate=self.params.mutation_rate, metric_update_interval=self.params.update_interval)
+    novelty_index_params = dict(self.params.novelty_index_params)
+    if self.params.novelty_index == 'torch': # The torch index keeps the features on the same device of the metric
+      novelty_index_params['device'] = self.device
+    self.opt = self.params.optimizer(self.population, archive=self.archive, mutation_rate=self.params.mutation_rate, metric_update_interval=self.params.update_interval,
+                                     novelty_index=self.params.novelty_index,
+                                     novelty_index_params=novelty_index_params)
+
+    # Workers used to evaluate the agents
+    self.rollouts = rollout.RolloutPool(self.env, self.params.env_tag, agent_type, self.agents_shapes,
+                                        self.params.max_episode_len, seed=self.params.seed,
+                                        workers=self.params.rollout_workers, render=True,
+                                        vec_env=rollout.make_vec_env(self.params.env_tag, self.params.lockstep_envs,
+                                                                       self.params.env_kwargs),
+                                        cache_size=self.params.rollout_cache_size, env_kwargs=self.params.env_kwargs)
 
     self.END = False
     self.elapsed_gen = 0
@@ -74,43 +97,49 @@ class RndQD(object):
   # ---------------------------------------------------
   def evaluate_agent(self, agent):
     """
-    This function evaluates the agent in the environment. This function should be run in parallel
+    This function evaluates the agent in the environment.
     :param agent: agent to evaluate
     :return:
     """
-    done = False
-    cumulated_reward = 0
-
-    obs = self.env.reset()
-    t = 0
-    while not done:
-      if 'FastsimSimpleNavigation' in self.params.env_tag:
-        agent_input = [t / self.params.max_episode_len, obs]  # Observation and time. The time is used to see when to stop the action. TODO move the action stopping outside of the agent
-      elif 'Ant' in self.params.env_tag:
-        agent_input = [t]
-      else:
-        agent_input = [t / self.params.max_episode_len]
-
-      action = utils.action_formatting(self.params.env_tag, agent['agent'](agent_input))
+    return self.process_rollout(agent, self.rollouts.evaluate([agent['agent']], [agent['name']])[0])
 
-      obs, reward, done, info = self.env.step(action)
-      t += 1
-      cumulated_reward += reward
-
-      if  t >= self.params.max_episode_len:
-        done = True
+  def process_rollout(self, agent, result):
+    """
+    Sets the data of the agent from the result of its rollout
+    :param agent: evaluated agent
+    :param result: result of the rollout
+    :return:
+    """
+    state = result['image'] # The image is normalized only by the metric, in prepare_states
 
-      if 'Ant' in self.params.env_tag:
-        CoM = np.array([self.env.robot.body_xyz[:2]])
-        if np.any(np.abs(CoM) >= np.array([3, 3])):
-          done = True
-    state = self.env.render(mode='rgb_array', top_bottom=True)
-    state = state/np.max((np.max(state), 1))
-
-    agent['bs'] = utils.extact_hd_bs(self.env, obs, reward, done, info)
-    agent['reward'] = cumulated_reward
+    agent['bs'] = result['bs']
+    agent['reward'] = result['reward']
     # Here we use instead the features of the AE to calculate the BD. This is done outside this function, in update_agents
-    return state, None, cumulated_reward # TODO check why there is a None here
+    return state, None, result['reward'] # TODO check why there is a None here
+  # ---------------------------------------------------
+
+  # ---------------------------------------------------
+  def prepare_states(self, images, batch_size=16):
+    """
+    Turns the rendered images in the states given to the metric. The images are subsampled to the input size of the
+    metric in small batches, and kept as uint8, scaled so that the brightest pixel of each image is 255. The metric
+    normalizes them to [0, 1] in its forward, so that the full resolution images are never stored as floats.
+    :param images: List of [H, W, 3] images
+    :param batch_size: Number of images subsampled together
+    :return: [N, 3, 64, 64] uint8 tensor
+    """
+    images = torch.from_numpy(np.stack(images)).permute(0, 3, 1, 2)
+    if images.dtype == torch.uint8 and images.shape[-1] <= self.metric.first_subs/4: # The env can already render at low resolution
+      return images.contiguous()
+
+    states = []
+    for batch in torch.split(images, batch_size):
+      batch = batch.float()
+      scale = 255. / torch.clamp(batch.flatten(1).max(dim=1)[0], min=1)
+      if batch.shape[-1] > self.metric.first_subs/4:
+        batch = self.metric.subsample(batch)
+      states.append(torch.round(batch * scale[:, None, None, None]).clamp(0, 255).to(torch.uint8))
+    return torch.cat(states)
   # ---------------------------------------------------
 
   # ---------------------------------------------------
@@ -133,13 +162,9 @@ class RndQD(object):
     :return:
     """
     if not len(self.archive) == 0:
-      feats = self.archive['features'].values
-      state = torch.Tensor([f[1] for f in feats])
-      mini_batches = utils.split_array(state, batch_size=128, shuffle=False) # This is done for when the archive gets sobig that it does not fit in the GPU
-
       min_batch_feat = []
       min_batch_surpr = []
-      for data in mini_batches:
+      for data in replay_buffer.minibatches([self.archive_states()], batch_size=128, shuffle=False):
         surprise, feature, _ = self.metric(data.to(self.device))
         min_batch_surpr.append(surprise.cpu().data.numpy())
         min_batch_feat.append(np.atleast_2d(feature.cpu().data.numpy()))
@@ -161,25 +186,38 @@ class RndQD(object):
 
       for agent, feat in zip(self.archive, feature):
         agent['features'][0] = feat.flatten()
-      self.archive.pop['surprise'] = surprise
+      self.archive['surprise'] = surprise
+      self.archive.features_version += 1
+      self.opt.update_archive_index(rebuild=True) # All the features moved, so the k-NN index has to be rebuilt
   # ---------------------------------------------------
 
   # ---------------------------------------------------
-  def update_metric(self, states, old_states=None):
+  def archive_states(self):
     """
-    This function uses the cumulated state to update the metrics parameters and then empties the cumulated_state
-    :return:
+    Returns the states of the archive as a tensor on the device of the metric. The states of the agents added to the
+    archive since the last call are copied in the archive buffer. If the archive states are in the state store and the
+    metric is on the CPU, they are read directly from the memory-mapped store instead.
+    :return: [archive size, ...] tensor
     """
-    # Take archive data
+    if self.archive.state_store is not None and self.device.type == 'cpu':
+      return torch.from_numpy(self.archive.get_states())
+    if len(self.archive_buffer) > len(self.archive): # The archive has been replaced
+      self.archive_buffer.clear()
+    if len(self.archive_buffer) < len(self.archive): # The archive only grows, so only the new states are copied
+      self.archive_buffer.add(self.archive.get_states(np.arange(len(self.archive_buffer), len(self.archive))))
+    return self.archive_buffer.data
+
+  def update_metric(self):
+    """
+    This function trains the metric for an epoch on the states of the generations since the last update and, if
+    train_on_archive is set, on the archive ones. The minibatches are drawn in random order directly on the device.
+    :return: Features of the last minibatch
+    """
+    states = [self.states_buffer.data]
     if not len(self.archive) == 0 and self.params.train_on_archive:
-      feats = self.archive['features'].values
-      archi_state = torch.Tensor([f[1] for f in feats])
-      total_state = torch.cat((states, archi_state), 0)
-    else:
-      total_state = states
+      states.append(self.archive_states())
     # Split the batch in minibatches of size 128 to have better learning
-    mini_batches = utils.split_array(total_state, batch_size=128)
-    for data in mini_batches:
+    for data in replay_buffer.minibatches(states, batch_size=128):
       loss, f, _ = self.metric.training_step(data.to(self.device))
       self.metric_update_steps += 1
     return f
@@ -192,34 +230,26 @@ class RndQD(object):
     :param steps: number of update steps (or generations)
     :return:
     """
-    inputs = None
     # if 'Ant' in self.params.env_tag: # Need it otherwise cannot init OpenGL
     #   self.env.render()
     for self.elapsed_gen in range(steps):
-      states = []
-      for agent in self.population:
-        state, _, _ = self.evaluate_agent(agent)
-        states.append(state)
-      states = np.stack(states)# - self.running_avg # Center data for training
-      states = self.metric.subsample(torch.Tensor(states).permute(0, 3, 1, 2))
+      # Evaluate all the agents in parallel
+      results = self.rollouts.evaluate(self.population['agent'], self.population['name'])
+      states = self.prepare_states([self.process_rollout(agent, result)[0] for agent, result in zip(self.population, results)])
       if self.params.update_metric:
-        if inputs is None:
-          inputs = states.clone()
-        else:
-          inputs = torch.cat((inputs, states), 0)
+        self.states_buffer.add(states)
 
       avg_gen_surprise = np.mean(self.update_agents(states))
-      max_rew = np.max(self.population['reward'].values)
+      max_rew = np.max(self.population['reward'])
 
       # Pop and archive need to have features from the same update step.
       self.opt.step()
 
       if self.params.update_metric and self.elapsed_gen % self.params.update_interval == 0 and self.elapsed_gen > 0:
         for epoch in range(5):
-          f = self.update_metric(inputs)
+          f = self.update_metric()
           print(f[0].cpu().data)
-        del inputs
-        inputs = None
+        self.states_buffer.clear()
         # Pop and archive need to have features from the same update step, so the archive features are updated everytime the metric is updated
         if not self.params.optimizer_type == 'Surprise':
           self.update_archive_feat()
@@ -241,7 +271,7 @@ class RndQD(object):
         print()
 
       if self.archive is not None:
-        bs_points = np.stack(self.archive['bs'].to_list())
+        bs_points = np.stack(self.archive['bs'])
       else:
         bs_points = np.concatenate([a['bs'] for a in self.population if a['bs'] is not None])
       if 'Ant' in self.params.env_tag:
@@ -263,9 +293,13 @@ class RndQD(object):
       self.logs.register_log('Max reward', max_rew)
       self.logs.register_log('Archive size', self.archive.size)
       self.logs.register_log('Coverage', coverage)
+      cache_hits, cache_misses = self.rollouts.cache_stats
+      self.logs.register_log('Rollout cache hits', cache_hits)
+      self.logs.register_log('Rollout cache misses', cache_misses)
       if self.END:
         print('Seed {} - Quitting.'.format(self.params.seed))
         break
+    self.rollouts.close()
     gc.collect()
   # ---------------------------------------------------
 
@@ -283,7 +317,10 @@ class RndQD(object):
       except:
         print('Seed {} - Cannot create save folder.'.format(self.params.seeds))
     self.population.save_pop(save_subf, 'pop')
-    self.archive.save_pop(save_subf, 'archive')
+    if ckpt: # Only the archive agents added since the last checkpoint are saved
+      self.archive.save_pop_incremental(save_subf, 'archive', self.elapsed_gen)
+    else:
+      self.archive.save_pop(save_subf, 'archive')
     self.metric.save(save_subf)
     self.logs.save(self.save_path)
     print('Seed {} - Done'.format(self.params.seed))
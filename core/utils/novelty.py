@@ -0,0 +1,763 @@
+import numpy as np
+import torch
+
+
+# ---------------------------------------------------
+def distances(points, space, max_chunk_elements=2**22):
+  """
+  Calculates the euclidean distances between each of the points and each of the points in space. For high dimensional
+  points the space is split in chunks, so that no more than max_chunk_elements values are allocated at the same time.
+  :param points: [n, feat_size] array of points
+  :param space: [m, feat_size] array of points
+  :param max_chunk_elements: Maximum number of elements of the temporary arrays
+  :return: [n, m] array of distances, in the type of the points
+  """
+  dists = np.empty((len(points), len(space)), dtype=np.result_type(points, space))
+  chunk = max(1, max_chunk_elements // max(1, np.size(points)))
+  for start in range(0, len(space), chunk):
+    diff = space[None, start:start + chunk, :] - points[:, None, :]
+    dists[:, start:start + chunk] = np.sqrt(np.sum(diff * diff, axis=2))
+  return dists
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------
+def fast_distances(points, space):
+  """
+  Calculates the euclidean distances between each of the points and each of the points in space as
+  sqrt(|p|^2 + |s|^2 - 2 p.s). It is much faster than distances for high dimensional points, but the result can differ
+  from it by rounding errors.
+  :param points: [n, feat_size] array of points
+  :param space: [m, feat_size] array of points
+  :return: [n, m] array of distances
+  """
+  sq_dists = np.sum(points * points, axis=1)[:, None] + np.sum(space * space, axis=1)[None, :] - 2 * np.dot(points, space.T)
+  return np.sqrt(np.maximum(sq_dists, 0))
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------
+def knn_novelty(points, space, k=15, max_chunk_elements=2**22):
+  """
+  Calculates the novelty of the points as the mean distance from their k nearest neighbours in space.
+  The first len(points) elements of space have to be the points themselves: the distance of each point from itself is
+  not considered. The distances are calculated in chunks of points, so that no more than max_chunk_elements values
+  are allocated at the same time.
+  The result is the same of calculating the distances one point at a time: the distances are calculated in the type
+  of the points and the neighbours are averaged in the same order.
+  :param points: [n, feat_size] array of points of which to calculate the novelty
+  :param space: [m, feat_size] array of points wrt which to calculate the novelty, with space[:n] == points
+  :param k: Number of nearest neighbours
+  :param max_chunk_elements: Maximum number of elements of the temporary arrays
+  :return: [n] array of novelty values
+  """
+  points_num = len(points)
+  novelty = np.empty(points_num, dtype=np.result_type(points, space))
+  chunk = max(1, max_chunk_elements // max(1, np.size(space)))
+
+  for start in range(0, points_num, chunk):
+    end = min(points_num, start + chunk)
+    dists = distances(points[start:end], space, max_chunk_elements)
+
+    # Remove the distance of each point from itself, keeping the others in the same order
+    not_self = np.ones(dists.shape, dtype=bool)
+    not_self[np.arange(end - start), np.arange(start, end)] = False
+    dists = dists[not_self].reshape(end - start, -1)
+
+    if dists.shape[1] <= k: # Should never happen
+      novelty[start:end] = np.mean(dists, axis=1)
+    else:
+      idx = np.argpartition(dists, k, axis=1)[:, :k] # Get k nearest neighs
+      novelty[start:end] = np.mean(np.take_along_axis(dists, idx, axis=1), axis=1)
+  return novelty
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+class BaseIndex(object):
+  """
+  Base k-NN index over a growing set of points. The points can be appended one batch at a time and are rebuilt in bulk
+  when all of them change.
+  """
+  approximate = False # True if the neighbours returned by query can differ from the exact ones
+  exact_novelty = False # True if the index calculates itself the novelty, exactly as the per-agent loop
+  dtype = np.float64 # Type used to store the points. If None the points keep their type
+
+  # ---------------------------------
+  def __init__(self):
+    """
+    Constructor
+    """
+    self._points = None
+    self.size = 0
+    self.version = 0 # Increased every time the index is rebuilt, so that cached results can be invalidated
+  # ---------------------------------
+
+  # ---------------------------------
+  @property
+  def points(self):
+    """
+    [size, feat_size] array of the indexed points
+    """
+    return self._points[:self.size]
+
+  def get_points(self, start=0):
+    """
+    Returns the indexed points starting from position start
+    :param start: Position of the first point
+    :return: [size - start, feat_size] array of points
+    """
+    return self.points[start:]
+  # ---------------------------------
+
+  # ---------------------------------
+  def add(self, points):
+    """
+    Appends the points to the index. The storage is grown geometrically, so that appending is amortized O(1)
+    :param points: [n, feat_size] array of points
+    """
+    points = np.atleast_2d(points)
+    dtype = self.dtype
+    if dtype is None:
+      dtype = points.dtype if self._points is None else np.promote_types(self._points.dtype, points.dtype)
+    if self._points is None:
+      self._points = np.empty((max(len(points), 16), points.shape[1]), dtype=dtype)
+    elif self.size + len(points) > len(self._points) or dtype != self._points.dtype:
+      storage = np.empty((max(self.size + len(points), 2 * len(self._points)), self._points.shape[1]), dtype=dtype)
+      storage[:self.size] = self.points
+      self._points = storage
+    self._points[self.size:self.size + len(points)] = points
+    self.size += len(points)
+  # ---------------------------------
+
+  # ---------------------------------
+  def rebuild(self, points):
+    """
+    Substitutes all the points of the index
+    :param points: [n, feat_size] array of points
+    """
+    self._points = None
+    self.size = 0
+    self.version += 1
+    if len(points) > 0:
+      self.add(points)
+  # ---------------------------------
+
+  # ---------------------------------
+  def query(self, points, k):
+    """
+    Finds the k nearest neighbours of the points. Needs to be implemented by inheriting classes
+    :param points: [n, feat_size] array of query points
+    :param k: Number of neighbours
+    :return: [n, min(k, size)] arrays of distances and indexes of the neighbours, sorted by increasing distance
+    """
+    raise NotImplementedError
+  # ---------------------------------
+
+  # ---------------------------------
+  # The following methods work on the distances in the array type of the index, so that an index on a device can
+  # calculate the novelty without moving the intermediate results to the host.
+  def queries(self, points):
+    """
+    Converts the query points in the array type of the index
+    :param points: [n, feat_size] array of points
+    :return: [n, feat_size] array of query points
+    """
+    return np.atleast_2d(points)
+
+  def knn(self, queries, k, start=0):
+    """
+    Finds the distances of the query points from their k nearest neighbours among the indexed points starting from
+    position start.
+    :param queries: [n, feat_size] array of query points, as returned by queries
+    :param k: Number of neighbours
+    :param start: Position of the first indexed point to consider
+    :return: [n, min(k, size - start)] array of distances, sorted by increasing distance
+    """
+    if start == 0:
+      return self.query(queries, k)[0]
+    return knn_distances(queries, self.get_points(start), k)[0]
+
+  def self_knn(self, queries, k):
+    """
+    Finds the distances of the query points from their k nearest neighbours among themselves, without the distance of
+    each point from itself. The points do not need to be in the index.
+    :param queries: [n, feat_size] array of query points, as returned by queries
+    :param k: Number of neighbours
+    :return: [n, min(k, n - 1)] array of distances, sorted by increasing distance
+    """
+    return knn_distances(queries, queries, k + 1, exact=not self.approximate)[0][:, 1:]
+
+  @staticmethod
+  def stack(dists):
+    """
+    Stacks the distances of single points
+    :param dists: List of [k] arrays of distances
+    :return: [n, k] array of distances
+    """
+    return np.stack(dists)
+
+  @staticmethod
+  def merge(dists, other_dists, k):
+    """
+    Merges two sets of neighbours of the same points, keeping the k nearest
+    :param dists: [n, k1] array of distances
+    :param other_dists: [n, k2] array of distances
+    :param k: Number of neighbours
+    :return: [n, min(k, k1 + k2)] array of distances, sorted by increasing distance
+    """
+    return np.sort(np.concatenate([dists, other_dists], axis=1), axis=1)[:, :k]
+
+  @staticmethod
+  def mean(dists):
+    """
+    Averages the distances of each point from its neighbours
+    :param dists: [n, k] array of distances
+    :return: [n] array on the host
+    """
+    return np.mean(dists, axis=1)
+  # ---------------------------------
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+class BruteForceIndex(BaseIndex):
+  """
+  Exact index that calculates all the distances. The points are kept in their type, and the novelty is recalculated
+  from all the distances at each call, so that it is bit-identical to the one of the per-agent loop.
+  """
+  exact_novelty = True
+  dtype = None
+
+  # ---------------------------------
+  def query(self, points, k):
+    """
+    Finds the k nearest neighbours of the points by calculating the distances from all the indexed points.
+    :param points: [n, feat_size] array of query points
+    :param k: Number of neighbours
+    :return: [n, min(k, size)] arrays of distances and indexes of the neighbours, sorted by increasing distance
+    """
+    return knn_distances(points, self.points, k)
+  # ---------------------------------
+
+  # ---------------------------------
+  def novelty(self, points, k=15):
+    """
+    Calculates the novelty of the points wrt themselves and the points in the index, with knn_novelty
+    :param points: [n, feat_size] array of points
+    :param k: Number of nearest neighbours
+    :return: [n] array of novelty values
+    """
+    space = points
+    if self.size > 0:
+      space = np.concatenate([points, self.points])
+    return knn_novelty(points, space, k)
+  # ---------------------------------
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+class KDTreeIndex(BaseIndex):
+  """
+  Exact index for low dimensional points. The points are stored in a KD-tree plus a small buffer of the last appended
+  points, that is searched by brute force. The tree is rebuilt only when the buffer grows bigger than a fraction of the
+  tree, so that appending stays amortized O(log n).
+  """
+  # ---------------------------------
+  def __init__(self, buffer_ratio=0.25, min_buffer=256):
+    """
+    Constructor
+    :param buffer_ratio: Fraction of the tree size that the buffer can reach before the tree is rebuilt
+    :param min_buffer: Minimum size of the buffer
+    """
+    super(KDTreeIndex, self).__init__()
+    self.buffer_ratio = buffer_ratio
+    self.min_buffer = min_buffer
+    self.tree = None
+    self.tree_size = 0
+  # ---------------------------------
+
+  # ---------------------------------
+  def add(self, points):
+    """
+    Appends the points to the buffer, rebuilding the tree if the buffer got too big
+    :param points: [n, feat_size] array of points
+    """
+    super(KDTreeIndex, self).add(points)
+    if self.size - self.tree_size > max(self.min_buffer, self.buffer_ratio * self.tree_size):
+      self._build_tree()
+
+  def rebuild(self, points):
+    """
+    Substitutes all the points of the index and rebuilds the tree
+    :param points: [n, feat_size] array of points
+    """
+    super(KDTreeIndex, self).rebuild(points)
+    self._build_tree()
+
+  def _build_tree(self):
+    """
+    Builds the tree over all the points
+    """
+    from scipy.spatial import cKDTree
+    self.tree = cKDTree(self.points) if self.size > 0 else None
+    self.tree_size = self.size
+  # ---------------------------------
+
+  # ---------------------------------
+  def query(self, points, k):
+    """
+    Finds the k nearest neighbours of the points, among the tree and the buffer.
+    :param points: [n, feat_size] array of query points
+    :param k: Number of neighbours
+    :return: [n, min(k, size)] arrays of distances and indexes of the neighbours, sorted by increasing distance
+    """
+    points = np.atleast_2d(points)
+    dists = np.empty((len(points), 0))
+    idx = np.empty((len(points), 0), dtype=int)
+    if self.tree_size > 0:
+      dists, idx = self.tree.query(points, k=min(k, self.tree_size))
+      dists, idx = dists.reshape(len(points), -1), idx.reshape(len(points), -1)
+    if self.size > self.tree_size:
+      buffer_dists, buffer_idx = knn_distances(points, self.points[self.tree_size:], k)
+      dists = np.concatenate([dists, buffer_dists], axis=1)
+      idx = np.concatenate([idx, buffer_idx + self.tree_size], axis=1)
+      order = np.argsort(dists, axis=1)[:, :k]
+      dists, idx = np.take_along_axis(dists, order, axis=1), np.take_along_axis(idx, order, axis=1)
+    return dists, idx
+  # ---------------------------------
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------
+def knn_distances(points, space, k, max_chunk_elements=2**22, exact=True):
+  """
+  Finds by brute force the k nearest neighbours in space of each of the points.
+  :param points: [n, feat_size] array of query points
+  :param space: [m, feat_size] array of points
+  :param k: Number of neighbours
+  :param max_chunk_elements: Maximum number of elements of the temporary arrays
+  :param exact: If False the distances are calculated with fast_distances
+  :return: [n, min(k, m)] arrays of distances and indexes of the neighbours, sorted by increasing distance
+  """
+  points = np.atleast_2d(points)
+  k = min(k, len(space))
+  dists = np.empty((len(points), k), dtype=np.result_type(points, space))
+  idx = np.empty((len(points), k), dtype=int)
+  if exact:
+    chunk = max(1, max_chunk_elements // max(1, np.size(space)))
+  else:
+    chunk = max(1, max_chunk_elements // max(1, len(space)))
+
+  for start in range(0, len(points), chunk):
+    end = min(len(points), start + chunk)
+    if exact:
+      chunk_dists = distances(points[start:end], space, max_chunk_elements)
+    else:
+      chunk_dists = fast_distances(points[start:end], space)
+    if k < len(space):
+      chunk_idx = np.argpartition(chunk_dists, k - 1, axis=1)[:, :k]
+    else:
+      chunk_idx = np.tile(np.arange(len(space)), (end - start, 1))
+    chunk_dists = np.take_along_axis(chunk_dists, chunk_idx, axis=1)
+    order = np.argsort(chunk_dists, axis=1)
+    dists[start:end] = np.take_along_axis(chunk_dists, order, axis=1)
+    idx[start:end] = np.take_along_axis(chunk_idx, order, axis=1)
+  return dists, idx
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+class LSHIndex(BaseIndex):
+  """
+  Approximate index for high dimensional points, based on random projection LSH. Each table hashes the points with the
+  signs of their projections on a set of random hyperplanes, so that close points are likely to end up in the same
+  bucket. The neighbours are then searched exactly only among the points sharing a bucket with the query.
+  More tables give higher recall, more bits give smaller buckets and so faster queries. The points are stored as
+  float32 to halve the memory.
+  """
+  approximate = True
+  dtype = np.float32
+
+  # ---------------------------------
+  def __init__(self, tables=16, bits=10, seed=None):
+    """
+    Constructor
+    :param tables: Number of hash tables
+    :param bits: Number of hyperplanes, and so of bits of the hash, of each table
+    :param seed: Seed used to generate the hyperplanes
+    """
+    super(LSHIndex, self).__init__()
+    self.tables = tables
+    self.bits = bits
+    self.rnd = np.random.RandomState(seed)
+    self.planes = None
+    self.center = None
+    self.buckets = [{} for _ in range(self.tables)]
+  # ---------------------------------
+
+  # ---------------------------------
+  def _hash(self, points):
+    """
+    Calculates the hash of the points in each of the tables
+    :param points: [n, feat_size] array of points
+    :return: [n, tables] array of hashes
+    """
+    signs = (np.dot(points - self.center, self.planes) > 0).reshape(len(points), self.tables, self.bits)
+    return np.dot(signs, 1 << np.arange(self.bits))
+  # ---------------------------------
+
+  # ---------------------------------
+  def add(self, points):
+    """
+    Appends the points to the index and to the buckets of the tables
+    :param points: [n, feat_size] array of points
+    """
+    points = np.atleast_2d(points).astype(self.dtype)
+    if self.planes is None:
+      # The hyperplanes pass through the center of the first points, so that they split them evenly
+      self.center = np.mean(points, axis=0)
+      self.planes = self.rnd.randn(points.shape[1], self.tables * self.bits).astype(self.dtype)
+    start = self.size
+    super(LSHIndex, self).add(points)
+
+    hashes = self._hash(points)
+    for table, table_hashes in zip(self.buckets, hashes.T):
+      for h in np.unique(table_hashes):
+        new_points = start + np.flatnonzero(table_hashes == h)
+        table[h] = np.concatenate([table[h], new_points]) if h in table else new_points
+
+  def rebuild(self, points):
+    """
+    Substitutes all the points of the index. The hyperplanes are regenerated around the new points.
+    :param points: [n, feat_size] array of points
+    """
+    self.planes = None
+    self.buckets = [{} for _ in range(self.tables)]
+    super(LSHIndex, self).rebuild(points)
+  # ---------------------------------
+
+  # ---------------------------------
+  def query(self, points, k):
+    """
+    Finds the approximate k nearest neighbours of the points among the points sharing a bucket with them. If less than
+    k candidates are found, all the points are searched.
+    :param points: [n, feat_size] array of query points
+    :param k: Number of neighbours
+    :return: [n, min(k, size)] arrays of distances and indexes of the neighbours, sorted by increasing distance
+    """
+    points = np.atleast_2d(points).astype(np.float64)
+    k = min(k, self.size)
+    dists = np.empty((len(points), k))
+    idx = np.empty((len(points), k), dtype=int)
+    if k == 0:
+      return dists, idx
+
+    empty = np.empty(0, dtype=int)
+    for i, point_hashes in enumerate(self._hash(points)):
+      candidates = np.unique(np.concatenate([table.get(h, empty) for table, h in zip(self.buckets, point_hashes)]))
+      if len(candidates) < k:
+        candidates = np.arange(self.size)
+      # The distances are calculated in double precision to avoid the rounding errors of fast_distances
+      cand_dists, cand_idx = knn_distances(points[i:i+1], self.points[candidates].astype(np.float64), k, exact=False)
+      dists[i], idx[i] = cand_dists[0], candidates[cand_idx[0]]
+    return dists, idx
+  # ---------------------------------
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+class TorchIndex(BaseIndex):
+  """
+  Exact index that keeps the points in a torch tensor on the given device and calculates the distances with
+  torch.cdist in batches. On GPU, or on multi-core CPUs thanks to the threaded torch kernels, this is faster than the
+  NumPy brute force. Only the final results are moved back to the host.
+  """
+  # ---------------------------------
+  def __init__(self, device=None, dtype=torch.float32, max_chunk_elements=2**24):
+    """
+    Constructor
+    :param device: Device on which to store the points and calculate the distances
+    :param dtype: Torch type of the stored points
+    :param max_chunk_elements: Maximum number of elements of the distance matrices
+    """
+    super(TorchIndex, self).__init__()
+    self.device = device if device is not None else torch.device('cpu')
+    self.tensor_dtype = dtype
+    self.max_chunk_elements = max_chunk_elements
+  # ---------------------------------
+
+  # ---------------------------------
+  @property
+  def points(self):
+    """
+    [size, feat_size] array of the indexed points
+    """
+    return self.tensor_points.cpu().numpy()
+
+  @property
+  def tensor_points(self):
+    """
+    [size, feat_size] tensor of the indexed points
+    """
+    return self._points[:self.size]
+
+  def get_points(self, start=0):
+    """
+    Returns the indexed points starting from position start. Only these are moved to the host.
+    :param start: Position of the first point
+    :return: [size - start, feat_size] array of points
+    """
+    return self.tensor_points[start:].cpu().numpy()
+
+  def _to_tensor(self, points):
+    """
+    Moves the points on the device of the index
+    :param points: [n, feat_size] array of points
+    :return: [n, feat_size] tensor
+    """
+    return torch.as_tensor(np.atleast_2d(points), dtype=self.tensor_dtype, device=self.device)
+  # ---------------------------------
+
+  # ---------------------------------
+  def add(self, points):
+    """
+    Appends the points to the index. The storage is grown geometrically, so that appending is amortized O(1)
+    :param points: [n, feat_size] array of points
+    """
+    points = self._to_tensor(points)
+    if self._points is None:
+      self._points = torch.empty((max(len(points), 16), points.shape[1]), dtype=self.tensor_dtype, device=self.device)
+    elif self.size + len(points) > len(self._points):
+      storage = torch.empty((max(self.size + len(points), 2 * len(self._points)), self._points.shape[1]),
+                            dtype=self.tensor_dtype, device=self.device)
+      storage[:self.size] = self.tensor_points
+      self._points = storage
+    self._points[self.size:self.size + len(points)] = points
+    self.size += len(points)
+  # ---------------------------------
+
+  # ---------------------------------
+  def _knn(self, queries, space, k, exclude_self=False):
+    """
+    Finds the k nearest neighbours in space of the query points, calculating the distances in chunks on the device
+    :param queries: [n, feat_size] tensor of query points
+    :param space: [m, feat_size] tensor of points
+    :param k: Number of neighbours
+    :param exclude_self: If True space has to be queries, and the distance of each point from itself is not considered
+    :return: [n, min(k, m)] tensors of distances and indexes of the neighbours, sorted by increasing distance
+    """
+    k = min(k, len(space) - 1 if exclude_self else len(space))
+    dists, idx = [], []
+    chunk = max(1, self.max_chunk_elements // max(1, len(space)))
+    with torch.no_grad():
+      for start in range(0, len(queries), chunk):
+        d = torch.cdist(queries[start:start + chunk], space)
+        if exclude_self:
+          rows = torch.arange(len(d), device=self.device)
+          d[rows, rows + start] = float('inf')
+        chunk_dists, chunk_idx = torch.topk(d, k, dim=1, largest=False, sorted=True)
+        dists.append(chunk_dists)
+        idx.append(chunk_idx)
+    if len(dists) == 0:
+      return torch.empty((0, k), dtype=self.tensor_dtype, device=self.device), \
+             torch.empty((0, k), dtype=torch.long, device=self.device)
+    return torch.cat(dists), torch.cat(idx)
+
+  def query(self, points, k):
+    """
+    Finds the k nearest neighbours of the points.
+    :param points: [n, feat_size] array of query points
+    :param k: Number of neighbours
+    :return: [n, min(k, size)] arrays of distances and indexes of the neighbours, sorted by increasing distance
+    """
+    dists, idx = self._knn(self._to_tensor(points), self.tensor_points, k)
+    return dists.cpu().double().numpy(), idx.cpu().numpy()
+  # ---------------------------------
+
+  # ---------------------------------
+  def queries(self, points):
+    """
+    Moves the query points on the device of the index
+    :param points: [n, feat_size] array of points
+    :return: [n, feat_size] tensor of query points
+    """
+    return self._to_tensor(points)
+
+  def knn(self, queries, k, start=0):
+    """
+    Finds the distances of the query points from their k nearest neighbours among the indexed points starting from
+    position start. The distances stay on the device.
+    :param queries: [n, feat_size] tensor of query points
+    :param k: Number of neighbours
+    :param start: Position of the first indexed point to consider
+    :return: [n, min(k, size - start)] tensor of distances, sorted by increasing distance
+    """
+    return self._knn(queries, self.tensor_points[start:], k)[0]
+
+  def self_knn(self, queries, k):
+    """
+    Finds the distances of the query points from their k nearest neighbours among themselves, without the distance of
+    each point from itself. The distances stay on the device.
+    :param queries: [n, feat_size] tensor of query points
+    :param k: Number of neighbours
+    :return: [n, min(k, n - 1)] tensor of distances, sorted by increasing distance
+    """
+    return self._knn(queries, queries, k, exclude_self=True)[0]
+
+  @staticmethod
+  def stack(dists):
+    """
+    Stacks the distances of single points on the device
+    :param dists: List of [k] tensors of distances
+    :return: [n, k] tensor of distances
+    """
+    return torch.stack(dists)
+
+  @staticmethod
+  def merge(dists, other_dists, k):
+    """
+    Merges two sets of neighbours of the same points on the device, keeping the k nearest
+    :param dists: [n, k1] tensor of distances
+    :param other_dists: [n, k2] tensor of distances
+    :param k: Number of neighbours
+    :return: [n, min(k, k1 + k2)] tensor of distances, sorted by increasing distance
+    """
+    return torch.sort(torch.cat([dists, other_dists], dim=1), dim=1)[0][:, :k]
+
+  @staticmethod
+  def mean(dists):
+    """
+    Averages the distances of each point from its neighbours. Only the result is moved to the host
+    :param dists: [n, k] tensor of distances
+    :return: [n] array on the host
+    """
+    return dists.mean(dim=1).cpu().double().numpy()
+  # ---------------------------------
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+class NoveltyCache(object):
+  """
+  Caches for each query point the distances from its k nearest neighbours in an index. When the same point is queried
+  again, only the distances from the points added to the index in the meantime are calculated, so that the cost is
+  proportional to the new data and not to the size of the index. The cache is invalidated when the index is rebuilt.
+  Indexes with exact_novelty (the brute force one) are not cached, and calculate the novelty themselves.
+  """
+  # ---------------------------------
+  def __init__(self, index):
+    """
+    Constructor
+    :param index: k-NN index
+    """
+    self.index = index
+    self.entries = {} # key -> (point, distances, index size, index version, k)
+  # ---------------------------------
+
+  # ---------------------------------
+  def _is_valid(self, entry, point, k):
+    """
+    Checks if the cached entry can be used for the point
+    :param entry: Cached entry
+    :param point: Query point
+    :param k: Number of neighbours
+    """
+    return entry is not None and entry[3] == self.index.version and entry[4] == k and entry[2] <= self.index.size \
+           and np.array_equal(entry[0], point)
+
+  def index_knn(self, keys, points, k, queries=None):
+    """
+    Finds the distances of the points from their k nearest neighbours in the index. The results are cached with the
+    given keys, and only the results for the keys of this call are kept. The distances are kept in the array type of
+    the index, so that for an index on a device they never leave it.
+    :param keys: Keys identifying the query points (e.g. the agents names)
+    :param points: [n, feat_size] array of query points
+    :param k: Number of neighbours
+    :param queries: The points converted by index.queries. If None they are converted here
+    :return: [n, min(k, size)] array of distances, sorted by increasing distance
+    """
+    points = np.atleast_2d(points)
+    if queries is None:
+      queries = self.index.queries(points)
+    size = self.index.size
+    dists = [None] * len(points)
+
+    # Group the points according to the size of the index at the moment in which they were cached
+    groups = {}
+    for i, (key, point) in enumerate(zip(keys, points)):
+      entry = self.entries.get(key)
+      groups.setdefault(entry[2] if self._is_valid(entry, point, k) else 0, []).append(i)
+
+    for cached_size, rows in groups.items():
+      if cached_size == 0:
+        group_dists = self.index.knn(queries[rows], k)
+      else:
+        group_dists = self.index.stack([self.entries[keys[i]][1] for i in rows])
+        if cached_size < size: # Only the distances from the points added in the meantime are calculated
+          group_dists = self.index.merge(group_dists, self.index.knn(queries[rows], k, start=cached_size), k)
+      for i, d in zip(rows, group_dists):
+        dists[i] = d
+
+    self.entries = {key: (point.copy(), d, size, self.index.version, k) for key, point, d in zip(keys, points, dists)}
+    return self.index.stack(dists)
+  # ---------------------------------
+
+  # ---------------------------------
+  def novelty(self, keys, points, k=15):
+    """
+    Calculates the novelty of the points wrt themselves and the points in the index, using the cached distances from
+    the index. All the distances are calculated by the index, and only the novelty is returned on the host.
+    :param keys: Keys identifying the points (e.g. the agents names)
+    :param points: [n, feat_size] array of points
+    :param k: Number of nearest neighbours
+    :return: [n] array of novelty values
+    """
+    points = np.atleast_2d(points)
+    if self.index.exact_novelty: # All the distances are needed to average the neighbours in the order of the loop
+      return self.index.novelty(points, k)
+    queries = self.index.queries(points)
+    dists = self.index.self_knn(queries, k)
+    if self.index.size > 0:
+      dists = self.index.merge(dists, self.index_knn(keys, points, k, queries), k)
+    return self.index.mean(dists)
+  # ---------------------------------
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------
+def knn_recall(index, points, k=15):
+  """
+  Measures how many of the exact k nearest neighbours of the points are found by the index.
+  :param index: k-NN index
+  :param points: [n, feat_size] array of query points
+  :param k: Number of neighbours
+  :return: Fraction of the exact neighbours found, averaged over the points
+  """
+  if index.size == 0:
+    return 1.
+  exact = knn_distances(points, index.points, k, exact=False)[1]
+  approx = index.query(points, k)[1]
+  return np.mean([len(np.intersect1d(e, a)) / len(e) for e, a in zip(exact, approx)])
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------
+def get_index(name, **kwargs):
+  """
+  Creates the k-NN index with the given name
+  :param name: 'brute', 'kdtree', 'lsh' or 'torch'
+  :param kwargs: Parameters of the index
+  :return: The index
+  """
+  if name == 'brute':
+    return BruteForceIndex(**kwargs)
+  elif name == 'kdtree':
+    return KDTreeIndex(**kwargs)
+  elif name == 'lsh':
+    return LSHIndex(**kwargs)
+  elif name == 'torch':
+    return TorchIndex(**kwargs)
+  else:
+    raise ValueError('Wrong novelty index specified: {}'.format(name))
+# ---------------------------------------------------
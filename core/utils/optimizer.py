@@ -1,4 +1,6 @@
 import numpy as np
+from core.evolution import agents
+from core.utils import novelty
 
 
 # ----------------------------------------------------------
@@ -7,9 +9,14 @@ class BaseOptimizer(object):
   Bsse optimizer class
   """
   # -----------------------------
-  def __init__(self, pop, mutation_rate=.9, archive=None, metric_update_interval=30):
+  def __init__(self, pop, mutation_rate=.9, archive=None, metric_update_interval=30, novelty_index='brute',
+               novelty_index_params=None):
     self.pop = pop
     self.archive = archive
+    # k-NN index over the archive features
+    self.archive_index = novelty.get_index(novelty_index, **(novelty_index_params or {}))
+    # Distances of the pop from the archive, so that at each generation only the new data has to be considered
+    self.novelty_cache = novelty.NoveltyCache(self.archive_index)
     self.mutation_rate = mutation_rate
     self.step_count = 0
     self.min_surprise = 0
@@ -23,27 +30,49 @@ class BaseOptimizer(object):
     The novelty is calculated wrt to the population and the archive.
     :return:
     """
-    for agent_idx in range(self.pop.size):
-      bs_point = self.pop[agent_idx]['features'][0] # Get agent features
-
-      bs_space = np.stack([a[0] for a in self.pop['features'].values]) # Get pop features
-      bs_space = np.delete(bs_space, agent_idx, axis=0) # Remove agent features from list
-      if self.archive.size > 0:
-        archive_bs_space = np.stack([a[0] for a in self.archive['features'].values]) # Get archive features
-        bs_space = np.concatenate([bs_space, archive_bs_space]) # Stack pop and archive feats
-
-      # Get distances
-      diff = np.atleast_2d(bs_space - bs_point)
-      dists = np.sqrt(np.sum(diff * diff, axis=1))
-      k = 15
-      if len(dists) <= k:  # Should never happen
-        idx = list(range(len(dists)))
-        k = len(idx)
-      else:
-        idx = np.argpartition(dists, k)  # Get 15 nearest neighs
+    bs_points = np.stack([a[0] for a in self.pop['features']]) # Get pop features
+    bs_points = bs_points.reshape(len(bs_points), -1) # Features can also be scalars
+    self.update_archive_index()
+    self.pop['novelty'] = self.novelty_cache.novelty(self.pop['name'], bs_points, k=15)
+  # -----------------------------
 
-      mean_k_dist = np.mean(dists[idx[:k]])
-      self.pop[agent_idx]['novelty'] = mean_k_dist
+  # -----------------------------
+  def update_archive_index(self, rebuild=False):
+    """
+    Adds to the k-NN index the features of the archive agents that are not indexed yet. The archive only grows, so the
+    new agents are always the last ones.
+    :param rebuild: If true the whole index is rebuilt. Needed when the features of the archive change.
+    """
+    if self.archive is None:
+      return
+    if rebuild or self.archive_index.size > self.archive.size:
+      self.archive_index.rebuild(self._archive_features(0))
+    elif self.archive_index.size < self.archive.size:
+      self.archive_index.add(self._archive_features(self.archive_index.size))
+
+  def novelty_recall(self, sample=20):
+    """
+    Measures how many of the exact 15 nearest neighbours in the archive of a sample of the pop are found by the archive
+    index. Useful to tune the approximate indexes.
+    :param sample: Number of agents of the pop on which to measure the recall
+    :return: Recall of the index
+    """
+    feats = [a[0] for a in self.pop['features'] if a is not None and a[0] is not None]
+    if len(feats) == 0:
+      return 1.
+    sample = np.random.choice(len(feats), min(sample, len(feats)), replace=False)
+    return novelty.knn_recall(self.archive_index, np.stack([feats[i] for i in sample]), k=15)
+
+  def _archive_features(self, start):
+    """
+    Returns the features of the archive agents starting from position start
+    :param start: Position of the first agent
+    :return: [n, feat_size] array of features
+    """
+    feats = self.archive['features'][start:]
+    if len(feats) == 0:
+      return np.empty((0, 0))
+    return np.stack([a[0] for a in feats]).reshape(len(feats), -1)
   # -----------------------------
 
   # -----------------------------
@@ -51,14 +80,15 @@ class BaseOptimizer(object):
     """
     This function updates the archive and the pop according to the surprise metric.
     """
-    novel = self.pop['surprise'].sort_values(ascending=False)
-    best = novel.iloc[:5].index.values # Get 5 best agents
-    worst = novel.iloc[-len(best):].index.values  # Get worst ones
+    novel = np.argsort(-self.pop['surprise'], kind='stable') # Sort agents by decreasing surprise
+    best = novel[:5] # Get 5 best agents
+    worst = novel[-len(best):]  # Get worst ones
 
     if self.archive is not None:
       for idx in best:
-        if self.pop[idx]['name'] not in self.archive['name'].values:
+        if self.pop[idx]['name'] not in self.archive['name']:
           self.archive.add(self.pop.copy(idx, with_data=True))  # Only add the most novel ones
+      self.update_archive_index()
 
     # Get a copy of the best agents
     new_gen = []
@@ -76,14 +106,15 @@ class BaseOptimizer(object):
     """
     This function updates the archive adn the pop according to the novelty metric.
     """
-    novel = self.pop['novelty'].sort_values(ascending=False)
-    best = novel.iloc[:5].index.values  # Get 5 best
-    dead = novel.iloc[-5:].index.values  # Get 5 worst
+    novel = np.argsort(-self.pop['novelty'], kind='stable') # Sort agents by decreasing novelty
+    best = novel[:5]  # Get 5 best
+    dead = novel[-5:]  # Get 5 worst
 
     if self.archive is not None:
       for idx in best:
-        if self.pop[idx]['name'] not in self.archive['name'].values:
+        if self.pop[idx]['name'] not in self.archive['name']:
           self.archive.add(self.pop.copy(idx, with_data=True))  # Only add the most novel ones
+      self.update_archive_index()
 
     # Get a copy of the best ones
     new_gen = []
@@ -96,17 +127,34 @@ class BaseOptimizer(object):
       self.pop[i] = new_agent
   # -----------------------------
 
+  # -----------------------------
+  def _mutate_agents(self, agents_idx):
+    """
+    Mutates the selected agents of the pop all at once: their flat genomes are stacked in a matrix that is mutated with
+    a single call and then written back into the agents.
+    :param agents_idx: Indexes of the agents to mutate
+    """
+    if len(agents_idx) == 0:
+      return
+    pop_agents = self.pop['agent']
+    selected = [pop_agents[i] for i in agents_idx]
+    genomes = np.stack([a.flat_genome for a in selected])
+    agents.mutate_flat_genomes(genomes, selected[0].mutation_spec, selected[0].mutation_operator)
+    for a, g in zip(selected, genomes):
+      a.load_flat_genome(g)
+  # -----------------------------
+
   # -----------------------------
   def mutate_pop(self):
     """
     This function mutates the population
     """
-    for a in self.pop:
-      if np.random.random() <= self.mutation_rate:
-        a['agent'].mutate()
-        a['name'] = self.pop.agent_name  # When an agent is mutated it also changes name, otherwise it will never be added to the archive
-        self.pop.agent_name += 1
-      a['best'] = False
+    mutated = np.flatnonzero(np.random.random(self.pop.size) <= self.mutation_rate)
+    self._mutate_agents(mutated)
+    # When an agent is mutated it also changes name, otherwise it will never be added to the archive
+    self.pop['name'][mutated] = self.pop.agent_name + np.arange(len(mutated))
+    self.pop.agent_name += len(mutated)
+    self.pop['best'] = False
 
     self.step_count += 1
   # -----------------------------
@@ -132,9 +180,9 @@ class FitnessOptimizer(BaseOptimizer):
     Optimization step
     :param kwargs:
     """
-    rewards = self.pop['reward'].sort_values(ascending=False) # Get rewards of population
-    best = rewards.iloc[:5].index.values # Get 5 best
-    worst = rewards.iloc[-5:].index.values # Get 5 worst
+    rewards = np.argsort(-self.pop['reward'], kind='stable') # Sort agents by decreasing reward
+    best = rewards[:5] # Get 5 best
+    worst = rewards[-5:] # Get 5 worst
 
     # Get a copy of the best agents
     new_gen = []
@@ -147,10 +195,9 @@ class FitnessOptimizer(BaseOptimizer):
       self.pop[i] = new_agent
 
     # Mutate pop that are not best
-    for a in self.pop:
-      if np.random.random() <= self.mutation_rate and not a['best']:
-        a['agent'].mutate()
-      a['best'] = False # For the new gen no one is best yet
+    mutated = np.flatnonzero((np.random.random(self.pop.size) <= self.mutation_rate) & ~self.pop['best'])
+    self._mutate_agents(mutated)
+    self.pop['best'] = False # For the new gen no one is best yet
   # -----------------------------
 # ----------------------------------------------------------
 
@@ -0,0 +1,111 @@
+import torch
+
+
+# ---------------------------------------------------------------------------
+class ReplayBuffer(object):
+  """
+  Append-only buffer of states kept in a preallocated tensor on the device of the metric. The tensor is grown
+  geometrically, so that adding states is amortized O(1), and is reused after the buffer is cleared.
+  """
+
+  # ---------------------------------
+  def __init__(self, capacity=1024, device=None):
+    """
+    Constructor
+    :param capacity: Number of states for which to preallocate the buffer
+    :param device: Device on which the states are kept
+    """
+    self.device = torch.device('cpu') if device is None else device
+    self._initial_capacity = max(capacity, 1)
+    self._data = None # Allocated when the first states are added, given that their shape and type are not known before
+    self._size = 0
+
+  def __len__(self):
+    return self._size
+
+  @property
+  def size(self):
+    """
+    Number of states in the buffer
+    """
+    return self._size
+
+  @property
+  def data(self):
+    """
+    View on the states in the buffer
+    """
+    if self._data is None:
+      return None
+    return self._data[:self._size]
+  # ---------------------------------
+
+  # ---------------------------------
+  def _reserve(self, capacity, like):
+    """
+    Grows the buffer so that it can contain at least capacity states. The capacity is doubled at each growth.
+    :param capacity: Needed capacity
+    :param like: Tensor of states with the shape and type of the ones in the buffer
+    """
+    if self._data is not None and capacity <= len(self._data):
+      return
+    old_capacity = 0 if self._data is None else len(self._data)
+    new_capacity = max(capacity, 2 * old_capacity, self._initial_capacity)
+    data = torch.empty((new_capacity,) + tuple(like.shape[1:]), dtype=like.dtype, device=self.device)
+    if self._size > 0:
+      data[:self._size] = self._data[:self._size]
+    self._data = data
+  # ---------------------------------
+
+  # ---------------------------------
+  def add(self, states):
+    """
+    Adds the states at the end of the buffer
+    :param states: [n, ...] tensor or array of states
+    """
+    states = torch.as_tensor(states)
+    if len(states) == 0:
+      return
+    self._reserve(self._size + len(states), states)
+    self._data[self._size:self._size + len(states)] = states.to(self.device)
+    self._size += len(states)
+
+  def clear(self):
+    """
+    Empties the buffer, keeping the allocated memory
+    """
+    self._size = 0
+  # ---------------------------------
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+def minibatches(tensors, batch_size=128, shuffle=True):
+  """
+  Iterates over the states of all the tensors together in minibatches. The states are gathered by index on the device
+  of the tensors, without copying them on the host.
+  :param tensors: List of [n, ...] tensors of states, all on the same device (e.g. the data of the buffers)
+  :param batch_size: Size of the minibatches. The last one can be smaller
+  :param shuffle: If True the states are drawn in random order
+  :return: Generator of [batch_size, ...] tensors
+  """
+  tensors = [t for t in tensors if t is not None and len(t) > 0]
+  if len(tensors) == 0:
+    return
+  total = sum(len(t) for t in tensors)
+  if shuffle:
+    order = torch.randperm(total, device=tensors[0].device)
+  else:
+    order = torch.arange(total, device=tensors[0].device)
+  starts = [0]
+  for t in tensors:
+    starts.append(starts[-1] + len(t))
+
+  for k in range(0, total, batch_size):
+    idx = order[k:k + batch_size]
+    if len(tensors) == 1:
+      yield tensors[0].index_select(0, idx) if shuffle else tensors[0][k:k + batch_size]
+    else: # index_select is much faster than indexing on the CPU
+      yield torch.cat([t.index_select(0, idx[(idx >= start) & (idx < end)] - start)
+                       for t, start, end in zip(tensors, starts[:-1], starts[1:])])
+# ---------------------------------------------------------------------------
@@ -0,0 +1,459 @@
+import numpy as np
+import multiprocessing as mp
+import hashlib
+from collections import OrderedDict
+from core.utils import utils
+from core.evolution import agents as agents_lib
+
+
+# ---------------------------------------------------
+def make_env(env_tag, env_kwargs=None):
+  """
+  Creates the environment, importing the package in which it is registered
+  :param env_tag: Name of the environment
+  :param env_kwargs: Dict of arguments of the environment
+  :return: The environment
+  """
+  import gym
+  if 'Billiard' in env_tag:
+    import gym_billiard
+  elif 'Fastsim' in env_tag:
+    import gym_fastsim
+  elif 'Ant' in env_tag:
+    import pybulletgym
+  return gym.make(env_tag, **(env_kwargs or {}))
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------
+def make_vec_env(env_tag, num_envs, env_kwargs=None):
+  """
+  Creates the vectorized version of the environment, if there is one
+  :param env_tag: Name of the environment
+  :param num_envs: Number of parallel envs. If 0 no vectorized env is created
+  :param env_kwargs: Dict of arguments of the environment. Only the rendering resolution, the physics fidelity, the
+  physics backend and the action repeat are used by the vectorized env
+  :return: The vectorized environment or None
+  """
+  if num_envs > 0 and env_tag == 'Billiard-v0':
+    # Created directly, given that the gym wrappers expect the step results of a single env
+    from gym_billiard.envs import VecBilliardEnv
+    vec_kwargs = {k: v for k, v in (env_kwargs or {}).items() if k in ['render_resolution', 'fidelity', 'backend', 'action_repeat']}
+    return VecBilliardEnv(num_envs=num_envs, auto_reset=False, **vec_kwargs)
+  return None
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------
+def rollout_seed(seed, name):
+  """
+  Calculates the seed of the rollout of an agent. It depends only on the seed of the experiment and on the name of the
+  agent, so that the results do not depend on which worker evaluates the agent.
+  :param seed: Seed of the experiment
+  :param name: Name of the agent
+  :return: The seed
+  """
+  return int(np.random.SeedSequence([int(seed), int(name)]).generate_state(1)[0])
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------
+def time_inputs(env_tag, max_episode_len):
+  """
+  Time inputs given to the agents at each step of the episode
+  :param env_tag: Name of the environment
+  :param max_episode_len: Maximum length of the episode
+  :return: [max_episode_len] array of inputs
+  """
+  if 'Ant' in env_tag:
+    return np.arange(max_episode_len, dtype=np.float64)
+  return np.arange(max_episode_len) / max_episode_len
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------
+def agent_input(env_tag, time, obs):
+  """
+  Input given to a closed loop agent at each step of the episode
+  :param env_tag: Name of the environment
+  :param time: Time input of the step, as given by time_inputs
+  :param obs: Observation of the env. For a batch of agents, the [n, obs_size] observations of their envs
+  :return: List of inputs of the agent
+  """
+  if 'FastsimSimpleNavigation' in env_tag:
+    return [time, obs] # Observation and time. The time is used to see when to stop the action. TODO move the action stopping outside of the agent
+  return [time]
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------
+def run_episode(env, agent, env_tag, max_episode_len, seed=None, render=False):
+  """
+  Evaluates the agent for one episode in the environment.
+  :param env: Environment
+  :param agent: Agent to evaluate
+  :param env_tag: Name of the environment
+  :param max_episode_len: Maximum length of the episode
+  :param seed: Seed of the rollout. If given, the env and the global numpy generator are seeded with it. The state of
+               the global generator is restored at the end of the episode.
+  :param render: If true the final frame of the episode is rendered
+  :return: Dict with the final image, the bs, the cumulated reward, the number of steps, the done flag of the env and
+           the final info
+  """
+  if seed is not None:
+    rnd_state = np.random.get_state()
+    np.random.seed(seed)
+    env.seed(seed)
+
+  done = False
+  env_done = False
+  cumulated_reward = 0
+
+  # Open loop agents are evaluated for the whole episode at once, and the rollout only looks up their actions
+  # After the last action the env is told that the actuation is over, so that it can end the episode when at rest
+  actions = None
+  actuation_steps = None
+  inputs = time_inputs(env_tag, max_episode_len)
+  if agent.open_loop and 'FastsimSimpleNavigation' not in env_tag:
+    actions = agent.trajectory(inputs)
+    if hasattr(getattr(env, 'unwrapped', env), 'stop_actuation'):
+      actuation_steps = agent.actuation_steps(inputs)
+
+  obs = env.reset()
+  t = 0
+  # Envs that can run a whole sequence of actions in one call get the trajectory of the agent in two chunks, before and
+  # after the end of the actuation
+  unwrapped = getattr(env, 'unwrapped', env)
+  if actions is not None and hasattr(unwrapped, 'step_many'):
+    actions = np.array([utils.action_formatting(env_tag, [action]) for action in actions[:max_episode_len]])
+    split = len(actions) if actuation_steps is None else min(actuation_steps, len(actions))
+    for chunk in [actions[:split], actions[split:]]:
+      if t == actuation_steps:
+        unwrapped.stop_actuation()
+      if not len(chunk):
+        continue
+      start = unwrapped.steps
+      obs, reward, env_done, info = unwrapped.step_many(chunk)
+      t += unwrapped.steps - start
+      cumulated_reward += reward
+      if env_done:
+        break
+    done = True
+
+  while not done:
+    if t == actuation_steps:
+      getattr(env, 'unwrapped', env).stop_actuation()
+    if actions is not None:
+      output = [actions[t]]
+    else:
+      output = agent(agent_input(env_tag, inputs[t], obs))
+    action = utils.action_formatting(env_tag, output)
+
+    obs, reward, env_done, info = env.step(action)
+    done = env_done
+    t += 1
+    cumulated_reward += reward
+
+    if t >= max_episode_len:
+      done = True
+
+    if 'Ant' in env_tag:
+      CoM = np.array([env.robot.body_xyz[:2]])
+      if np.any(np.abs(CoM) >= np.array([3, 3])):
+        done = True
+
+  image = None
+  if render:
+    try:
+      image = env.render(mode='rgb_array', top_bottom=True)
+    except TypeError:
+      image = env.render(mode='rgb_array')
+
+  result = {'image': image,
+            'bs': utils.extact_hd_bs(env, obs, reward, done, info),
+            'reward': cumulated_reward,
+            'steps': t,
+            'done': env_done,
+            'info': info}
+
+  if seed is not None:
+    np.random.set_state(rnd_state)
+  return result
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------
+def run_vec_episodes(vec_env, agents, env_tag, max_episode_len, seeds=None, render=False):
+  """
+  Evaluates the agents in lockstep in the vectorized env, one episode each. The env must not reset automatically the
+  envs that are done. The agents are evaluated in chunks of vec_env.num_envs. Closed loop agents are evaluated together
+  with a FFNeuralPopulation, and receive the same inputs of run_episode, with the observations of their tables
+  flattened in [len(chunk), obs_size] rows.
+  :param vec_env: Vectorized environment
+  :param agents: Agents to evaluate
+  :param env_tag: Name of the environment
+  :param max_episode_len: Maximum length of the episodes
+  :param seeds: Seeds of the rollouts of the agents
+  :param render: If true the final frame of each episode is rendered
+  :return: List of dicts with the same results of run_episode
+  """
+  results = []
+  num_envs = vec_env.num_envs
+  for start in range(0, len(agents), num_envs):
+    chunk = agents[start:start + num_envs]
+    if seeds is not None:
+      chunk_seeds = list(seeds[start:start + num_envs])
+      vec_env.seed(chunk_seeds + [None] * (num_envs - len(chunk)))
+
+    obs = vec_env.reset()
+    cumulated_reward = np.zeros(num_envs)
+    infos = [{} for _ in range(num_envs)]
+    env_done = np.zeros(num_envs, dtype=bool)
+    steps = np.zeros(num_envs, dtype=int)
+    action = np.zeros((num_envs, 2))
+    inputs = time_inputs(env_tag, max_episode_len)
+    # Open loop agents are precomputed for the whole episode, the closed loop ones are evaluated all together each step
+    open_loop = all(agent.open_loop for agent in chunk)
+    if open_loop:
+      trajectories = np.stack([agent.trajectory(inputs) for agent in chunk])
+    else:
+      policy = agents_lib.FFNeuralPopulation(chunk)
+    for t in range(max_episode_len):
+      if open_loop:
+        output = trajectories[:, t]
+      else:
+        # The vectorized env returns a tuple of [num_envs, ...] arrays, that are joined in one row per table
+        table_obs = np.concatenate([np.reshape(o, (num_envs, -1)) for o in obs], axis=1)[:len(chunk)]
+        output = policy(agent_input(env_tag, inputs[t], table_obs))
+      action[:len(chunk)] = utils.action_formatting(env_tag, [output])
+
+      running = ~env_done
+      obs, reward, env_done, info = vec_env.step(action)
+      cumulated_reward += reward
+      steps[running] += 1
+      for idx in np.flatnonzero(running):
+        infos[idx] = info[idx]
+      if np.all(env_done[:len(chunk)]):
+        break
+
+    images = vec_env.render(mode='rgb_array') if render else [None] * num_envs
+    for idx in range(len(chunk)):
+      results.append({'image': images[idx],
+                      'bs': obs[0][idx].copy(),
+                      'reward': cumulated_reward[idx],
+                      'steps': steps[idx],
+                      'done': env_done[idx],
+                      'info': infos[idx]})
+  return results
+# ---------------------------------------------------
+
+
+# Each worker process owns an env and an agent, created once when the worker starts
+_worker = {}
+
+# ---------------------------------------------------
+def _init_worker(env_tag, env_kwargs, agent_class, shapes, max_episode_len, render):
+  """
+  Initializes the worker process
+  """
+  _worker['env'] = make_env(env_tag, env_kwargs)
+  _worker['agent'] = agent_class(shapes)
+  _worker['args'] = (env_tag, max_episode_len)
+  _worker['render'] = render
+
+def _run_worker(task):
+  """
+  Evaluates a genome in the worker
+  :param task: (flat genome, seed) tuple
+  :return: The result of the episode
+  """
+  genome, seed = task
+  _worker['agent'].load_flat_genome(genome)
+  return run_episode(_worker['env'], _worker['agent'], *_worker['args'], seed=seed, render=_worker['render'])
+# ---------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+class RolloutCache(object):
+  """
+  LRU cache of the results of the rollouts, keyed by a hash of the genome of the agent, the env and the episode length.
+  Agents that survive unmutated, or clones of other agents, get the stored results without stepping the env.
+  It has to be used only with deterministic envs, where the result of a rollout depends only on the genome.
+  """
+  # ---------------------------------
+  def __init__(self, env_tag, max_episode_len, max_size=1000):
+    """
+    Constructor
+    :param env_tag: Name of the environment
+    :param max_episode_len: Maximum length of the episodes
+    :param max_size: Maximum number of results stored. When full, the least recently used ones are discarded
+    """
+    self.env_tag = env_tag
+    self.max_episode_len = max_episode_len
+    self.max_size = max_size
+    self.results = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+  # ---------------------------------
+
+  # ---------------------------------
+  def key(self, genome):
+    """
+    Calculates the key of a genome
+    :param genome: Flat genome of the agent
+    :return: The key
+    """
+    h = hashlib.blake2b(np.ascontiguousarray(genome, dtype=np.float64).tobytes(), digest_size=16)
+    h.update('{}/{}'.format(self.env_tag, self.max_episode_len).encode())
+    return h.digest()
+  # ---------------------------------
+
+  # ---------------------------------
+  def get(self, key):
+    """
+    Looks up the result of a rollout, updating the hit and miss counters
+    :param key: Key of the genome
+    :return: A copy of the stored result, or None if not present
+    """
+    result = self.results.get(key)
+    if result is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.results.move_to_end(key)
+    return self._copy(result)
+
+  def put(self, key, result):
+    """
+    Stores a copy of the result of a rollout
+    :param key: Key of the genome
+    :param result: Result of the rollout
+    """
+    self.results[key] = self._copy(result)
+    self.results.move_to_end(key)
+    while len(self.results) > self.max_size:
+      self.results.popitem(last=False)
+
+  @staticmethod
+  def _copy(result):
+    """
+    Copies the result, with its arrays and info. The stored results never share their data with the agents, that can
+    make it read-only (see population.share)
+    :param result: Result of a rollout
+    :return: The copy
+    """
+    return {k: v.copy() if isinstance(v, (np.ndarray, dict)) else v for k, v in result.items()}
+  # ---------------------------------
+
+  # ---------------------------------
+  def __len__(self):
+    return len(self.results)
+  # ---------------------------------
+# ---------------------------------------------------------------------------
+
+
+# ---------------------------------------------------------------------------
+class RolloutPool(object):
+  """
+  Evaluates the agents in parallel with a persistent pool of worker processes, each one with its own env. The workers
+  receive only the flat genomes of the agents and return the results of the episodes. With a single worker the agents
+  are evaluated sequentially in the given env, or in lockstep if a vectorized env is given. Each rollout is seeded with
+  rollout_seed, so that the results do not depend on the number of workers. If cache_size > 0, the results are stored
+  in a RolloutCache and the agents whose genome has already been evaluated are not simulated again.
+  """
+  # ---------------------------------
+  def __init__(self, env, env_tag, agent_class, shapes, max_episode_len, seed, workers=1, render=False, vec_env=None,
+               cache_size=0, env_kwargs=None):
+    """
+    Constructor
+    :param env: Environment used to evaluate the agents when there are no workers
+    :param env_tag: Name of the environment
+    :param agent_class: Agent type
+    :param shapes: Parameters for the agents
+    :param max_episode_len: Maximum length of the episodes
+    :param seed: Seed of the experiment
+    :param workers: Number of worker processes
+    :param render: If true the final frame of each episode is rendered
+    :param vec_env: Vectorized env in which to evaluate the agents in lockstep when there are no workers
+    :param cache_size: Number of results kept in the rollout cache. If 0 the cache is not used
+    :param env_kwargs: Arguments used to create the envs of the workers. They should be the same ones of env
+    """
+    self.env = env
+    self.vec_env = vec_env
+    self.env_tag = env_tag
+    self.max_episode_len = max_episode_len
+    self.seed = seed
+    self.render = render
+    self.workers = workers
+    self.pool = None
+    self.cache = RolloutCache(env_tag, max_episode_len, cache_size) if cache_size > 0 else None
+
+    if workers > 1:
+      if mp.current_process().daemon:
+        print('Seed {} - Cannot create rollout workers from a daemonic process. Evaluating sequentially.'.format(seed))
+      else:
+        self.pool = mp.Pool(workers, initializer=_init_worker,
+                            initargs=(env_tag, env_kwargs, agent_class, shapes, max_episode_len, render))
+  # ---------------------------------
+
+  # ---------------------------------
+  def evaluate(self, agents, names):
+    """
+    Evaluates the agents
+    :param agents: List of agents to evaluate
+    :param names: Names of the agents, used to seed the rollouts
+    :return: List with the result of the episode of each agent
+    """
+    if self.cache is None:
+      return self._evaluate(agents, names)
+
+    keys = [self.cache.key(agent.flat_genome) for agent in agents]
+    results = [self.cache.get(key) for key in keys]
+    missing = [idx for idx, result in enumerate(results) if result is None]
+    if missing:
+      new_results = self._evaluate([agents[idx] for idx in missing], [names[idx] for idx in missing])
+      for idx, result in zip(missing, new_results):
+        self.cache.put(keys[idx], result)
+        results[idx] = result
+    return results
+
+  def _evaluate(self, agents, names):
+    """
+    Evaluates the agents, without looking at the cache
+    :param agents: List of agents to evaluate
+    :param names: Names of the agents, used to seed the rollouts
+    :return: List with the result of the episode of each agent
+    """
+    seeds = [rollout_seed(self.seed, name) for name in names]
+    if self.pool is None and self.vec_env is not None:
+      return run_vec_episodes(self.vec_env, agents, self.env_tag, self.max_episode_len, seeds=seeds, render=self.render)
+    if self.pool is None:
+      return [run_episode(self.env, agent, self.env_tag, self.max_episode_len, seed=seed, render=self.render)
+              for agent, seed in zip(agents, seeds)]
+
+    tasks = [(agent.flat_genome, seed) for agent, seed in zip(agents, seeds)]
+    return self.pool.map(_run_worker, tasks, chunksize=max(1, len(tasks) // (4 * self.workers)))
+  # ---------------------------------
+
+  # ---------------------------------
+  @property
+  def cache_stats(self):
+    """
+    Hits and misses of the rollout cache. Both are 0 if the cache is not used
+    """
+    if self.cache is None:
+      return 0, 0
+    return self.cache.hits, self.cache.misses
+  # ---------------------------------
+
+  # ---------------------------------
+  def close(self):
+    """
+    Stops the workers. Following evaluations are done sequentially.
+    """
+    if self.pool is not None:
+      self.pool.close()
+      self.pool.join()
+      self.pool = None
+  # ---------------------------------
+# ---------------------------------------------------------------------------
@@ -0,0 +1,149 @@
+import numpy as np
+import os
+import tempfile
+
+
+# ---------------------------------------------------------------------------
+class StateStore(object):
+  """
+  Append-only store of fixed shape states (e.g. the subsampled images of the archive agents), kept in a memory-mapped
+  file instead of in RAM. Each state is identified by the index of its row, that is what the population keeps.
+  The file is grown geometrically, so that appending a state is amortized O(1).
+  """
+
+  # ---------------------------------
+  def __init__(self, path=None, dtype=np.uint8, capacity=1024):
+    """
+    Constructor
+    :param path: File in which to keep the states. If None a temporary file is used, and deleted when the store is closed
+    :param dtype: Type with which the states are stored. uint8 for images, float16 for float states
+    :param capacity: Number of states for which to preallocate the file
+    """
+    self.temporary = path is None
+    if self.temporary:
+      fd, path = tempfile.mkstemp(suffix='.dat')
+      os.close(fd)
+    self.path = path
+    self.dtype = np.dtype(dtype)
+    self.shape = None # Set when the first states are added
+    self._initial_capacity = max(capacity, 1)
+    self._capacity = 0
+    self._size = 0
+    self._data = None
+
+  def __len__(self):
+    return self._size
+
+  @property
+  def size(self):
+    """
+    Number of stored states
+    """
+    return self._size
+  # ---------------------------------
+
+  # ---------------------------------
+  def _reserve(self, capacity):
+    """
+    Grows the file so that it can contain at least capacity states. The capacity is doubled at each growth.
+    :param capacity: Needed capacity
+    """
+    if capacity <= self._capacity:
+      return
+    new_capacity = max(capacity, 2 * self._capacity, self._initial_capacity)
+    if self._data is not None:
+      self._data.flush()
+    self._data = None
+    with open(self.path, 'ab') as file:
+      file.truncate(new_capacity * int(np.prod(self.shape)) * self.dtype.itemsize)
+    self._data = np.memmap(self.path, dtype=self.dtype, mode='r+', shape=(new_capacity,) + self.shape)
+    self._capacity = new_capacity
+  # ---------------------------------
+
+  # ---------------------------------
+  def append(self, state):
+    """
+    Adds a state at the end of the store
+    :param state: State to add
+    :return: Index of the state
+    """
+    return int(self.extend(np.asarray(state)[None])[0])
+
+  def extend(self, states):
+    """
+    Adds the states at the end of the store
+    :param states: [n, ...] array of states
+    :return: [n] array with the indexes of the states
+    """
+    states = np.asarray(states)
+    if np.issubdtype(self.dtype, np.integer) and np.issubdtype(states.dtype, np.floating):
+      raise ValueError('Float states would be truncated by the {} store. Scale them to integers first'.format(self.dtype))
+    if self.shape is None:
+      self.shape = states.shape[1:]
+    assert states.shape[1:] == self.shape, 'Wrong state shape. Expected {}, got {}'.format(self.shape, states.shape[1:])
+
+    start = self._size
+    self._reserve(start + len(states))
+    self._data[start:start + len(states)] = states
+    self._size += len(states)
+    return np.arange(start, self._size)
+
+  def read(self, indexes=None):
+    """
+    Returns the states with the given indexes. If the indexes are consecutive the states are returned as a slice of the
+    memory-mapped file, without copying them.
+    :param indexes: Indexes of the states. If None all the states are returned
+    :return: [n, ...] array of states
+    """
+    if indexes is None:
+      indexes = np.arange(self._size)
+    indexes = np.asarray(indexes, dtype=np.int64)
+    if len(indexes) == 0:
+      return np.empty((0,) + (self.shape or ()), dtype=self.dtype)
+    assert np.all(indexes >= 0) and np.all(indexes < self._size), 'State index out of range'
+    start = indexes[0]
+    if np.all(indexes == np.arange(start, start + len(indexes))):
+      return np.asarray(self._data[start:start + len(indexes)])
+    return np.asarray(self._data[indexes])
+  # ---------------------------------
+
+  # ---------------------------------
+  def save(self, filepath, indexes=None, chunk=1024):
+    """
+    Saves the states in a .npy file, reading them in chunks so that they are never all in RAM
+    :param filepath: Path of the .npy file
+    :param indexes: Indexes of the states to save, in the order in which they are saved. If None all of them are saved
+    :param chunk: Number of states copied at a time
+    """
+    if indexes is None:
+      indexes = np.arange(self._size)
+    indexes = np.asarray(indexes, dtype=np.int64)
+    out = np.lib.format.open_memmap(filepath, mode='w+', dtype=self.dtype, shape=(len(indexes),) + (self.shape or ()))
+    for start in range(0, len(indexes), chunk):
+      out[start:start + chunk] = self.read(indexes[start:start + chunk])
+    out.flush()
+    del out
+
+  def clear(self):
+    """
+    Removes all the states. The file keeps its size and is overwritten by the new states
+    """
+    self._size = 0
+
+  def close(self):
+    """
+    Releases the memory map, deleting the file if it is temporary
+    """
+    self._data = None
+    self._capacity = 0
+    self._size = 0
+    if self.temporary and os.path.exists(self.path):
+      os.remove(self.path)
+
+  def __del__(self):
+    try:
+      self.close()
+    except Exception:
+      pass
+  # ---------------------------------
+# ---------------------------------------------------------------------------
@@ -0,0 +1,179 @@
+from core.utils import novelty
+import torch
+import numpy as np
+
+np.random.seed(7)
+
+def loop_novelty(points, space, k=15):
+  """
+  Novelty calculated one point at a time
+  """
+  novelties = []
+  for idx, point in enumerate(points):
+    bs_space = np.delete(space, idx, axis=0)
+    diff = np.atleast_2d(bs_space - point)
+    dists = np.sqrt(np.sum(diff * diff, axis=1))
+    if len(dists) <= k:
+      neighs = list(range(len(dists)))
+      kk = len(neighs)
+    else:
+      neighs = np.argpartition(dists, k)
+      kk = k
+    novelties.append(np.mean(dists[neighs[:kk]]))
+  return np.array(novelties)
+
+def test_knn_distances():
+  points = np.random.randn(100, 10)
+  space = np.concatenate([points, np.random.randn(500, 10)])
+  # Small chunks to test the chunking
+  dists, idx = novelty.knn_distances(points, space, 16, max_chunk_elements=space.size * 7)
+  expected = np.sort(np.sqrt(np.sum((space[None] - points[:, None]) ** 2, axis=2)), axis=1)[:, :16]
+  assert np.array_equal(dists, expected), 'Wrong distances with chunking.'
+  assert np.all(idx[:, 0] == np.arange(100)), 'Wrong neighbours with chunking.'
+
+def test_knn_novelty():
+  points = np.random.randn(100, 10)
+  space = np.concatenate([points, np.random.randn(500, 10)])
+  # Small chunks to test the chunking
+  result = novelty.knn_novelty(points, space, k=15, max_chunk_elements=space.size * 7)
+  assert np.array_equal(result, loop_novelty(points, space)), 'Novelty different from the one calculated point by point.'
+
+def test_novelty_few_points():
+  points = np.random.randn(10, 3)
+  cache = novelty.NoveltyCache(novelty.get_index('brute'))
+  result = cache.novelty(np.arange(10), points, k=15)
+  assert np.array_equal(result, loop_novelty(points, points)), 'Wrong novelty with less than k neighbours.'
+
+def test_novelty_float32():
+  # The features given by the metric are float32: the novelty has to be the one of the loop in float32
+  points = np.random.randn(100, 10).astype(np.float32)
+  archive = np.random.randn(500, 10).astype(np.float32)
+  index = novelty.get_index('brute')
+  cache = novelty.NoveltyCache(index)
+  result = cache.novelty(np.arange(100), points, k=15)
+  assert result.dtype == np.float32, 'Novelty not calculated in the type of the features.'
+  assert np.array_equal(result, loop_novelty(points, points)), 'Wrong float32 novelty with empty index.'
+  for batch in np.split(archive, 5):
+    index.add(batch)
+    points[:50] = np.random.randn(50, 10)
+    result = cache.novelty(np.arange(100), points, k=15)
+    expected = loop_novelty(points, np.concatenate([points, archive[:index.size]]))
+    assert np.array_equal(result, expected), 'Float32 novelty different from the one calculated point by point.'
+
+def test_knn_index():
+  points = np.random.randn(50, 10)
+  archive = np.random.randn(1000, 10)
+  expected = loop_novelty(points, np.concatenate([points, archive]))
+  for name in ['brute', 'kdtree']:
+    index = novelty.get_index(name)
+    # Adding in small batches tests both the tree and the buffer of the KD-tree
+    for batch in np.split(archive, 20):
+      index.add(batch)
+    assert index.size == len(archive), 'Wrong {} index size.'.format(name)
+    cache = novelty.NoveltyCache(index)
+    assert np.allclose(cache.novelty(np.arange(50), points, k=15), expected), 'Wrong novelty from {} index.'.format(name)
+
+    dists, idx = index.query(points, k=5)
+    brute_dists = np.sort(np.sqrt(np.sum((archive[None] - points[:, None]) ** 2, axis=2)), axis=1)[:, :5]
+    assert np.allclose(dists, brute_dists), 'Wrong neighbours from {} index.'.format(name)
+    assert np.allclose(np.linalg.norm(archive[idx] - points[:, None], axis=2), dists), 'Wrong neighbours indexes from {} index.'.format(name)
+
+    index.rebuild(archive[:10])
+    assert index.size == 10, 'Could not rebuild {} index.'.format(name)
+    result = cache.novelty(np.arange(50), points, k=15)
+    assert np.allclose(result, loop_novelty(points, np.concatenate([points, archive[:10]]))), 'Wrong novelty after rebuilding {} index.'.format(name)
+
+def test_lsh_index():
+  points = np.random.rand(30, 500)
+  archive = np.random.rand(2000, 500)
+  index = novelty.get_index('lsh', tables=16, bits=4, seed=7)
+  for batch in np.split(archive, 4):
+    index.add(batch)
+  assert index.approximate, 'LSH index should be approximate.'
+  assert index.size == len(archive), 'Wrong LSH index size.'
+  assert novelty.knn_recall(index, points, k=15) > 0.5, 'LSH recall too low.'
+
+  # The points in the index always share the buckets with themselves
+  dists, idx = index.query(archive[:10], k=1)
+  assert np.all(idx[:, 0] == np.arange(10)), 'LSH index could not find the indexed points.'
+  assert np.allclose(dists, 0, atol=1e-3), 'Wrong distances from LSH index.'
+
+def test_torch_index():
+  points = np.random.randn(50, 10)
+  archive = np.random.randn(300, 10)
+  index = novelty.get_index('torch', dtype=torch.float64, max_chunk_elements=1000)
+  cache = novelty.NoveltyCache(index)
+  keys = np.arange(50)
+  assert np.allclose(cache.novelty(keys, points, k=15), loop_novelty(points, points)), 'Wrong novelty from empty torch index.'
+  for batch in np.split(archive, 10):
+    index.add(batch)
+  assert index.size == len(archive), 'Wrong torch index size.'
+  assert np.allclose(index.points, archive), 'Wrong points in torch index.'
+  expected = loop_novelty(points, np.concatenate([points, archive]))
+  assert np.allclose(cache.novelty(keys, points, k=15), expected), 'Wrong novelty from torch index.'
+  dists, idx = index.query(points, k=5)
+  assert np.allclose(dists, novelty.knn_distances(points, archive, 5)[0]), 'Wrong neighbours from torch index.'
+
+def test_torch_novelty_cache():
+  points = np.random.randn(40, 10)
+  archive = np.random.randn(400, 10)
+  keys = np.arange(40)
+  index = novelty.get_index('torch', dtype=torch.float64, max_chunk_elements=1000)
+  cache = novelty.NoveltyCache(index)
+  # The indexed points never have to be moved to the host
+  index.get_points = None
+
+  index.add(archive[:200])
+  cache.novelty(keys, points, k=15)
+  assert all(torch.is_tensor(entry[1]) for entry in cache.entries.values()), 'Cached distances moved to the host.'
+  # Partial cache hits only calculate the distances from the new points, on the device
+  points[20:] = np.random.randn(20, 10)
+  index.add(archive[200:])
+  result = cache.novelty(keys, points, k=15)
+  assert np.allclose(result, loop_novelty(points, np.concatenate([points, archive]))), 'Wrong novelty from torch cache.'
+
+def test_novelty_cache():
+  points = np.random.randn(40, 10)
+  archive = np.random.randn(400, 10)
+  keys = np.arange(40)
+  index = novelty.get_index('kdtree')
+  cache = novelty.NoveltyCache(index)
+  queried = []
+  query = index.query
+  index.query = lambda p, k: queried.append(len(p)) or query(p, k)
+
+  index.add(archive[:200])
+  cache.novelty(keys, points, k=15)
+  # Change half of the points and add new archive points: only the changed points have to query the whole index
+  points[20:] = np.random.randn(20, 10)
+  index.add(archive[200:])
+  result = cache.novelty(keys, points, k=15)
+  assert queried == [40, 20], 'Cached points queried again.'
+  assert np.allclose(result, loop_novelty(points, np.concatenate([points, archive]))), 'Wrong novelty from cache.'
+
+  # After rebuilding the index the cache is not valid anymore
+  archive = archive * 2
+  index.rebuild(archive)
+  result = cache.novelty(keys, points, k=15)
+  assert queried == [40, 20, 40], 'Cache not invalidated by rebuild.'
+  assert np.allclose(result, loop_novelty(points, np.concatenate([points, archive]))), 'Wrong novelty after rebuild.'
+
+def test_novelty_cache_exact():
+  # Over several generations the brute force index gives exactly the novelty of the loop, while the distances of the
+  # KD-tree can differ from those in the last ulp
+  for name, atol in [('brute', 0), ('kdtree', 1e-12)]:
+    index = novelty.get_index(name)
+    cache = novelty.NoveltyCache(index)
+    points = np.random.rand(100, 10)
+    keys = np.arange(100)
+    archive = np.empty((0, 10))
+    for gen in range(10):
+      result = cache.novelty(keys, points, k=15)
+      expected = loop_novelty(points, np.concatenate([points, archive]))
+      assert np.allclose(result, expected, rtol=0, atol=atol), 'Wrong novelty from cached {} index.'.format(name)
+      archive = np.concatenate([archive, points[:50]])
+      index.add(points[:50])
+      changed = np.random.choice(100, 50, replace=False)
+      points, keys = points.copy(), keys.copy()
+      points[changed] = np.random.rand(50, 10)
+      keys[changed] += 1000 * (gen + 1)
@@ -0,0 +1,30 @@
+from core.utils import replay_buffer
+import torch
+import numpy as np
+
+torch.manual_seed(7)
+
+def test_add_clear():
+  buffer = replay_buffer.ReplayBuffer(capacity=4)
+  states = np.random.randint(0, 256, (10, 3, 8, 8), dtype=np.uint8)
+  buffer.add(states[:3])
+  buffer.add(torch.from_numpy(states[3:]))
+  assert len(buffer) == 10 and buffer.data.dtype == torch.uint8, 'Wrong buffer'
+  assert np.array_equal(buffer.data.numpy(), states), 'States lost while growing the buffer'
+
+  allocated = buffer._data.data_ptr()
+  buffer.clear()
+  buffer.add(states[:2])
+  assert buffer._data.data_ptr() == allocated and np.array_equal(buffer.data.numpy(), states[:2]), 'Buffer not reused'
+
+def test_minibatches():
+  first = torch.arange(10)
+  second = torch.arange(10, 25)
+  batches = list(replay_buffer.minibatches([first, second], batch_size=4))
+  assert [len(b) for b in batches] == [4] * 6 + [1], 'Wrong minibatch sizes'
+  assert torch.equal(torch.sort(torch.cat(batches))[0], torch.arange(25)), 'Each state has to be drawn once'
+  assert not torch.equal(torch.cat(batches), torch.arange(25)), 'States not shuffled'
+
+  ordered = torch.cat(list(replay_buffer.minibatches([first], batch_size=3, shuffle=False)))
+  assert torch.equal(ordered, first), 'Wrong order without shuffling'
+  assert len(list(replay_buffer.minibatches([first[:0]]))) == 0, 'Minibatches from empty tensors'
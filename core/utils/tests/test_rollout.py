@@ -0,0 +1,81 @@
+from core.utils import rollout
+from core.evolution import population, agents
+import numpy as np
+import gym
+from gym_billiard.envs import BilliardEnv, VecBilliardEnv
+
+shapes = {'dof': 2, 'degree': 5, 'type': 'poly'}
+
+class DummyEnv(object):
+  """
+  Env in which the agent moves a point, with a random initial position
+  """
+  class spec:
+    id = 'Dummy-v0'
+
+  def seed(self, seed=None):
+    self.rnd = np.random.RandomState(seed)
+
+  def reset(self):
+    self.pose = self.rnd.uniform(-1, 1, 2)
+    return self.pose
+
+  def step(self, action):
+    self.pose = self.pose + np.random.normal(action, 0.01)
+    return self.pose, 0, False, {}
+
+def test_rollout_seeding():
+  pop = population.Population(shapes, agent=agents.DMPAgent, pop_size=5)
+  pool = rollout.RolloutPool(DummyEnv(), 'Dummy-v0', agents.DMPAgent, shapes, max_episode_len=20, seed=7)
+  state = np.random.get_state()[1].copy()
+  results = pool.evaluate(pop['agent'], pop['name'])
+  assert np.array_equal(np.random.get_state()[1], state), 'Rollouts changed the global random state.'
+  assert all(r['steps'] == 20 for r in results), 'Wrong episode length.'
+
+  # Evaluating the agents in a different order gives the same results
+  reversed_results = pool.evaluate(pop['agent'][::-1], pop['name'][::-1])[::-1]
+  for r, rr in zip(results, reversed_results):
+    assert np.array_equal(r['bs'], rr['bs']), 'Rollouts not reproducible.'
+
+def test_rollout_cache():
+  pop = population.Population(shapes, agent=agents.DMPAgent, pop_size=5)
+  pool = rollout.RolloutPool(DummyEnv(), 'Dummy-v0', agents.DMPAgent, shapes, max_episode_len=20, seed=7, cache_size=3)
+  results = pool.evaluate(pop['agent'], pop['name'])
+  assert pool.cache_stats == (0, 5), 'Wrong cache counters.'
+  assert len(pool.cache) == 3, 'Cache size not bounded.'
+
+  # The oldest results have been discarded
+  cached = pool.evaluate([pop['agent'][4], pop['agent'][0]], [pop['name'][4], pop['name'][0]])
+  assert pool.cache_stats == (1, 6), 'Wrong cache counters.'
+  assert np.array_equal(cached[0]['bs'], results[4]['bs']), 'Wrong cached result.'
+
+  # Sharing the data of an agent does not make the stored results read-only
+  pop[4]['bs'] = cached[0]['bs']
+  pop.copy(4, with_data=True)
+  assert not pop[4]['bs'].flags.writeable, 'Shared data not read-only.'
+  assert pool.evaluate([pop['agent'][4]], [pop['name'][4]])[0]['bs'].flags.writeable, 'Cached result made read-only.'
+  assert pool.cache_stats == (2, 6), 'Wrong cache counters.'
+
+  # Clones hit the cache, mutated agents do not
+  clone = pop.copy(4)
+  mutated = pop.copy(3)
+  mutated['agent'].mutate()
+  pool.evaluate([clone['agent'], mutated['agent']], [clone['name'], mutated['name']])
+  assert pool.cache_stats == (3, 7), 'Wrong cache counters.'
+
+def test_lockstep_closed_loop():
+  # 5 agents on 4 tables, so that the last chunk is partial
+  ff_shapes = {'input_shape': 1, 'output_shape': 2}
+  pop = [agents.FFNeuralAgent(ff_shapes) for _ in range(5)]
+  seeds = [rollout.rollout_seed(7, name) for name in range(5)]
+  # Created directly, so that the gym env checker is not involved. The spec is needed to extract the BS
+  env = BilliardEnv()
+  env.spec = gym.spec('Billiard-v0')
+  vec_env = VecBilliardEnv(num_envs=4, auto_reset=False)
+  results = rollout.run_vec_episodes(vec_env, pop, 'Billiard-v0', max_episode_len=50, seeds=seeds)
+  assert len(results) == 5, 'Wrong number of results.'
+  for agent, seed, result in zip(pop, seeds, results):
+    expected = rollout.run_episode(env, agent, 'Billiard-v0', max_episode_len=50, seed=seed)
+    assert np.allclose(result['bs'], expected['bs']), 'Lockstep rollout differs from the sequential one.'
+    assert np.isclose(result['reward'], expected['reward']), 'Wrong lockstep reward.'
+    assert result['steps'] == expected['steps'], 'Wrong lockstep episode length.'
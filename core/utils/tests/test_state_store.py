@@ -0,0 +1,30 @@
+from core.utils import state_store
+import numpy as np
+import pytest
+
+np.random.seed(7)
+
+def test_append_read(tmp_path):
+  store = state_store.StateStore(str(tmp_path / 'states.dat'), capacity=4)
+  states = np.random.randint(0, 256, (10, 3, 8, 8), dtype=np.uint8)
+  assert store.append(states[0]) == 0, 'Wrong index of single state'
+  assert np.all(store.extend(states[1:]) == np.arange(1, 10)), 'Wrong indexes of the states'
+  assert store.size == 10, 'Wrong store size'
+
+  assert np.array_equal(store.read(), states), 'States lost while growing the store'
+  assert np.shares_memory(store.read([2, 3, 4]), store._data), 'Consecutive states have been copied'
+  assert np.array_equal(store.read([7, 1, 7]), states[[7, 1, 7]]), 'Wrong states read'
+
+  store.save(str(tmp_path / 'saved.npy'), [9, 0])
+  assert np.array_equal(np.load(str(tmp_path / 'saved.npy')), states[[9, 0]]), 'Wrong states saved'
+
+  with pytest.raises(ValueError): # Float states would be truncated
+    store.append(np.full((3, 8, 8), .5))
+
+def test_temporary_file():
+  store = state_store.StateStore(dtype=np.float16)
+  store.extend(np.ones((2, 3)) * .5)
+  path = store.path
+  assert store.read().dtype == np.float16 and np.all(store.read() == .5), 'Wrong stored states'
+  store.close()
+  assert not state_store.os.path.exists(path), 'Temporary file not deleted'
@@ -9,4 +9,8 @@ register(
     id='BilliardHard-v0',
     entry_point='gym_billiard.envs:BilliardHardEnv',
     # timestep_limit=1000,
-)
\ No newline at end of file
+)
+register(
+    id='VecBilliard-v0',
+    entry_point='gym_billiard.envs:VecBilliardEnv',
+)
@@ -1,2 +1,3 @@
 from gym_billiard.envs.billiard_env import BilliardEnv
-from gym_billiard.envs.billiard_hard_env import BilliardHardEnv
\ No newline at end of file
+from gym_billiard.envs.billiard_hard_env import BilliardHardEnv
+from gym_billiard.envs.vec_billiard_env import VecBilliardEnv
\ No newline at end of file
@@ -1,8 +1,10 @@
 import gym
 from gym import error, spaces, utils
 from gym.utils import seeding
+import math
 import numpy as np
-from gym_billiard.utils import physics, parameters
+import Box2D as b2
+from gym_billiard.utils import physics, batch_physics, parameters, rasterizer
 
 # TODO implement logger
 
@@ -24,11 +26,33 @@ class BilliardEnv(gym.Env):
               'video.frames_per_second':15
               }
 
-  def __init__(self, seed=None, max_steps=500):
+  def __init__(self, seed=None, max_steps=500, rest_termination=False, render_resolution=None, fidelity='reference',
+               backend='box2d', action_repeat=1):
     self.screen = None
     self.params = parameters.Params()
     self.params.MAX_ENV_STEPS = max_steps
-    self.physics_eng = physics.PhysicsSim()
+    self.params.ACTION_REPEAT = action_repeat
+    self.params.REST_TERMINATION = rest_termination
+    self.params.RENDER_RESOLUTION = render_resolution
+    self.params.set_fidelity(fidelity)
+    self.params.BACKEND = backend
+    self.actuating = True
+    if self.params.BACKEND == 'box2d':
+      self.physics_eng = physics.PhysicsSim(params=self.params)
+    elif self.params.BACKEND == 'numpy':
+      self.physics_eng = batch_physics.BatchPhysicsSim(1, params=self.params)
+    else:
+      raise ValueError('Unknown physics backend {}. Available: box2d, numpy'.format(backend))
+
+    # Holes as plain floats, to check quickly at every step if the ball is in one of them
+    self.holes = [(float(hole['pose'][0]), float(hole['pose'][1]), float(hole['radius'])) for hole in self.physics_eng.holes]
+
+    self.rasterizer = None
+    self.display_rasterizer = None
+    if self.params.RENDER_RESOLUTION is not None:
+      self.rasterizer = rasterizer.Rasterizer(self.params, self.params.RENDER_RESOLUTION)
+    elif self.params.BACKEND == 'numpy':
+      self.rasterizer = rasterizer.Rasterizer(self.params, self.params.DISPLAY_SIZE[::-1])
 
     # Ball XY positions can be between -1.5 and 1.5
     ball_os = spaces.Box(low=np.array([-self.params.TABLE_SIZE[0]/2., -self.params.TABLE_SIZE[1]/2.]),
@@ -52,7 +76,12 @@ class BilliardEnv(gym.Env):
     self.np_random, seed = seeding.np_random(seed)
     return [seed]
 
-  def reset(self, desired_ball_pose=None):
+  def initial_pose(self, desired_ball_pose=None):
+    '''
+    Samples the initial pose of the ball and of the arm
+    :param desired_ball_pose: Ball pose used when the ball pose is not random. If None the default one is used
+    :return: ball pose, joints angles. The joints angles are None if the arm starts in the default pose
+    '''
     if self.params.RANDOM_BALL_INIT_POSE:
 
       init_ball_pose = np.array([self.np_random.uniform(low=-1.2, high=1.2), # x
@@ -67,67 +96,204 @@ class BilliardEnv(gym.Env):
                                   self.np_random.uniform(low=-np.pi * .9, high=np.pi * .9)])    # Joint1
     else:
       init_joint_pose = None
+    return init_ball_pose, init_joint_pose
 
+  def reset(self, desired_ball_pose=None):
+    init_ball_pose, init_joint_pose = self.initial_pose(desired_ball_pose)
     self.physics_eng.reset([init_ball_pose], init_joint_pose)
     self.steps = 0
+    self.actuating = True
     return self._get_obs()
 
-  def _get_obs(self):
+  def stop_actuation(self):
     '''
-    This function returns the state after reading the simulator parameters.
+    Signals that all the following actions of the episode are zero. If REST_TERMINATION is set, from now on the episode
+    ends as soon as the scene is at rest.
     '''
-    ball_pose = self.physics_eng.balls[0].position + self.physics_eng.wt_transform
-    joint0_a = self.physics_eng.arm['jointW0'].angle
-    joint0_v = self.physics_eng.arm['jointW0'].speed
-    joint1_a = self.physics_eng.arm['joint01'].angle
-    joint1_v = self.physics_eng.arm['joint01'].speed
+    self.actuating = False
+
+  def at_rest(self):
+    '''
+    Checks if the scene is at rest: all the dynamic bodies are asleep and the ball is not touching the arm. From here on
+    the ball does not move anymore, so the ball pose, the reward and the rendered image are the same ones of the full
+    episode. The joints are not: the arm is asleep too, but in the full episode it is woken up again every step by the
+    joint motors, and the joint solver keeps nudging the angles by a few float32 ulps (measured < 1e-6 rad, with the
+    speeds staying exactly 0). Waiting for the arm to stay asleep would never end the episode early.
+    If REST_VELOCITY > 0, awake bodies slower than it are considered at rest too, trading exactness for shorter episodes.
+    '''
+    if self.params.BACKEND == 'numpy':
+      return self.physics_eng.at_rest(self.params.REST_VELOCITY)[0]
+    for body in self.physics_eng.world.bodies:
+      if body.type is not b2.b2.dynamicBody:
+        continue
+      if body.awake:
+        if self.params.REST_VELOCITY <= 0:
+          return False
+        if body.linearVelocity.length > self.params.REST_VELOCITY or abs(body.angularVelocity) > self.params.REST_VELOCITY:
+          return False
+      elif self.params.REST_VELOCITY <= 0:
+        for edge in body.contacts:
+          if edge.contact.touching and edge.other.type is b2.b2.dynamicBody:
+            return False
+    return True
+
+  def _ball_pose(self):
+    '''
+    Reads the pose of the ball in table RF
+    '''
+    if self.params.BACKEND == 'numpy':
+      ball_pose = self.physics_eng.ball_pose[0] + self.physics_eng.wt_transform
+    else:
+      ball_pose = self.physics_eng.balls[0].position + self.physics_eng.wt_transform
     if np.abs(ball_pose[0])> 1.5 or np.abs(ball_pose[1]) > 1.5:
       raise ValueError('Ball out of map in position: {}'.format(ball_pose))
+    return ball_pose
+
+  def _get_obs(self):
+    '''
+    This function returns the state after reading the simulator parameters.
+    '''
+    ball_pose = self._ball_pose()
+    if self.params.BACKEND == 'numpy':
+      _, joints_angle, joints_speed = self.physics_eng.read_state()
+      joint0_a, joint1_a = joints_angle[0]
+      joint0_v, joint1_v = joints_speed[0]
+    else:
+      joint0_a = self.physics_eng.arm['jointW0'].angle
+      joint0_v = self.physics_eng.arm['jointW0'].speed
+      joint1_a = self.physics_eng.arm['joint01'].angle
+      joint1_v = self.physics_eng.arm['joint01'].speed
 
     self.state = (np.array([ball_pose[0], ball_pose[1]]), np.array([joint0_a, joint1_a]), np.array([joint0_v, joint1_v]))
     return self.state
 
   def step(self, action):
     # action = np.clip(action, -1, 1)
+    self._simulate(action)
+    #Get state
+    self._get_obs()
+    reward, final, info = self._episode_end(self.state[0])
+    return self.state, reward, final, info
+
+  def step_many(self, actions, observations=False):
+    '''
+    Performs a sequence of steps within a single call, stopping when the episode ends. The state is read only at the
+    end, unless the states of all the steps are requested.
+    :param actions: [T, 2] actions of the steps
+    :param observations: If True the states of all the steps are returned, stacked as [T, 2] arrays
+    :return: state, cumulated reward, done flag and info of the last step
+    '''
+    cumulated_reward = 0
+    final = False
+    info = {}
+    states = []
+    for action in actions:
+      self._simulate(action)
+      if observations:
+        states.append(self._get_obs())
+      reward, final, info = self._episode_end(self._ball_pose())
+      cumulated_reward += reward
+      if final:
+        break
+
+    if observations:
+      state = tuple(np.stack(s) for s in zip(*states)) if states else (np.zeros((0, 2)),) * 3
+    else:
+      state = self._get_obs()
+    return state, cumulated_reward, final, info
 
+  def _simulate(self, action):
+    '''
+    Applies the action for ACTION_REPEAT simulator steps, stopping early if the ball falls in a hole
+    '''
     # Set motor torques
     self.physics_eng.move_joint('jointW0', action[0])
     self.physics_eng.move_joint('joint01', action[1])
     # Simulate timestep
-    self.physics_eng.step()
-    #Get state
-    self._get_obs()
+    for _ in range(self.params.ACTION_REPEAT):
+      self.physics_eng.step()
+      if self.params.ACTION_REPEAT > 1 and self._in_hole(self._ball_pose()):
+        break
+    self.steps += 1
+
+  def _in_hole(self, ball_pose):
+    '''
+    Calculates if distance between the ball's center and the holes' center is smaller than the holes' radius
+    '''
+    x, y = float(ball_pose[0]), float(ball_pose[1])
+    for hole_x, hole_y, radius in self.holes:
+      if math.sqrt((x - hole_x) ** 2 + (y - hole_y) ** 2) <= radius:
+        return True
+    return False
+
+  def _episode_end(self, ball_pose):
+    '''
+    Checks if the episode is over after the last step
+    :param ball_pose: Pose of the ball
+    :return: reward, done flag and info of the step
+    '''
     reward = 0
     info = {}
 
     final = False
     # Check if final state
-    # Calculates if distance between the ball's center and the holes' center is smaller than the holes' radius
-    ball_pose = self.state[0]
-    for hole in self.physics_eng.holes:
-      dist = np.linalg.norm(ball_pose - hole['pose'])
-      if dist <= hole['radius']:
-        final = True
-        reward = 100
-        info['reason'] = 'Ball in hole'
+    if self._in_hole(ball_pose):
+      final = True
+      reward = 100
+      info['reason'] = 'Ball in hole'
 
-    self.steps += 1
     if self.steps >= self.params.MAX_ENV_STEPS:
       final = True
       info['reason'] = 'Max Steps reached: {}'.format(self.steps)
+    elif self.params.REST_TERMINATION and not final and not self.actuating and self.at_rest():
+      final = True
+      info['reason'] = 'Scene at rest'
+    return reward, final, info
 
-    return self.state, reward, final, info
-
-  def render(self, mode='human', **kwargs):
+  def _init_display(self):
+    '''
+    Opens the pygame window, if it is not open yet
+    '''
     import pygame
-
-    if self.screen is None and mode=='human':
+    if self.screen is None:
       self.screen = pygame.display.set_mode((self.params.DISPLAY_SIZE[0], self.params.DISPLAY_SIZE[1]), 0, 32)
       pygame.display.set_caption('Billiard')
       self.clock = pygame.time.Clock()
 
+  def show(self, physics_eng, table=0):
+    '''
+    Shows in the window a table of a numpy simulator. Without Box2D bodies to draw, the scene is rasterized at the
+    resolution of the display.
+    :param physics_eng: Numpy simulator. Can be the batched one of the vectorized env
+    :param table: Table of the simulator to show
+    :return: The pygame screen
+    '''
+    import pygame
+    self._init_display()
+    if self.display_rasterizer is None:
+      self.display_rasterizer = rasterizer.Rasterizer(self.params, self.params.DISPLAY_SIZE[::-1])
+    image = self.display_rasterizer.render(physics_eng, table=table, show_arm=True)
+    pygame.surfarray.blit_array(self.screen, image.swapaxes(0, 1))
+    pygame.display.flip()
+    self.clock.tick(self.params.TARGET_FPS)
+    return self.screen
+
+  def render(self, mode='human', **kwargs):
+    # The headless rasterizer gives directly the low resolution image, without going through pygame
+    if mode=='rgb_array' and self.rasterizer is not None:
+      if self.state is None: return None
+      return self.rasterizer.render(self.physics_eng)
+
+    import pygame
+
+    if mode=='human':
+      self._init_display()
+
     if self.state is None: return None
 
+    if self.params.BACKEND == 'numpy':
+      return self.show(self.physics_eng)
+
     if mode=='human':
       self.screen.fill(pygame.color.THECOLORS["white"])
     elif mode=='rgb_array':
@@ -0,0 +1,173 @@
+import gym
+from gym import spaces
+import numpy as np
+from gym_billiard.envs.billiard_env import BilliardEnv
+from gym_billiard.utils import batch_physics
+
+import logging
+logger = logging.getLogger(__name__)
+
+class VecBilliardEnv(gym.Env):
+  '''
+  Vectorized version of the Billiard env. It holds N independent tables, each with its own physics world, that are
+  stepped together with a single call.
+
+  The state is composed of the stacked states of the N tables:
+  s = ([N, [ball_x, ball_y]], [N, [joint0_angle, joint1_angle]], [N, [joint0_speed, joint1_speed]])
+
+  With auto_reset the tables that are done are reset at the end of the step, and their final state is returned in
+  the info of the table as 'terminal_observation'. Without it, the tables that are done are not simulated anymore
+  until the next reset, so that N episodes can be run in lockstep.
+
+  With the numpy backend all the tables are simulated by a single BatchPhysicsSim, stepped with one call for all of them.
+  '''
+  metadata = {'render.modes': ['human', 'rgb_array'],
+              'video.frames_per_second':15
+              }
+
+  def __init__(self, num_envs=8, seed=None, max_steps=500, auto_reset=True, render_resolution=None, fidelity='reference',
+               backend='box2d', action_repeat=1):
+    self.num_envs = num_envs
+    self.auto_reset = auto_reset
+    # With the numpy backend the envs are only used to sample the initial poses and to render the tables
+    self.envs = [BilliardEnv(max_steps=max_steps, render_resolution=render_resolution, fidelity=fidelity, backend=backend,
+                             action_repeat=action_repeat) for _ in range(num_envs)]
+    self.params = self.envs[0].params
+    self.physics_eng = None
+    if self.params.BACKEND == 'numpy':
+      self.physics_eng = batch_physics.BatchPhysicsSim(num_envs, params=self.params)
+
+    self.observation_space = spaces.Tuple([spaces.Box(low=np.stack([s.low] * num_envs), high=np.stack([s.high] * num_envs),
+                                                      dtype=np.float32) for s in self.envs[0].observation_space])
+    self.action_space = spaces.Box(low=-np.ones((num_envs, 2)), high=np.ones((num_envs, 2)), dtype=np.float32)
+
+    self.holes_pose = np.stack([hole['pose'] for hole in self.envs[0].physics_eng.holes])
+    self.holes_radius = np.array([hole['radius'] for hole in self.envs[0].physics_eng.holes])
+
+    self.balls = np.zeros((num_envs, 2))
+    self.joints_angle = np.zeros((num_envs, 2))
+    self.joints_vel = np.zeros((num_envs, 2))
+    self.steps = np.zeros(num_envs, dtype=int)
+    self.dones = np.zeros(num_envs, dtype=bool)
+    self.seed(seed)
+
+  def seed(self, seed=None):
+    '''
+    Seeds the tables. If seed is a list, each table gets its own seed, otherwise table i gets seed + i
+    '''
+    if seed is None or np.isscalar(seed):
+      seed = [None if seed is None else seed + i for i in range(self.num_envs)]
+    return [env.seed(s)[0] for env, s in zip(self.envs, seed)]
+
+  def reset(self, desired_ball_pose=None):
+    '''
+    Resets all the tables
+    :param desired_ball_pose: Initial ball pose, the same for all the tables
+    '''
+    for idx in range(self.num_envs):
+      self._reset_env(idx, desired_ball_pose)
+    self.dones[:] = False
+    return self._get_obs()
+
+  def _reset_env(self, idx, desired_ball_pose=None):
+    '''
+    Resets the table idx and reads its state
+    '''
+    if self.physics_eng is not None:
+      init_ball_pose, init_joint_pose = self.envs[idx].initial_pose(desired_ball_pose)
+      self.physics_eng.reset([init_ball_pose], init_joint_pose, tables=[idx])
+    else:
+      self.envs[idx].reset(desired_ball_pose)
+    self.steps[idx] = 0
+    self._read_state(idx)
+
+  def _read_state(self, idx):
+    '''
+    Reads the state of table idx from its simulator
+    '''
+    if self.physics_eng is not None:
+      balls_pose, joints_angle, joints_vel = self.physics_eng.read_state()
+      self.balls[idx], self.joints_angle[idx], self.joints_vel[idx] = balls_pose[idx], joints_angle[idx], joints_vel[idx]
+      return
+    physics_eng = self.envs[idx].physics_eng
+    self.balls[idx] = physics_eng.balls[0].position + physics_eng.wt_transform
+    self.joints_angle[idx] = physics_eng.arm['jointW0'].angle, physics_eng.arm['joint01'].angle
+    self.joints_vel[idx] = physics_eng.arm['jointW0'].speed, physics_eng.arm['joint01'].speed
+
+  def _get_obs(self):
+    '''
+    This function returns a copy of the stacked states of the tables.
+    '''
+    return self.balls.copy(), self.joints_angle.copy(), self.joints_vel.copy()
+
+  def step(self, action):
+    '''
+    Steps all the tables that are not done.
+    :param action: [N, 2] array of joints actions
+    :return: stacked states, [N] rewards, [N] done masks, list of N infos
+    '''
+    action = np.reshape(action, (self.num_envs, 2))
+    active = ~self.dones
+    if self.physics_eng is not None:
+      tables = np.flatnonzero(active)
+      self.physics_eng.move_joints(action[tables], tables)
+      # The action is repeated on the tables whose ball did not fall in a hole
+      for _ in range(self.params.ACTION_REPEAT):
+        self.physics_eng.step(tables)
+        if self.params.ACTION_REPEAT > 1:
+          tables = tables[~self._in_hole(self.physics_eng.ball_pose[tables] + self.physics_eng.wt_transform)]
+      self._read_state(np.flatnonzero(active))
+    else:
+      for idx in np.flatnonzero(active):
+        self.envs[idx]._simulate(action[idx])
+        self._read_state(idx)
+    self.steps[active] += 1
+
+    if np.any(np.abs(self.balls) > 1.5):
+      raise ValueError('Ball out of map in position: {}'.format(self.balls[np.any(np.abs(self.balls) > 1.5, axis=1)]))
+
+    in_hole = active & self._in_hole(self.balls)
+    max_steps = active & (self.steps >= self.params.MAX_ENV_STEPS)
+    reward = np.where(in_hole, 100, 0)
+    done = in_hole | max_steps
+
+    info = [{} for _ in range(self.num_envs)]
+    for idx in np.flatnonzero(in_hole):
+      info[idx]['reason'] = 'Ball in hole'
+    for idx in np.flatnonzero(max_steps):
+      info[idx]['reason'] = 'Max Steps reached: {}'.format(self.steps[idx])
+
+    if self.auto_reset:
+      for idx in np.flatnonzero(done):
+        info[idx]['terminal_observation'] = (self.balls[idx].copy(), self.joints_angle[idx].copy(), self.joints_vel[idx].copy())
+        self._reset_env(idx)
+    else:
+      self.dones |= done
+      done = self.dones.copy()
+    return self._get_obs(), reward, done, info
+
+  def _in_hole(self, balls):
+    '''
+    Calculates if distance between the balls' center and the holes' center is smaller than the holes' radius
+    :param balls: [n, 2] poses of the balls
+    :return: [n] mask of the balls in a hole
+    '''
+    holes_dist = np.linalg.norm(balls[:, None] - self.holes_pose[None], axis=2)
+    return np.any(holes_dist <= self.holes_radius, axis=1)
+
+  def render(self, mode='rgb_array', **kwargs):
+    '''
+    Renders the tables. With rgb_array returns the [N, H, W, 3] stacked images of the tables, in human mode shows the
+    first one.
+    '''
+    for idx, env in enumerate(self.envs):
+      env.state = (self.balls[idx], self.joints_angle[idx], self.joints_vel[idx])
+    if self.physics_eng is not None:
+      # The tables are rendered from the batched simulator, with the rasterizer of their env
+      if mode == 'human':
+        # The first table is shown in the window of the first env
+        return self.envs[0].show(self.physics_eng, table=0)
+      return np.stack([env.rasterizer.render(self.physics_eng, table=idx) for idx, env in enumerate(self.envs)])
+    if mode == 'human':
+      return self.envs[0].render(mode, **kwargs)
+    return np.stack([env.render(mode, **kwargs) for env in self.envs])
@@ -0,0 +1,506 @@
+'''
+Vectorized NumPy simulator of the billiard tables, used by the numpy backend of the Billiard envs.
+
+It is an approximation of the Box2D simulator, not a port: the arm is moved kinematically and the ball contacts are
+solved with a simplified sequential impulses solver. Its results are not comparable with the Box2D ones, so runs with
+different backends should not be mixed.
+
+The Box2D constants below are the ones of the Box2D version used by PhysicsSim, while the bodies properties are copied
+from PhysicsSim. The only fitted constant is JOINT0_STIFFNESS, that decides how the arm slides along the walls. It was
+chosen with a sweep over [1, 24], running both simulators on 400 episodes of 300 steps with the smooth random actions
+and the random ball poses of test_batch_physics.py (seeds 0-9), and minimizing the mean absolute error of the joint
+angles along the episodes. The minimum is flat between 12 and 16 (error .027 rad, against .047 rad with 1).
+
+Measured deviation from Box2D on the same episodes:
+- the same balls are hit in 99% of the episodes (97.5% in the worst batch of 40);
+- the final joint angles differ by .008 rad in median, .17 rad at the 90th percentile, given that the arm is stopped
+  differently by the walls;
+- the final pose of the balls that have been hit differs by .15 in median, on a 3x3 table, given that the
+  trajectories diverge after the impacts;
+- the mean displacement of the balls differs by 17% on average, and up to 42%, over batches of 40 episodes.
+test_matches_box2d only checks these statistics loosely on two of the seeds.
+'''
+import numpy as np
+from gym_billiard.utils import parameters
+
+# Constants of the Box2D solver emulated by the batched simulator
+LINEAR_SLOP = 0.005
+POLYGON_RADIUS = 2 * LINEAR_SLOP
+VELOCITY_THRESHOLD = 1.
+BAUMGARTE = 0.2
+MAX_LINEAR_CORRECTION = 0.2
+LINEAR_SLEEP_TOLERANCE = 0.01
+ANGULAR_SLEEP_TOLERANCE = 2. / 180. * np.pi
+TIME_TO_SLEEP = 0.5
+
+# Bodies properties, the same ones used by PhysicsSim
+BALL_DENSITY = .5
+BALL_DAMPING = 1.
+JOINT0_LIMIT = .4 * np.pi
+JOINT1_LIMIT = .9 * np.pi
+# How much more joint0 resists to the walls than joint1, fitted on the Box2D arm (see the module docstring)
+JOINT0_STIFFNESS = 12.
+
+def _rotate(vectors, angles):
+  '''
+  Rotates the [..., 2] vectors by the [...] angles
+  '''
+  cos, sin = np.cos(angles), np.sin(angles)
+  return np.stack([cos * vectors[..., 0] - sin * vectors[..., 1], sin * vectors[..., 0] + cos * vectors[..., 1]], axis=-1)
+
+def _cross(w, r):
+  '''
+  Cross product between the angular velocities w and the [..., 2] vectors r
+  '''
+  return np.stack([-w * r[..., 1], w * r[..., 0]], axis=-1)
+
+class BatchPhysicsSim(object):
+  '''
+  Vectorized simulator of N billiard tables with one ball each, alternative to the Box2D based PhysicsSim. The state of
+  all the tables is kept in arrays, so that they are all stepped with the same NumPy operations.
+
+  The simulation emulates the Box2D one:
+  - the joint motors are strong enough to always track their speed, so the arm moves kinematically within the joint
+    limits and stops when a link would go through a wall. The ball cannot push the arm;
+  - the ball has the same mass, damping, friction and restitution of the Box2D one, and is solved against the walls
+    and the links with sequential impulses, followed by a position correction, with the same tolerances of Box2D.
+    Contacts about to happen during the step are solved speculatively, in place of the continuous collision of Box2D;
+  - the ball falls asleep as the Box2D one does, so that the episodes can end at rest.
+  The trajectories are not the same ones of Box2D, especially after the impacts of the arm, but statistically match.
+  '''
+  def __init__(self, num_tables=1, balls_pose=None, arm_position=None, params=None):
+    '''
+    :param num_tables: Number of tables N
+    :param balls_pose: [N, 2] initial pose of the balls in table RF. If None the balls are in the center
+    :param arm_position: [N, 2] initial angles of the joints. If None the arms are straight
+    :param params: Parameters of the simulation
+    '''
+    if params is None:
+      self.params = parameters.Params()
+    else:
+      self.params = params
+    self.num_tables = num_tables
+    self.dt = self.params.TIME_STEP
+    self.vel_iter = self.params.VEL_ITER
+    self.pos_iter = self.params.POS_ITER
+
+    self.wt_transform = -self.params.TABLE_SIZE / 2. # world RF -> table RF
+    self.tw_transform = self.params.TABLE_SIZE / 2. # table RF -> world RF
+    self._create_holes()
+
+    self.ball_radius = self.params.BALL_RADIUS
+    self.ball_mass = BALL_DENSITY * np.pi * self.ball_radius ** 2
+    self.ball_inertia = .5 * self.ball_mass * self.ball_radius ** 2
+    # Contacts with the walls (left, right, bottom, upper) and with the links. Restitution and friction are mixed as in
+    # Box2D, with the max and the geometric mean
+    self.restitution = np.array([max(self.params.BALL_ELASTICITY, self.params.WALL_ELASTICITY)] * 4 +
+                                [max(self.params.BALL_ELASTICITY, self.params.LINK_ELASTICITY)] * 2)
+    self.friction = np.array([np.sqrt(self.params.BALL_FRICTION * self.params.WALL_FRICTION)] * 4 +
+                             [np.sqrt(self.params.BALL_FRICTION * self.params.LINK_FRICTION)] * 2)
+    self.walls_normal = np.array([[1., 0.], [-1., 0.], [0., 1.], [0., -1.]])
+    self.walls_offset = np.array([self.params.WALL_THICKNESS / 2, -(self.params.TABLE_SIZE[0] - self.params.WALL_THICKNESS / 2),
+                                  self.params.WALL_THICKNESS / 2, -(self.params.TABLE_SIZE[1] - self.params.WALL_THICKNESS / 2)])
+
+    self.arm_base = np.array([self.params.TABLE_SIZE[0] / 2, 0.])
+    self.links_extent = np.array([[self.params.LINK_THICKNESS, self.params.LINK_0_LENGTH / 2],
+                                  [self.params.LINK_THICKNESS, self.params.LINK_1_LENGTH / 2]])
+
+    self.ball_pose = np.zeros((num_tables, 2))
+    self.ball_vel = np.zeros((num_tables, 2))
+    self.ball_spin = np.zeros(num_tables)
+    self.ball_awake = np.ones(num_tables, dtype=bool)
+    self.ball_sleep_time = np.zeros(num_tables)
+    self.arm_angle = np.zeros((num_tables, 2)) # Absolute angle of link0 and angle of link1 relative to link0
+    self.arm_reference = np.zeros((num_tables, 2))
+    self.arm_speed = np.zeros((num_tables, 2))
+    self.arm_sleep_time = np.zeros(num_tables)
+    self.motor_speed = np.zeros((num_tables, 2))
+
+    if balls_pose is None:
+      balls_pose = np.zeros((num_tables, 2))
+    self.reset(balls_pose, arm_position)
+
+  def _create_holes(self):
+    '''
+    Defines the holes in table RF. This ones are not simulated, but just defined as a list of dicts.
+    :return:
+    '''
+    self.holes = [{'pose': np.array([-self.params.TABLE_SIZE[0] / 2, self.params.TABLE_SIZE[1] / 2]), 'radius': .4},
+                  {'pose': np.array([self.params.TABLE_SIZE[0] / 2, self.params.TABLE_SIZE[1] / 2]), 'radius': .4}]
+
+  def reset(self, balls_pose, arm_position=None, tables=None):
+    '''
+    Resets the tables
+    :param balls_pose: [n, 2] initial pose of the balls in table RF
+    :param arm_position: [n, 2] initial angles of the joints. If None the arms are straight
+    :param tables: Indexes of the n tables to reset. If None all the tables are reset
+    :return:
+    '''
+    if tables is None:
+      tables = slice(None)
+    if arm_position is None:
+      arm_position = np.zeros(2)
+    arm_position = np.broadcast_to(arm_position, self.arm_angle[tables].shape)
+
+    self.ball_pose[tables] = np.reshape(balls_pose, (-1, 2)) + self.tw_transform
+    self.ball_vel[tables] = 0.
+    self.ball_spin[tables] = 0.
+    self.ball_awake[tables] = True
+    self.ball_sleep_time[tables] = 0.
+    # The joint angles are measured from the initial pose, as the Box2D joints do
+    self.arm_angle[tables, 0] = arm_position[:, 0]
+    self.arm_angle[tables, 1] = arm_position[:, 1] - arm_position[:, 0]
+    self.arm_reference[tables] = self.arm_angle[tables]
+    self.arm_speed[tables] = 0.
+    self.arm_sleep_time[tables] = 0.
+    self.motor_speed[tables] = 0.
+
+  def move_joint(self, joint, value):
+    '''
+    Sets the speed of a joint motor of all the tables
+    :param joint: Either 'jointW0' or 'joint01'
+    :param value: Scalar or [N] action
+    '''
+    idx = ['jointW0', 'joint01'].index(joint)
+    speed = self.motor_speed[:, idx]
+    if self.params.TORQUE_CONTROL:
+      speed = speed + value * self.dt
+    else:
+      speed = np.broadcast_to(value, speed.shape)
+
+    # Limit max joint speed
+    self.motor_speed[:, idx] = np.clip(speed, -1, 1)
+
+  def move_joints(self, actions, tables=None):
+    '''
+    Sets the speed of the joint motors
+    :param actions: [n, 2] actions
+    :param tables: Indexes of the n tables. If None the actions are for all the tables
+    '''
+    if tables is None:
+      tables = slice(None)
+    speed = self.motor_speed[tables]
+    if self.params.TORQUE_CONTROL:
+      speed = speed + actions * self.dt
+    else:
+      speed = actions
+    self.motor_speed[tables] = np.clip(speed, -1, 1)
+
+  def links_pose(self, arm_angle):
+    '''
+    Computes the pose of the links
+    :param arm_angle: [n, 2] joint angles
+    :return: [n, 2, 2] centers of the links, [n, 2] absolute angles of the links and [n, 2] position of joint01
+    '''
+    angles = np.stack([arm_angle[:, 0], arm_angle[:, 0] + arm_angle[:, 1]], axis=1)
+    joint01 = self.arm_base + _rotate(np.array([0., self.params.LINK_0_LENGTH]), angles[:, 0])
+    # The links overlap by .1 around joint01
+    link0 = self.arm_base + _rotate(np.array([0., self.params.LINK_0_LENGTH / 2]), angles[:, 0])
+    link1 = joint01 + _rotate(np.array([0., self.params.LINK_1_LENGTH / 2 - .1]), angles[:, 1])
+    return np.stack([link0, link1], axis=1), angles, joint01
+
+  def links_vertices(self, arm_angle):
+    '''
+    Computes the vertices of the links
+    :param arm_angle: [n, 2] joint angles
+    :return: [n, 2, 4, 2] vertices of the links, in counterclockwise order
+    '''
+    centers, angles, _ = self.links_pose(arm_angle)
+    corners = np.array([[-1., -1.], [1., -1.], [1., 1.], [-1., 1.]])
+    local = corners[None] * self.links_extent[:, None] # [2, 4, 2]
+    return centers[:, :, None] + _rotate(local[None], angles[:, :, None])
+
+  def _move_arm(self, tables):
+    '''
+    Moves the arms with the speed of the motors. The joints stop at their limits. When link1 would go through a wall,
+    joint1 is pushed back as the weaker motor is in Box2D, so that link1 slides along the wall. The arms that cannot
+    move without going through the walls, or without pushing a ball through them, do not move.
+    :return: [n, 2] new joint angles
+    '''
+    angle = self.arm_angle[tables]
+    target = angle + self.dt * self.motor_speed[tables]
+    target[:, 0] = np.clip(target[:, 0], -JOINT0_LIMIT, JOINT0_LIMIT)
+    target[:, 1] = np.clip(target[:, 1], -JOINT1_LIMIT, JOINT1_LIMIT)
+
+    new_angle = target.copy()
+    blocked = np.flatnonzero(~self._link1_free(target[:, 0, None], target[:, 1, None])[:, 0])
+    if len(blocked):
+      # Both joints give way, joint1 more than the stronger joint0. The free pose closest to the targets is chosen, with
+      # joint0 going back at most to its previous angle and joint1 moving up to .15 rad from its target. The search is
+      # done on a coarse grid, and then refined on joint1
+      back = np.linspace(0, 1, 5)
+      offsets = np.arange(-10, 11) * .015
+      candidates0 = target[blocked, 0, None] + back * (angle[blocked, 0] - target[blocked, 0])[:, None]
+      candidates0 = np.repeat(candidates0, len(offsets), axis=1)
+      candidates1 = target[blocked, 1, None] + np.tile(offsets, len(back))
+      best0, best1, found = self._closest_free(target[blocked], candidates0, candidates1)
+      refine = np.arange(-2, 3) * .005
+      candidates0 = np.repeat(best0[:, None], len(refine), axis=1)
+      candidates1 = best1[:, None] + refine
+      best0, best1, refined = self._closest_free(target[blocked], candidates0, candidates1)
+      new_angle[blocked] = np.stack([best0, best1], axis=1)
+      stuck = blocked[~(found & refined)]
+      new_angle[stuck] = angle[stuck]
+
+    crushed = self._crushes(new_angle, self.ball_pose[tables])
+    new_angle[crushed] = angle[crushed]
+    return new_angle
+
+  def _closest_free(self, target, candidates0, candidates1):
+    '''
+    Selects among the candidate joint angles the one closest to the target in which link1 does not touch the walls
+    :param target: [n, 2] target joint angles
+    :param candidates0: [n, c] candidate angles of joint0
+    :param candidates1: [n, c] candidate angles of joint1
+    :return: [n] best angles of joint0, [n] best angles of joint1, [n] mask of the arms with at least one free candidate
+    '''
+    free = self._link1_free(candidates0, candidates1) & (np.abs(candidates1) <= JOINT1_LIMIT)
+    cost = JOINT0_STIFFNESS * (candidates0 - target[:, 0, None]) ** 2 + (candidates1 - target[:, 1, None]) ** 2
+    best = np.argmin(np.where(free, cost, np.inf), axis=1)
+    rows = np.arange(len(target))
+    return candidates0[rows, best], candidates1[rows, best], np.any(free, axis=1)
+
+  def _link1_free(self, angles0, angles1):
+    '''
+    Checks if link1 is inside the walls
+    :param angles0: [n, c] candidate angles of joint0
+    :param angles1: [n, c] candidate angles of joint1
+    :return: [n, c] mask of the candidates in which link1 does not touch the walls
+    '''
+    # In Box2D the links stop at 2 polygon radii from the walls, minus the slop
+    low = self.params.WALL_THICKNESS / 2 + 2 * POLYGON_RADIUS - LINEAR_SLOP
+    high = self.params.TABLE_SIZE - low
+    joint01_x = self.arm_base[0] - self.params.LINK_0_LENGTH * np.sin(angles0)
+    joint01_y = self.arm_base[1] + self.params.LINK_0_LENGTH * np.cos(angles0)
+    link_angle = angles0 + angles1
+    cos, sin = np.cos(link_angle), np.sin(link_angle)
+    distance = self.params.LINK_1_LENGTH / 2 - .1 # The links overlap by .1 around joint01
+    # Bounding box of link1
+    center_x = joint01_x - distance * sin
+    center_y = joint01_y + distance * cos
+    half_x = np.abs(cos) * self.links_extent[1, 0] + np.abs(sin) * self.links_extent[1, 1]
+    half_y = np.abs(sin) * self.links_extent[1, 0] + np.abs(cos) * self.links_extent[1, 1]
+    return (center_x - half_x >= low) & (center_x + half_x <= high[0]) & \
+           (center_y - half_y >= low) & (center_y + half_y <= high[1])
+
+  def _crushes(self, arm_angle, ball_pose):
+    '''
+    Checks if the links push the balls through the walls they are pressed against
+    :param arm_angle: [n, 2] joint angles
+    :param ball_pose: [n, 2] position of the balls in world RF
+    :return: [n] mask of the arms crushing the balls
+    '''
+    walls_separation = ball_pose @ self.walls_normal.T - self.walls_offset - self.ball_radius - POLYGON_RADIUS
+    pinned = walls_separation <= LINEAR_SLOP
+    crushed = np.zeros(len(ball_pose), dtype=bool)
+    check = np.flatnonzero(np.any(pinned, axis=1))
+    if len(check):
+      normals, separations = self._contacts(ball_pose[check], arm_angle[check])
+      # The links push the balls towards the walls
+      against = np.einsum('nkd,wd->nkw', normals[:, 4:], self.walls_normal) < 0
+      crushed[check] = np.any((separations[:, 4:] < -LINEAR_SLOP) & np.any(against & pinned[check, None], axis=2), axis=1)
+    return crushed
+
+  def _contacts(self, ball_pose, arm_angle):
+    '''
+    Computes the contacts of the balls with the walls and the links
+    :param ball_pose: [n, 2] position of the balls in world RF
+    :param arm_angle: [n, 2] joint angles
+    :return: [n, 6, 2] normals, pointing towards the balls, and [n, 6] separations
+    '''
+    n = len(ball_pose)
+    normals = np.zeros((n, 6, 2))
+    separations = np.zeros((n, 6))
+    radius = self.ball_radius + POLYGON_RADIUS
+
+    normals[:, :4] = self.walls_normal
+    separations[:, :4] = ball_pose @ self.walls_normal.T - self.walls_offset - radius
+
+    centers, angles, _ = self.links_pose(arm_angle)
+    local = _rotate(ball_pose[:, None] - centers, -angles) # Balls in the links RF
+    closest = np.clip(local, -self.links_extent, self.links_extent)
+    outside = local - closest
+    distance = np.linalg.norm(outside, axis=-1)
+    inside = distance == 0
+    # Inside the links the normal is the one of the closest face
+    depth = self.links_extent - np.abs(local)
+    axis = np.argmin(depth, axis=-1)
+    inside_normal = np.where(np.arange(2) == axis[..., None], np.sign(local), 0.)
+    local_normal = np.where(inside[..., None], inside_normal, outside / np.maximum(distance, 1e-12)[..., None])
+    normals[:, 4:] = _rotate(local_normal, angles)
+    separations[:, 4:] = np.where(inside, -np.min(depth, axis=-1), distance) - radius
+    return normals, separations
+
+  def step(self, tables=None):
+    '''
+    Performs a simulator step
+    :param tables: Indexes of the tables to step. If None all the tables are stepped
+    :return:
+    '''
+    if tables is None:
+      tables = np.arange(self.num_tables)
+    dt = self.dt
+    arm_angle = self.arm_angle[tables]
+    new_arm_angle = self._move_arm(tables)
+    arm_speed = (new_arm_angle - arm_angle) / dt
+    arm_still = np.all(np.abs(arm_speed) <= ANGULAR_SLEEP_TOLERANCE, axis=1)
+
+    pose = self.ball_pose[tables]
+    vel = self.ball_vel[tables] / (1. + dt * BALL_DAMPING)
+    spin = self.ball_spin[tables] / (1. + dt * BALL_DAMPING)
+
+    # Contacts at the beginning of the step, included the ones that can happen during it
+    normals, separations = self._contacts(pose, arm_angle)
+    touching_arm = np.any(separations[:, 4:] <= 0, axis=1)
+    awake = self.ball_awake[tables] | touching_arm
+    speed = np.linalg.norm(vel, axis=1) + np.linalg.norm(self.arm_base - pose, axis=1) * np.abs(arm_speed).sum(axis=1)
+    active = awake[:, None] & (separations < (speed[:, None] + 1.) * dt)
+
+    solving = np.flatnonzero(np.any(active, axis=1))
+    if len(solving):
+      vel[solving], spin[solving] = self._solve_velocities(pose[solving], vel[solving], spin[solving],
+                                                          arm_angle[solving], arm_speed[solving], normals[solving],
+                                                          separations[solving], active[solving])
+    vel[~awake] = 0.
+    spin[~awake] = 0.
+    pose = pose + dt * vel
+
+    # Position correction, with the links in their new pose
+    for it in range(self.pos_iter):
+      normals, separations = self._contacts(pose, new_arm_angle)
+      if np.min(separations[awake], initial=0.) >= -3 * LINEAR_SLOP:
+        break
+      correction = np.clip(BAUMGARTE * (separations + LINEAR_SLOP), -MAX_LINEAR_CORRECTION, 0)
+      correction[~awake] = 0.
+      pose -= np.sum(correction[..., None] * normals, axis=1)
+
+    # Sleeping. A ball touching the arm is in its island, so it cannot sleep while the arm moves
+    slow = (np.linalg.norm(vel, axis=1) <= LINEAR_SLEEP_TOLERANCE) & (np.abs(spin) <= ANGULAR_SLEEP_TOLERANCE)
+    touching_arm = np.any(self._contacts(pose, new_arm_angle)[1][:, 4:] <= 0, axis=1)
+    sleep_time = np.where(slow & (~touching_arm | arm_still), self.ball_sleep_time[tables] + dt, 0.)
+    asleep = sleep_time >= TIME_TO_SLEEP
+    vel[asleep] = 0.
+    spin[asleep] = 0.
+
+    self.ball_pose[tables] = pose
+    self.ball_vel[tables] = vel
+    self.ball_spin[tables] = spin
+    self.ball_awake[tables] = awake & ~asleep
+    self.ball_sleep_time[tables] = sleep_time
+    self.arm_angle[tables] = new_arm_angle
+    self.arm_speed[tables] = arm_speed
+    self.arm_sleep_time[tables] = np.where(arm_still, self.arm_sleep_time[tables] + dt, 0.)
+
+  def _solve_velocities(self, pose, vel, spin, arm_angle, arm_speed, normals, separations, active):
+    '''
+    Solves the contacts of the balls with sequential impulses, as the Box2D contact solver does. The walls and the links
+    do not move because of the ball.
+    :return: [n, 2] velocities and [n] angular velocities of the balls after the contacts
+    '''
+    dt = self.dt
+    radius = self.ball_radius
+    nx, ny = normals[..., 0], normals[..., 1]
+    tx, ty = ny, -nx # Tangents
+
+    # Velocity of the contact points on the links. The contact points are at -radius * normal from the ball centers
+    _, _, joint01 = self.links_pose(arm_angle)
+    points = pose[:, None] - radius * normals
+    others_vel = np.zeros_like(normals)
+    others_vel[:, 4] = _cross(arm_speed[:, 0], points[:, 4] - self.arm_base)
+    others_vel[:, 5] = _cross(arm_speed[:, 0], joint01 - self.arm_base) + \
+                       _cross(arm_speed[:, 0] + arm_speed[:, 1], points[:, 5] - joint01)
+    others_n = others_vel[..., 0] * nx + others_vel[..., 1] * ny
+    others_t = others_vel[..., 0] * tx + others_vel[..., 1] * ty
+
+    normal_mass = self.ball_mass
+    tangent_mass = 1. / (1. / self.ball_mass + radius ** 2 / self.ball_inertia)
+
+    # Restitution is applied only to impacts faster than the threshold. Contacts that are not touching yet can
+    # approach until they touch
+    approach = vel[:, None, 0] * nx + vel[:, None, 1] * ny - others_n
+    gap = np.maximum(separations, 0.)
+    impact = (approach < -VELOCITY_THRESHOLD) & (approach * dt <= -gap)
+    target = np.where(impact, -self.restitution * approach, -gap / dt)
+
+    # The tables whose impulses converged are removed from the iterations
+    vel, spin = vel.copy(), spin.copy()
+    rows = np.arange(len(vel))
+    vx, vy, w = vel[:, 0].copy(), vel[:, 1].copy(), spin.copy()
+    normal_impulse = np.zeros_like(separations)
+    tangent_impulse = np.zeros_like(separations)
+    # A table converged when a sweep does not change the velocity of its ball. The impulses can keep growing when the
+    # ball is squeezed between the walls and the arm, that cannot be pushed back
+    tolerance = 1e-6
+    for it in range(self.vel_iter):
+      previous = vx.copy(), vy.copy(), w.copy()
+      for k in np.flatnonzero(np.any(active, axis=0)):
+        # Friction
+        max_friction = self.friction[k] * normal_impulse[:, k]
+        vt = vx * tx[:, k] + vy * ty[:, k] + radius * w - others_t[:, k]
+        new_impulse = np.clip(tangent_impulse[:, k] - tangent_mass * vt, -max_friction, max_friction)
+        impulse = np.where(active[:, k], new_impulse - tangent_impulse[:, k], 0.)
+        tangent_impulse[:, k] += impulse
+        vx += impulse * tx[:, k] / self.ball_mass
+        vy += impulse * ty[:, k] / self.ball_mass
+        w += radius * impulse / self.ball_inertia
+
+        # Normal
+        vn = vx * nx[:, k] + vy * ny[:, k] - others_n[:, k]
+        new_impulse = np.maximum(normal_impulse[:, k] - normal_mass * (vn - target[:, k]), 0.)
+        impulse = np.where(active[:, k], new_impulse - normal_impulse[:, k], 0.)
+        normal_impulse[:, k] += impulse
+        vx += impulse * nx[:, k] / self.ball_mass
+        vy += impulse * ny[:, k] / self.ball_mass
+
+      vel[rows, 0], vel[rows, 1], spin[rows] = vx, vy, w
+      change = np.abs(vx - previous[0]) + np.abs(vy - previous[1]) + radius * np.abs(w - previous[2])
+      running = change >= tolerance
+      if not np.all(running):
+        rows, vx, vy, w = rows[running], vx[running], vy[running], w[running]
+        normal_impulse, tangent_impulse = normal_impulse[running], tangent_impulse[running]
+        active, target = active[running], target[running]
+        nx, ny, tx, ty, others_n, others_t = nx[running], ny[running], tx[running], ty[running], others_n[running], others_t[running]
+        if not len(rows):
+          break
+    return vel, spin
+
+  def read_state(self):
+    '''
+    Reads the state of the tables
+    :return: [N, 2] ball poses in table RF, [N, 2] joint angles and [N, 2] joint speeds
+    '''
+    return self.ball_pose + self.wt_transform, self.arm_angle - self.arm_reference, self.arm_speed.copy()
+
+  def at_rest(self, velocity=0.):
+    '''
+    Checks which tables are at rest
+    :param velocity: If > 0, the bodies slower than this are considered at rest too, otherwise only the asleep ones are
+    :return: [N] boolean mask
+    '''
+    if velocity > 0:
+      ball_still = (np.linalg.norm(self.ball_vel, axis=1) <= velocity) & (np.abs(self.ball_spin) <= velocity)
+      return ball_still & np.all(np.abs(self.arm_speed) <= velocity, axis=1)
+    touching_arm = np.any(self._contacts(self.ball_pose, self.arm_angle)[1][:, 4:] <= 0, axis=1)
+    return ~self.ball_awake & ~touching_arm & (self.arm_sleep_time >= TIME_TO_SLEEP)
+
+  def shapes(self, table=0, static=False):
+    '''
+    Shapes of the bodies of a table, used to render it
+    :param table: Index of the table
+    :param static: If True the shapes of the walls are returned, otherwise the ones of the ball and of the links
+    :return: List of (name, 'circle', center, radius) and (name, 'polygon', vertices, None) in world RF
+    '''
+    if static:
+      half_size = self.params.TABLE_SIZE / 2
+      thickness = self.params.WALL_THICKNESS / 2
+      walls = {'left wall': ((0, half_size[1]), (thickness, half_size[1])),
+               'right wall': ((self.params.TABLE_SIZE[0], half_size[1]), (thickness, half_size[1])),
+               'upper wall': ((half_size[0], self.params.TABLE_SIZE[1]), (half_size[0], thickness)),
+               'bottom wall': ((half_size[0], 0), (half_size[0], thickness))}
+      corners = np.array([[-1., -1.], [1., -1.], [1., 1.], [-1., 1.]])
+      return [(name, 'polygon', np.array(center) + corners * extent, None) for name, (center, extent) in walls.items()]
+
+    vertices = self.links_vertices(self.arm_angle[table:table + 1])[0]
+    return [('ball0', 'circle', self.ball_pose[table], self.ball_radius),
+            ('link0', 'polygon', vertices[0], None),
+            ('link1', 'polygon', vertices[1], None)]
@@ -1,4 +1,11 @@
 import numpy as np
+
+# Solver settings of the physics simulation, from the most accurate to the fastest. The timestep is the same for all
+# of them, so that an env step always corresponds to the same simulated time
+FIDELITY_PROFILES = {'reference': {'VEL_ITER': 100, 'POS_ITER': 100},
+                     'balanced': {'VEL_ITER': 20, 'POS_ITER': 10},
+                     'fast': {'VEL_ITER': 8, 'POS_ITER': 3}}
+
 # Params class
 class Params(object):
   # Define simulation parameters (Might move them to a param file)
@@ -23,8 +30,11 @@ class Params(object):
     self.WALL_ELASTICITY = .95
     self.WALL_FRICTION = .9
 
-    self.VEL_ITER = 100
-    self.POS_ITER = 100
+    self.FIDELITY = 'reference'
+    self.set_fidelity(self.FIDELITY)
+    # Physics simulator: 'box2d' for the PhysicsSim one, 'numpy' for the vectorized BatchPhysicsSim. The latter only
+    # approximates Box2D, so the results of the two backends are not comparable
+    self.BACKEND = 'box2d'
 
   # Graphic params
     self.PPM = int(min(self.DISPLAY_SIZE)/max(self.TABLE_SIZE))
@@ -33,6 +43,14 @@ class Params(object):
 
     self.MAX_ENV_STEPS = 300
 
+    # If True, once the actuation is stopped the episode ends as soon as the scene is at rest. The final ball pose and
+    # reward are the ones of the full episode, the joint speeds are 0 in both, while the joint angles can differ by
+    # < 1e-6 rad, given that in the full episode the joint motors keep waking the arm up
+    self.REST_TERMINATION = False
+    # Awake bodies slower than this are considered at rest. With 0 only sleeping bodies are at rest, so that the final
+    # state is the one of the full episode up to the joint angles jitter above
+    self.REST_VELOCITY = 0.
+
     self.TORQUE_CONTROL = False
     self.TEST = True
 
@@ -40,3 +58,16 @@ class Params(object):
     self.RANDOM_BALL_INIT_POSE = False
 
     self.SHOW_ARM_IN_ARRAY = False
+    # If set, the rgb_array images are rendered without pygame at this resolution. Either an int or a (height, width) tuple
+    self.RENDER_RESOLUTION = None
+
+  def set_fidelity(self, profile):
+    '''
+    Sets the solver iterations of the given fidelity profile
+    :param profile: Name of the profile, one of FIDELITY_PROFILES
+    '''
+    if profile not in FIDELITY_PROFILES:
+      raise ValueError('Unknown fidelity profile {}. Available: {}'.format(profile, list(FIDELITY_PROFILES)))
+    self.FIDELITY = profile
+    for name, value in FIDELITY_PROFILES[profile].items():
+      setattr(self, name, value)
@@ -1,5 +1,4 @@
 import Box2D as b2
-import pygame
 import numpy as np
 from gym_billiard.utils import parameters
 from pprint import pprint
@@ -9,6 +8,7 @@ from pprint import pprint
 
 # Extend polygon shape with drawing function
 def draw_polygon(polygon, body, screen, params, color):
+  import pygame
   vertices = [(body.transform * v) * params.PPM for v in polygon.vertices]
   vertices = [(v[0], params.DISPLAY_SIZE[1] - v[1]) for v in vertices]
   pygame.draw.polygon(screen, color, vertices)
@@ -17,6 +17,7 @@ b2.b2.polygonShape.draw = draw_polygon
 
 # Extend circle shape with drawing function
 def my_draw_circle(circle, body, screen, params, color):
+  import pygame
   position = body.transform * circle.pos * params.PPM
   position = (position[0], params.DISPLAY_SIZE[1] - position[1])
   pygame.draw.circle(screen,
@@ -171,8 +172,19 @@ class PhysicsSim(object):
                                            friction=self.params.LINK_FRICTION,
                                            restitution=self.params.LINK_ELASTICITY))
 
+    self.arm = {'link0': link0, 'link1': link1}
+    self._create_arm_joints(arm_pose)
+    self.arm_position = None if arm_position is None else np.array(arm_position)
+
+  def _create_arm_joints(self, arm_pose):
+    '''
+    Creates the joints of the arm. The reference angles and the limits of the joints depend on the pose of the links at
+    creation time, so the links must already be in the initial arm pose.
+    :param arm_pose: Arm pose, as given by _calculate_arm_pose
+    :return:
+    '''
     jointW0 = self.world.CreateRevoluteJoint(bodyA=self.walls[3],
-                                             bodyB=link0,
+                                             bodyB=self.arm['link0'],
                                              anchor=self.walls[3].worldCenter,
                                              lowerAngle=-.4 * b2.b2_pi - arm_pose['link0_angle'],
                                              upperAngle=.4 * b2.b2_pi - arm_pose['link0_angle'],
@@ -181,8 +193,8 @@ class PhysicsSim(object):
                                              motorSpeed=0.0,
                                              enableMotor=True)
 
-    joint01 = self.world.CreateRevoluteJoint(bodyA=link0,
-                                             bodyB=link1,
+    joint01 = self.world.CreateRevoluteJoint(bodyA=self.arm['link0'],
+                                             bodyB=self.arm['link1'],
                                              anchor=arm_pose['joint01_center'],
                                              lowerAngle=-b2.b2_pi*0.9 + arm_pose['link0_angle'] - arm_pose['link1_angle'],
                                              upperAngle=b2.b2_pi*0.9 + arm_pose['link0_angle'] - arm_pose['link1_angle'],
@@ -191,7 +203,8 @@ class PhysicsSim(object):
                                              motorSpeed=0.0,
                                              enableMotor=True)
 
-    self.arm = {'link0': link0, 'link1': link1, 'joint01': joint01, 'jointW0': jointW0}
+    self.arm['joint01'] = joint01
+    self.arm['jointW0'] = jointW0
 
   def _create_holes(self):
     '''
@@ -202,6 +215,56 @@ class PhysicsSim(object):
                   {'pose': np.array([self.params.TABLE_SIZE[0] / 2, self.params.TABLE_SIZE[1] / 2]), 'radius': .4}]
 
   def reset(self, balls_pose, arm_position):
+    '''
+    Resets the simulation. The bodies and the joints of the previous episode are reused: their state is restored to
+    the one they would have if they were created again, so the following steps are the same ones of a new simulation.
+    The joints are created again only if the arm pose changes, given that their limits depend on it.
+    :param balls_pose: Initial pose of the balls in table RF
+    :param arm_position: Initial angles of the joints. If None the arm is straight
+    :return:
+    '''
+    if len(balls_pose) != len(self.balls):
+      self._rebuild(balls_pose, arm_position)
+      return
+
+    # Deactivating the bodies destroys their contacts and broadphase proxies, as destroying the bodies would
+    dynamic_bodies = [body for body in self.world.bodies if body.type is b2.b2.dynamicBody]
+    for body in dynamic_bodies:
+      body.active = False
+
+    arm_pose = self._calculate_arm_pose(arm_position)
+    rebuild_joints = not np.array_equal(arm_position, self.arm_position)
+    if rebuild_joints:
+      self.world.DestroyJoint(self.arm['jointW0'])
+      self.world.DestroyJoint(self.arm['joint01'])
+
+    initial_poses = [(pose + self.tw_transform, 0) for pose in balls_pose]
+    initial_poses += [(arm_pose['link0_center'], arm_pose['link0_angle']), (arm_pose['link1_center'], arm_pose['link1_angle'])]
+    # Reactivated in creation order, so that the proxies get the same ids of new bodies
+    for body, (position, angle) in zip(self.balls + [self.arm['link0'], self.arm['link1']], initial_poses):
+      body.transform = (position, angle)
+      body.awake = False # Clears velocities, forces and sleep time
+      body.awake = True
+      body.active = True
+
+    if rebuild_joints:
+      self._create_arm_joints(arm_pose)
+      self.arm_position = None if arm_position is None else np.array(arm_position)
+    else:
+      self.arm['jointW0'].motorSpeed = 0.
+      self.arm['joint01'].motorSpeed = 0.
+
+    # New bodies would look for their contacts before the first step, and would have no impulses to warm start with
+    self.world.contactManager.FindNewContacts()
+    self.world.warmStarting = False
+
+  def _rebuild(self, balls_pose, arm_position):
+    '''
+    Destroys all the dynamic bodies and creates them again
+    :param balls_pose: Initial pose of the balls in table RF
+    :param arm_position: Initial angles of the joints
+    :return:
+    '''
     # Destroy all the bodies
     for body in self.world.bodies:
       if body.type is b2.b2.dynamicBody:
@@ -228,6 +291,7 @@ class PhysicsSim(object):
     '''
     self.world.Step(self.dt, self.vel_iter, self.pos_iter)
     self.world.ClearForces()
+    self.world.warmStarting = True
 
 if __name__ == "__main__":
   phys = PhysicsSim(balls_pose=[[0, 0], [1, 1]])
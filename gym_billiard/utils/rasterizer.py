@@ -0,0 +1,200 @@
+import numpy as np
+import Box2D as b2
+
+def pooling_matrix(size, resolution):
+  '''
+  Matrix that downsamples an axis of size pixels to resolution pixels in the same way of the subsampler of the metrics:
+  an adaptive average pooling to 4 * resolution followed by two average poolings of 2.
+  :param size: Number of pixels of the input
+  :param resolution: Number of pixels of the output
+  :return: [resolution, size] matrix
+  '''
+  samples = 4 * resolution
+  pool = np.zeros((samples, size))
+  for i in range(samples):
+    start = (i * size) // samples
+    end = -((-(i + 1) * size) // samples)
+    pool[i, start:end] = 1. / (end - start)
+  return pool.reshape(resolution, 4, size).mean(axis=1)
+
+def circle_stencil(radius):
+  '''
+  Pixels covered by a filled circle, with the same midpoint algorithm used by pygame.draw.circle
+  :param radius: Integer radius
+  :return: [2 * radius + 1, 2 * radius + 1] boolean mask, centered on the center of the circle
+  '''
+  mask = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=bool)
+  f = 1 - radius
+  ddf_x = 0
+  ddf_y = -2 * radius
+  x = 0
+  y = radius
+  while x < y:
+    if f >= 0:
+      y -= 1
+      ddf_y += 2
+      f += ddf_y
+    x += 1
+    ddf_x += 2
+    f += ddf_x + 1
+    if f >= 0:
+      mask[radius + y - 1, radius - x:radius + x] = True
+      mask[radius - y, radius - x:radius + x] = True
+    mask[radius + x - 1, radius - y:radius + y] = True
+    mask[radius - x, radius - y:radius + y] = True
+  return mask
+
+class Rasterizer(object):
+  '''
+  Headless renderer of the table, that does not need pygame. The scene is rasterized with the same pixel rules of
+  the pygame renderer on the DISPLAY_SIZE grid, which is used as supersampling grid: each pixel of the low resolution
+  image is the weighted average of the samples it covers, with the same weights used by the subsampler of the metrics.
+  Only the bounding box of the dynamic bodies is rasterized at each call, the holes and the walls are done only once.
+
+  The images match the pygame rgb_array rendering downsampled by the metrics within 0.5 of the uint8 range, due to
+  the rounding. The only exception are the links of the arm, drawn only with SHOW_ARM_IN_ARRAY, whose edge pixels can
+  differ from the pygame polygon filling.
+  '''
+  def __init__(self, params, resolution=64):
+    '''
+    :param params: Parameters of the env
+    :param resolution: Size of the image. Either an int or a (height, width) tuple
+    '''
+    self.params = params
+    if np.isscalar(resolution):
+      resolution = (resolution, resolution)
+    self.resolution = tuple(int(r) for r in resolution)
+    self.width, self.height = self.params.DISPLAY_SIZE
+    self.pool_rows = pooling_matrix(self.height, self.resolution[0])
+    self.pool_cols = pooling_matrix(self.width, self.resolution[1])
+
+    self.stencils = {}
+    self.background = None
+    self.background_image = None
+    self.canvas = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+    self.image = np.zeros(self.resolution + (3,))
+
+  def render(self, physics_eng, table=0, show_arm=None):
+    '''
+    Renders the current state of the simulation
+    :param physics_eng: Physics simulator of the env
+    :param table: Table to render, with the batched simulator
+    :param show_arm: If the arm is drawn. If None SHOW_ARM_IN_ARRAY is used
+    :return: [height, width, 3] uint8 image
+    '''
+    if show_arm is None:
+      show_arm = self.params.SHOW_ARM_IN_ARRAY
+    if self.background is None:
+      self.background = np.zeros_like(self.canvas)
+      self._draw_holes(self.background, physics_eng)
+      self._draw_bodies(self.background, physics_eng, static=True, table=table)
+      self.background_image = np.stack([self.pool_rows @ self.background[:, :, c] @ self.pool_cols.T for c in range(3)], axis=2)
+      np.copyto(self.canvas, self.background)
+
+    # The dynamic bodies are drawn on the canvas, that outside of their bounding box is equal to the background
+    np.copyto(self.image, self.background_image)
+    window = self._draw_bodies(self.canvas, physics_eng, static=False, table=table, show_arm=show_arm)
+    if window is not None:
+      rows, cols = window
+      delta = self.canvas[rows, cols].astype(np.float64) - self.background[rows, cols]
+      for c in range(3):
+        self.image[:, :, c] += self.pool_rows[:, rows] @ delta[:, :, c] @ self.pool_cols[:, cols].T
+      self.canvas[rows, cols] = self.background[rows, cols]
+    return np.rint(self.image).astype(np.uint8)
+
+  def _draw_holes(self, canvas, physics_eng):
+    '''
+    Draws the holes, in the same position in which the pygame renderer draws them
+    '''
+    for hole in physics_eng.holes:
+      center = (-hole['pose'] + physics_eng.tw_transform) * self.params.PPM
+      self._fill_circle(canvas, center, hole['radius'] * self.params.PPM, (255, 0, 0))
+
+  def _draw_bodies(self, canvas, physics_eng, static, table=0, show_arm=False):
+    '''
+    Draws the fixtures of the static or of the dynamic bodies
+    :return: The (rows, cols) bounding box of the drawn pixels, None if nothing was drawn
+    '''
+    low = np.array([self.height, self.width])
+    high = np.zeros(2, dtype=int)
+    for obj_name, kind, geometry, radius in self._shapes(physics_eng, static, table):
+      color = (0, 0, 0)
+      if obj_name == 'ball0':
+        color = (0, 0, 255)
+      elif obj_name in ['link0', 'link1']:
+        if not show_arm:
+          continue
+        color = (100, 100, 100)
+      elif 'wall' in obj_name:
+        color = (150, 150, 150)
+
+      if kind == 'circle':
+        rows, cols = self._fill_circle(canvas, self._to_pixels(geometry), radius * self.params.PPM, color)
+      else:
+        rows, cols = self._fill_polygon(canvas, np.array([self._to_pixels(v) for v in geometry]), color)
+      low = np.minimum(low, (rows.start, cols.start))
+      high = np.maximum(high, (rows.stop, cols.stop))
+
+    if np.any(high <= low):
+      return None
+    return slice(low[0], high[0]), slice(low[1], high[1])
+
+  def _shapes(self, physics_eng, static, table):
+    '''
+    Yields the shapes of the static or of the dynamic bodies, as (name, 'circle', center, radius) or
+    (name, 'polygon', vertices, None) in world RF. The Box2D points are kept as b2Vec2.
+    '''
+    if not hasattr(physics_eng, 'world'):
+      yield from physics_eng.shapes(table, static)
+      return
+    for body in physics_eng.world.bodies:
+      if (body.type is b2.b2.staticBody) != static:
+        continue
+      for fixture in body.fixtures:
+        shape = fixture.shape
+        if isinstance(shape, b2.b2CircleShape):
+          yield body.userData['name'], 'circle', body.transform * shape.pos, shape.radius
+        else:
+          yield body.userData['name'], 'polygon', [body.transform * v for v in shape.vertices], None
+
+  def _to_pixels(self, point):
+    '''
+    Transforms a point from world RF to pixels of the DISPLAY_SIZE rendering. The scaling is done on the Box2D vector,
+    in single precision, like the pygame renderer does.
+    '''
+    point = point * self.params.PPM
+    return np.array([point[0], self.height - point[1]])
+
+  def _fill_circle(self, canvas, center, radius, color):
+    '''
+    Fills a circle, truncating center and radius to integers like pygame does
+    :return: The (rows, cols) bounding box of the circle in the canvas
+    '''
+    radius = int(radius)
+    if radius not in self.stencils:
+      self.stencils[radius] = circle_stencil(radius)
+    stencil = self.stencils[radius]
+    x, y = int(center[0]) - radius, int(center[1]) - radius
+    rows = slice(min(max(y, 0), self.height), max(min(y + stencil.shape[0], self.height), 0))
+    cols = slice(min(max(x, 0), self.width), max(min(x + stencil.shape[1], self.width), 0))
+    canvas[rows, cols][stencil[rows.start - y:rows.stop - y, cols.start - x:cols.stop - x]] = color
+    return rows, cols
+
+  def _fill_polygon(self, canvas, vertices, color):
+    '''
+    Fills a convex polygon, including the pixels on its edges
+    :return: The (rows, cols) bounding box of the polygon in the canvas
+    '''
+    vertices = np.floor(vertices)
+    low = np.clip(vertices.min(axis=0), 0, (self.width, self.height)).astype(int)
+    high = np.clip(vertices.max(axis=0) + 1, low, (self.width, self.height)).astype(int)
+    rows, cols = slice(low[1], high[1]), slice(low[0], high[0])
+    y, x = np.mgrid[rows, cols]
+    inside_left = np.ones(x.shape, dtype=bool)
+    inside_right = np.ones(x.shape, dtype=bool)
+    for start, end in zip(vertices, np.roll(vertices, -1, axis=0)):
+      cross = (end[0] - start[0]) * (y - start[1]) - (end[1] - start[1]) * (x - start[0])
+      inside_left &= cross >= 0
+      inside_right &= cross <= 0
+    canvas[rows, cols][inside_left | inside_right] = color
+    return rows, cols
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+from gym_billiard.envs import BilliardEnv, VecBilliardEnv
+from gym_billiard.utils import physics, batch_physics
+
+def smooth_actions(rnd, episodes, steps):
+  '''
+  Smooth random joint speeds, sums of sinusoids like the trajectories of the DMP agents
+  '''
+  t = np.arange(steps)[None, :, None, None] / steps
+  amplitude = rnd.uniform(-1, 1, (episodes, 1, 2, 3))
+  frequency = rnd.uniform(.5, 4, (episodes, 1, 2, 3))
+  phase = rnd.uniform(0, 2 * np.pi, (episodes, 1, 2, 3))
+  return np.clip(np.sum(amplitude * np.sin(2 * np.pi * frequency * t + phase), axis=-1), -1, 1)
+
+def free_balls_pose(rnd, sim):
+  '''
+  Random initial ball poses that do not overlap with the arm
+  '''
+  balls_pose = rnd.uniform(-1.2, 1.2, (sim.num_tables, 2))
+  while True:
+    _, separations = sim._contacts(balls_pose + sim.tw_transform, sim.arm_angle)
+    overlap = np.any(separations[:, 4:] < .05, axis=1)
+    if not np.any(overlap):
+      return balls_pose
+    balls_pose[overlap] = rnd.uniform(-1.2, 1.2, (np.sum(overlap), 2))
+
+def run_box2d(balls_pose, actions):
+  '''
+  Runs the episodes with the Box2D simulator
+  :return: [N, 2] final ball poses and [N, T, 2] joint angles
+  '''
+  sim = physics.PhysicsSim()
+  final_pose = np.zeros_like(balls_pose)
+  joints = np.zeros(actions.shape)
+  for i in range(len(balls_pose)):
+    sim.reset([balls_pose[i]], None)
+    for t in range(actions.shape[1]):
+      sim.move_joint('jointW0', actions[i, t, 0])
+      sim.move_joint('joint01', actions[i, t, 1])
+      sim.step()
+      joints[i, t] = sim.arm['jointW0'].angle, sim.arm['joint01'].angle
+    final_pose[i] = np.array(sim.balls[0].position) + sim.wt_transform
+  return final_pose, joints
+
+def test_batch_step():
+  sim = batch_physics.BatchPhysicsSim(3, balls_pose=[[-.5, .2], [.5, .5], [1., -1.]])
+  sim.move_joints(np.ones((3, 2)))
+  sim.step(tables=[0, 2])
+  balls_pose, joints_angle, joints_speed = sim.read_state()
+  assert np.allclose(balls_pose, [[-.5, .2], [.5, .5], [1., -1.]]), 'The balls moved without being hit'
+  assert np.allclose(joints_angle[[0, 2]], sim.dt) and np.allclose(joints_angle[1], 0), 'Wrong tables stepped'
+  assert np.allclose(joints_speed[[0, 2]], 1), 'Wrong joints speed'
+
+  sim.reset([[.1, .1]], [.2, .3], tables=[1])
+  assert np.allclose(sim.read_state()[0][1], [.1, .1]) and np.allclose(sim.read_state()[1][1], 0), 'Wrong reset'
+  assert np.allclose(sim.read_state()[1][[0, 2]], sim.dt), 'Reset the wrong table'
+
+def test_numpy_backend_env():
+  env = BilliardEnv(max_steps=20, backend='numpy')
+  box2d_env = BilliardEnv(max_steps=20)
+  obs, box2d_obs = env.reset(), box2d_env.reset()
+  for i in range(3):
+    assert np.allclose(obs[i], box2d_obs[i]), 'Wrong initial state'
+  assert np.array_equal(env.render('rgb_array'), box2d_env.render('rgb_array')), 'Wrong rendering'
+  for t in range(20):
+    obs, reward, done, info = env.step([.5, -.5])
+    box2d_obs, _, box2d_done, _ = box2d_env.step([.5, -.5])
+    assert done == box2d_done, 'Wrong done flag'
+  assert np.allclose(obs[0], box2d_obs[0]) and np.allclose(obs[1], box2d_obs[1], atol=1e-3), 'Free arm diverged'
+
+  vec_env = VecBilliardEnv(num_envs=3, max_steps=5, auto_reset=False, backend='numpy', render_resolution=16)
+  vec_env.reset()
+  for t in range(8):
+    obs, reward, done, info = vec_env.step(np.ones((3, 2)))
+  assert np.all(done) and np.all(vec_env.steps == 5), 'Done envs have been simulated'
+  assert np.allclose(obs[1], 5 * vec_env.params.TIME_STEP), 'Wrong joint angles'
+  assert vec_env.render().shape == (3, 16, 16, 3), 'Wrong images shape'
+
+def test_numpy_backend_human_render(monkeypatch):
+  monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+  vec_env = VecBilliardEnv(num_envs=2, max_steps=5, auto_reset=False, backend='numpy')
+  env_sim = vec_env.envs[0].physics_eng
+  vec_env.reset()
+  vec_env.step(np.ones((2, 2)))
+  assert vec_env.render(mode='human') is not None, 'Nothing shown'
+  assert vec_env.envs[0].physics_eng is env_sim, 'Rendering changed the simulator of the first env'
+
+  with pytest.raises(ValueError):
+    BilliardEnv(backend='mujoco')
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_matches_box2d(seed):
+  '''
+  The trajectories diverge after the impacts, so the final states are compared statistically
+  '''
+  rnd = np.random.RandomState(seed)
+  episodes = 40
+  actions = smooth_actions(rnd, episodes, 300)
+  sim = batch_physics.BatchPhysicsSim(episodes)
+  balls_pose = free_balls_pose(rnd, sim)
+  sim.reset(balls_pose)
+  for t in range(actions.shape[1]):
+    sim.move_joints(actions[:, t])
+    sim.step()
+  final_pose = sim.read_state()[0]
+  box2d_final_pose, box2d_joints = run_box2d(balls_pose, actions)
+
+  moved = np.linalg.norm(final_pose - balls_pose, axis=1) > 1e-3
+  box2d_moved = np.linalg.norm(box2d_final_pose - balls_pose, axis=1) > 1e-3
+  assert np.mean(moved == box2d_moved) >= .9, 'Different balls have been hit'
+  assert np.allclose(final_pose[~moved & ~box2d_moved], box2d_final_pose[~moved & ~box2d_moved])
+
+  displacement = np.mean(np.linalg.norm(final_pose - balls_pose, axis=1))
+  box2d_displacement = np.mean(np.linalg.norm(box2d_final_pose - balls_pose, axis=1))
+  assert abs(displacement - box2d_displacement) <= .3 * box2d_displacement, 'Different mean displacement of the balls'
+  assert np.median(np.abs(sim.read_state()[1] - box2d_joints[:, -1])) < .05, 'Different arm trajectories'
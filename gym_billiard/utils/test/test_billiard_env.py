@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+from gym_billiard.envs import BilliardEnv
+from gym_billiard.utils import parameters
+
+def test_rest_termination():
+  np.random.seed(11)
+  env = BilliardEnv(max_steps=300, rest_termination=True)
+  full_env = BilliardEnv(max_steps=300)
+  early_ends = 0
+  for episode in range(5):
+    actions = np.zeros((300, 2))
+    actions[:40] = np.random.uniform(-1, 1, (40, 2))
+    results = []
+    for e in [env, full_env]:
+      e.reset()
+      for t in range(300):
+        if t == 40:
+          e.stop_actuation()
+        obs, reward, done, info = e.step(actions[t])
+        if done:
+          break
+      results.append((obs, reward, t + 1, info))
+
+    (obs, reward, steps, info), (full_obs, full_reward, full_steps, _) = results
+    assert np.array_equal(obs[0], full_obs[0]), 'Ball pose differs from the full episode'
+    assert reward == full_reward, 'Reward differs from the full episode'
+    assert np.array_equal(obs[2], full_obs[2]), 'Joint speeds differ from the full episode'
+    assert np.allclose(obs[1], full_obs[1], rtol=0, atol=1e-6), 'Joint angles differ from the full episode'
+    if steps < full_steps:
+      assert info['reason'] == 'Scene at rest', 'Wrong termination reason'
+      assert env.at_rest(), 'Episode ended while the scene was not at rest'
+      early_ends += 1
+  assert early_ends > 0, 'No episode ended early with the scene at rest'
+
+def test_render_resolution():
+  np.random.seed(5)
+  env = BilliardEnv(render_resolution=64)
+  pygame_env = BilliardEnv()
+  for episode in range(3):
+    ball_pose = np.random.uniform(-1.2, 1.2, 2)
+    for e in [env, pygame_env]:
+      e.reset(desired_ball_pose=ball_pose)
+    for t in range(60):
+      action = np.random.uniform(-1, 1, 2)
+      env.step(action)
+      pygame_env.step(action)
+
+    image = env.render(mode='rgb_array')
+    assert image.shape == (64, 64, 3) and image.dtype == np.uint8, 'Wrong image format'
+
+    # Same downsampling of the subsampler of the metrics
+    reference = pygame_env.render(mode='rgb_array').astype(np.float64)
+    rows, cols = env.rasterizer.pool_rows, env.rasterizer.pool_cols
+    reference = np.stack([rows @ reference[:, :, c] @ cols.T for c in range(3)], axis=2)
+    assert np.max(np.abs(image - reference)) <= 0.5, 'Image differs from the pygame rendering'
+
+def test_reset_reuses_world():
+  np.random.seed(3)
+  env = BilliardEnv()
+  rebuilt_env = BilliardEnv()
+  rebuilt_env.physics_eng.reset = rebuilt_env.physics_eng._rebuild
+  link0 = env.physics_eng.arm['link0']
+  for episode in range(6):
+    for e in [env, rebuilt_env]:
+      e.params.RANDOM_ARM_INIT_POSE = episode >= 3
+      e.seed(episode)
+    ball_pose = np.random.uniform(-1.2, 1.2, 2)
+    obs, rebuilt_obs = env.reset(ball_pose), rebuilt_env.reset(ball_pose)
+    for t in range(100):
+      action = np.random.uniform(-1, 1, 2)
+      obs, rebuilt_obs = env.step(action)[0], rebuilt_env.step(action)[0]
+      for s, rs in zip(obs, rebuilt_obs):
+        assert np.array_equal(s, rs), 'Reused world differs from a new one'
+  assert env.physics_eng.arm['link0'] is link0, 'Bodies not reused'
+
+def test_fidelity_profiles():
+  env = BilliardEnv(fidelity='fast')
+  assert env.physics_eng.vel_iter == parameters.FIDELITY_PROFILES['fast']['VEL_ITER'], 'Profile not applied'
+  assert env.physics_eng.pos_iter == parameters.FIDELITY_PROFILES['fast']['POS_ITER'], 'Profile not applied'
+  with pytest.raises(ValueError):
+    BilliardEnv(fidelity='unknown')
+
+def test_step_many():
+  np.random.seed(7)
+  env = BilliardEnv(max_steps=100)
+  step_env = BilliardEnv(max_steps=100)
+  for episode in range(3):
+    actions = np.random.uniform(-1, 1, (120, 2))
+    env.reset()
+    step_env.reset()
+    states, cumulated_reward, done, info = env.step_many(actions, observations=True)
+    for t in range(100):
+      obs, reward, step_done, step_info = step_env.step(actions[t])
+      for s, ss in zip(obs, states):
+        assert np.array_equal(s, ss[t]), 'Different states from the single steps'
+    assert len(states[0]) == env.steps == 100, 'Steps done after the end of the episode'
+    assert done == step_done and info == step_info, 'Different end of the episode'
+
+    env.reset()
+    obs = env.step_many(actions[:50])[0]
+    assert np.array_equal(obs[0], states[0][49]), 'Different final state'
+
+def test_action_repeat():
+  env = BilliardEnv(max_steps=20, action_repeat=3)
+  step_env = BilliardEnv(max_steps=60)
+  env.reset()
+  step_env.reset()
+  for t in range(20):
+    obs, reward, done, info = env.step([.5, -.3])
+    for _ in range(3):
+      step_obs = step_env.step([.5, -.3])[0]
+    for s, ss in zip(obs, step_obs):
+      assert np.array_equal(s, ss), 'Action not repeated'
+  assert done and env.steps == 20, 'Repeated steps counted as env steps'
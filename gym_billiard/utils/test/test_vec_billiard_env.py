@@ -0,0 +1,50 @@
+import numpy as np
+from gym_billiard.envs import BilliardEnv, VecBilliardEnv
+
+def test_vec_step():
+  vec_env = VecBilliardEnv(num_envs=3, max_steps=50)
+  envs = [BilliardEnv(max_steps=50) for _ in range(3)]
+  obs = vec_env.reset()
+  for k, env in enumerate(envs):
+    env_obs = env.reset()
+    for i in range(3):
+      assert np.allclose(obs[i][k], env_obs[i]), 'Wrong initial state'
+
+  actions = np.random.uniform(-1, 1, (50, 3, 2))
+  for t in range(50):
+    obs, reward, done, info = vec_env.step(actions[t])
+    for k, env in enumerate(envs):
+      env_obs, env_reward, env_done, env_info = env.step(actions[t][k])
+      if not done[k]:
+        for i in range(3):
+          assert np.allclose(obs[i][k], env_obs[i]), 'Vectorized env diverged from the single env'
+      assert reward[k] == env_reward, 'Wrong reward'
+      assert done[k] == env_done, 'Wrong done flag'
+
+def test_vec_reset():
+  vec_env = VecBilliardEnv(num_envs=2, max_steps=5, auto_reset=True)
+  vec_env.reset()
+  for t in range(5):
+    obs, reward, done, info = vec_env.step(np.ones((2, 2)))
+  assert np.all(done), 'Envs not done after max steps'
+  assert 'terminal_observation' in info[0], 'Missing terminal observation'
+  assert np.all(vec_env.steps == 0), 'Envs not reset'
+  assert np.allclose(obs[0], [-0.5, 0.2]), 'Envs not reset to initial state'
+
+  vec_env = VecBilliardEnv(num_envs=2, max_steps=5, auto_reset=False)
+  vec_env.reset()
+  for t in range(8):
+    obs, reward, done, info = vec_env.step(np.ones((2, 2)))
+  assert np.all(done) and np.all(vec_env.steps == 5), 'Done envs have been simulated'
+
+def test_vec_action_repeat():
+  vec_env = VecBilliardEnv(num_envs=2, max_steps=10, auto_reset=False, action_repeat=3)
+  env = BilliardEnv(max_steps=10, action_repeat=3)
+  vec_env.reset()
+  env.reset()
+  actions = np.random.uniform(-1, 1, (10, 2, 2))
+  for t in range(10):
+    obs = vec_env.step(actions[t])[0]
+    env_obs = env.step(actions[t][0])[0]
+    for i in range(3):
+      assert np.array_equal(obs[i][0], env_obs[i]), 'Action not repeated'
@@ -0,0 +1,51 @@
+import time
+import numpy as np
+from core.evolution import agents
+from core.utils import rollout
+import gym_billiard
+from gym_billiard.utils import parameters
+
+def benchmark(profiles, genomes=50, max_episode_len=300, seed=7):
+  """
+  Evaluates the same set of DMP agents with each physics fidelity profile of the Billiard, and compares their final
+  ball positions with the ones of the reference profile
+  :param profiles: Names of the profiles to benchmark
+  :param genomes: Number of agents
+  :param max_episode_len: Length of the episodes
+  :param seed: Seed used to generate the agents and the rollouts
+  :return: Dict with, for each profile, the simulated steps per second and the mean and max distance of the final ball
+           positions from the reference ones
+  """
+  shapes = {'dof': 2, 'degree': 5, 'type': 'poly'}
+  rnd_state = np.random.get_state()
+  np.random.seed(seed)
+  agents_list = [agents.DMPAgent(shapes) for _ in range(genomes)]
+  np.random.set_state(rnd_state)
+
+  final_poses = {}
+  results = {}
+  for profile in ['reference'] + [p for p in profiles if p != 'reference']:
+    env = rollout.make_env('Billiard-v0', {'max_steps': max_episode_len, 'fidelity': profile})
+    steps = 0
+    poses = []
+    start = time.perf_counter()
+    for idx, agent in enumerate(agents_list):
+      result = rollout.run_episode(env, agent, 'Billiard-v0', max_episode_len, seed=seed + idx)
+      steps += result['steps']
+      poses.append(result['bs'])
+    elapsed = time.perf_counter() - start
+
+    final_poses[profile] = np.array(poses)
+    deviation = np.linalg.norm(final_poses[profile] - final_poses['reference'], axis=1)
+    results[profile] = {'steps/s': steps / elapsed, 'mean dev': np.mean(deviation), 'max dev': np.max(deviation)}
+  return {profile: results[profile] for profile in profiles}
+
+
+if __name__ == "__main__":
+  genomes = 50
+  results = benchmark(list(parameters.FIDELITY_PROFILES), genomes=genomes)
+
+  print('Final ball position deviation from the reference profile over {} DMP agents'.format(genomes))
+  print('{:<10} {:>10} {:>10} {:>10}'.format('Profile', 'Steps/s', 'Mean dev', 'Max dev'))
+  for profile, res in results.items():
+    print('{:<10} {:>10.0f} {:>10.4f} {:>10.4f}'.format(profile, res['steps/s'], res['mean dev'], res['max dev']))
@@ -77,10 +77,12 @@ class CoverageMap(object):
       raise ValueError('Wrong agent type selected: {}'.format(self.params.qd_agent))
 
     self.pop = population.Population(agent=agent_type, pop_size=0, shapes=self.params.agent_shapes)
-    self.pop.load_pop(os.path.join(load_path, 'models/qd_archive.pkl'))
+    archive_path = os.path.join(load_path, 'models/qd_archive')
+    if not os.path.exists(archive_path): # Archive saved in the legacy pickle format
+      archive_path += '.pkl'
+    self.pop.load_pop(archive_path)
     print('Loaded "{} policies.'.format(len(self.pop)))
-    self.pop.pop.sort_values('name', inplace=True)
-    self.pop.pop.reset_index(drop=True, inplace=True)
+    self.pop.sort('name')
   # -----------------------------------------------
 
   # -----------------------------------------------
@@ -140,7 +142,7 @@ class CoverageMap(object):
     if gen >= len(self.exp_data['archive_size']):
       gen = len(self.exp_data['archive_size']) - 1
     agents_num = self.exp_data['archive_size'][gen]
-    bs = self.pop['bs'].values[:agents_num]
+    bs = self.pop['bs'][:agents_num]
     if 'Fastsim' in self.params.env_tag:
       for k in range(len(bs)):
         bs[k][1] = 600. - bs[k][1]
@@ -153,7 +155,7 @@ class CoverageMap(object):
   # -----------------------------------------------
   def feat_pca(self):
     print('Doing PCA')
-    feats = self.pop['features'].values
+    feats = self.pop['features']
     feats = np.array([k[0] for k in feats])
     self.pca = PCA(n_components=2, whiten=False)
     pca_feat = self.pca.fit_transform(feats)
@@ -172,7 +174,7 @@ class CoverageMap(object):
     np.random.seed(int(self.seed))
     self.env.reset()
 
-    if True:# None in self.pop['bs'].values:
+    if True:# None in self.pop['bs']:
       self.evaluate_agent_xy()
       self.pop.save_pop(os.path.join(folder_name, 'models'), 'archive')
 
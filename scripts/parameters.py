@@ -27,9 +27,27 @@ class Params(object):
     self.parallel = True
     if self.threads == 1:
       self.parallel = False
+    # Processes used to evaluate the agents of each seed. Workers cannot be created when the seeds run in parallel, so
+    # in that case the agents are evaluated sequentially.
+    self.rollout_workers = 1
+    # If > 0 and the env has a vectorized version (Billiard), the agents are evaluated in lockstep on this many tables
+    self.lockstep_envs = 0
+    # If > 0 the results of the rollouts of this many genomes are cached, so that the agents that survive unmutated are
+    # not simulated again. Use only with deterministic envs
+    self.rollout_cache_size = 0
+    # Arguments used to create the env. E.g. {'rest_termination': True} ends the Billiard episodes as soon as the scene
+    # is at rest after the last action of the agent (same ball pose and reward, joint angles within 1e-6 rad of the
+    # full episode), {'render_resolution': 64} renders the final Billiard frames
+    # directly at 64x64 without pygame, {'fidelity': 'fast'} uses fewer solver iterations for the Billiard physics
+    # (see scripts/benchmark_fidelity.py), {'backend': 'numpy'} simulates the lockstep Billiard tables all together
+    # with the vectorized NumPy physics, an approximation of Box2D whose results are not comparable with the Box2D
+    # ones (see gym_billiard/utils/batch_physics.py), and {'action_repeat': 3} applies each action for 3 physics steps
+    self.env_kwargs = {}
 
     self.pop_size = 100
     self.use_archive = True
+    # If true the images of the archive agents are kept in a memory-mapped file in the save folder instead of in RAM
+    self.archive_state_store = False
     self.mutation_rate = 0.9
 
     # Metric
@@ -40,6 +58,19 @@ class Params(object):
     self.per_agent_update = False
     self.train_on_archive = True
     self.update_interval = 30
+    # k-NN index used for the novelty. The brute force index recalculates all the distances at each generation, in the
+    # type of the features (float32 for the metrics), and averages the neighbours in the same order of the original
+    # per-agent loop, so it gives bit-identical values. The other indexes cache the neighbours between generations and
+    # calculate in float64: the KD-tree is faster on low dimensional features, but its novelty differs from the loop by
+    # the float32 rounding (~1e-7) for float32 features, or in the last ulp for float64 ones.
+    # For the high dimensional images of IBD the approximate LSH index is used: more tables give higher recall, more
+    # bits give faster queries.
+    if self.exp == 'IBD':
+      self.novelty_index = 'lsh'
+      self.novelty_index_params = {'tables': 16, 'bits': 10}
+    else:
+      self.novelty_index = 'brute' # 'brute', 'kdtree', 'lsh', 'torch' (on the device of the metric)
+      self.novelty_index_params = {}
   # ---------------------------------------------------------
 
   # ---------------------------------------------------------
@@ -8,7 +8,7 @@ from gym.wrappers import Monitor
 import numpy as np
 from core.metrics import ae, rnd
 from core.evolution import population, agents
-from core.utils import utils
+from core.utils import utils, novelty
 import os
 import matplotlib.pyplot as plt
 from matplotlib import cm
@@ -29,6 +29,7 @@ class Eval(object):
     self.params = None
     self.reeval_bs = reeval_bs
     self.render_test = render_test
+    self.feat_index = None
 
     # Get all the seeds
     self.seeds = list(os.walk(self.folder))[0][1][:1]
@@ -158,7 +159,11 @@ class Eval(object):
       raise ValueError('Wrong agent type selected: {}'.format(self.params.qd_agent))
 
     self.pop = population.Population(agent=agent_type, pop_size=0, shapes=self.params.agent_shapes)
-    self.pop.load_pop(os.path.join(load_path, 'models/qd_archive.pkl'))
+    archive_path = os.path.join(load_path, 'models/qd_archive')
+    if not os.path.exists(archive_path): # Archive saved in the legacy pickle format
+      archive_path += '.pkl'
+    self.pop.load_pop(archive_path)
+    self.feat_index = None
   # -----------------------------------------------
 
   # -----------------------------------------------
@@ -176,16 +181,16 @@ class Eval(object):
       surprise, bs_point, y = self.selector(state)
       bs_point = bs_point.flatten().cpu().data.numpy()
       agent['features'] = [bs_point]
+    self.feat_index = None # Features changed, so the index has to be rebuilt
   # -----------------------------------------------
 
   # -----------------------------------------------
   def _get_closest_agent(self, bs_point):
-    bs_space = np.stack([a[0] for a in self.pop['features'].values])
-    # Get distances
-    diff = np.atleast_2d(bs_space - bs_point)
-    dists = np.sqrt(np.sum(diff * diff, axis=1))
+    if self.feat_index is None: # The index is built once and reused for all the targets
+      self.feat_index = novelty.KDTreeIndex()
+      self.feat_index.rebuild(np.stack([a[0] for a in self.pop['features']]))
     # Get agent with smallest distance in BS space
-    closest_agent = np.argmin(dists)
+    closest_agent = self.feat_index.query(bs_point, k=1)[1][0, 0]
     selected = self.pop[closest_agent]
     # print("Selected agent {}".format(closest_agent))
     return selected
@@ -477,7 +482,10 @@ if __name__ == "__main__":
     raise ValueError('Wrong agent type selected: {}'.format(params.qd_agent))
 
   pop = population.Population(agent=agent_type, pop_size=0, shapes=params.agent_shapes)
-  pop.load_pop(os.path.join(load_path, 'models/qd_archive.pkl'))
+  archive_path = os.path.join(load_path, 'models/qd_archive')
+  if not os.path.exists(archive_path): # Archive saved in the legacy pickle format
+    archive_path += '.pkl'
+  pop.load_pop(archive_path)
   # -----------------------------------------------
 
   # Evaluate archive agents BS points
@@ -535,7 +543,7 @@ if __name__ == "__main__":
   #
   # Get closest agent
   # -----------------------------------------------
-  bs_space = np.stack([a[0] for a in pop['features'].values])
+  bs_space = np.stack([a[0] for a in pop['features']])
   # Get distances
   diff = np.atleast_2d(bs_space - bs_point)
   dists = np.sqrt(np.sum(diff * diff, axis=1))
@@ -666,7 +674,7 @@ if __name__ == "__main__":
   #
   #   # Get K closest agents
   #   # -----------------------------------------------
-  #   bs_space = np.stack([a[0] for a in pop['features'].values])
+  #   bs_space = np.stack([a[0] for a in pop['features']])
   #
   #   # Get distances
   #   diff = np.atleast_2d(bs_space - bs_point)
@@ -21,7 +21,7 @@ torch.backends.cudnn.enabled = False # There is a issue with CUDNN and Pytorch h
 def main(seed, params):
   print('\nTraining with seed {}'.format(seed))
   total_train_time = 0
-  env = gym.make(params.env_tag) # Create environment
+  env = gym.make(params.env_tag, **params.env_kwargs) # Create environment
   # Set seed
   params.seed = seed
   env.seed(seed)
@@ -74,7 +74,7 @@ def main(seed, params):
 
   # Plot coverage
   if evolver.archive is not None:
-    bs_points = np.stack(evolver.archive['bs'].to_list())
+    bs_points = np.stack(evolver.archive['bs'])
   else:
     bs_points = np.concatenate([a['bs'] for a in evolver.population if a['bs'] is not None])
   if 'Ant' in params.env_tag:
@@ -5,6 +5,7 @@ setup(author='Giuseppe Paolo',
       version='0.0.1',
       install_requires=[
             'numpy',
+            'scipy',
             'torch',
             'torchvision',
             'pytest',